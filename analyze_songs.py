@@ -1,6 +1,6 @@
 import pandas as pd
 from collections import Counter, defaultdict
-from app import map_to_parent_genre
+from taxonomy import map_to_parent_genre
 
 def analyze_spotify_data(file_path):
     print(f"Loading data from {file_path}...")
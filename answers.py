@@ -0,0 +1,201 @@
+"""Judging a typed guess against the song being played.
+
+Requiring the exact name as a substring meant one wrong letter failed the
+round, so guesses are matched several ways, loosest last (see
+Answer.matches). Everything on the song's side is worked out ahead of time:
+the library's cleaned artist and title are stored with each song when it
+loads (see quiz_library.prepare_song_data), and an Answer reduces one of
+them to the spacing-free, consonant and distinctive-word forms it's compared
+in. A guess is reduced once and compared against both names.
+"""
+import re
+from collections import Counter
+from difflib import SequenceMatcher
+from functools import lru_cache
+
+from artists import primary_artist
+
+WHOLE_MATCH_RATIO = 0.8    # "alanis morisett" vs "alanis morissette"
+TOKEN_MATCH_RATIO = 0.85   # a single misspelled word
+MIN_TOKEN_LENGTH = 5       # short words like "john" are too common to accept alone
+MIN_SKELETON_LENGTH = 3    # below this, consonants alone collide too easily
+MIN_TIGHT_LENGTH = 4       # shorter names collapse into too many guesses
+
+VOWELS = set('aeiouy')
+
+ANSWER_STOPWORDS = {'the', 'and', 'featuring', 'with', 'their', 'band'}
+
+ANSWER_CACHE_SIZE = 4096   # Reduced names kept; a round's second guess reuses its own
+
+
+# clean_text's passes, in the order they have to run. Each one sees what the
+# last left behind: "fe(x)at" only becomes a "feat" to strip once the aside
+# is gone, so they can't all be one pattern.
+#
+# Dropping apostrophes also settles contractions - "don't" is "dont" - apart
+# from rock 'n' roll, which reads "and". Not before "bout", though: "'bout"
+# loses its apostrophe first, leaving nothing for "'n'" to match.
+APOSTROPHES = re.compile(r"'n'(?!bout)|'")
+PARENTHESES = re.compile(r'\([^)]*\)')
+BRACKETS = re.compile(r'\[[^\]]*\]')
+# Only ever "feat" or "ft": the first alternative wins, even in "featuring"
+FEATURING = re.compile(r'feat\.?|ft\.?', re.IGNORECASE)
+PUNCTUATION = re.compile(r'[^\w\s]')
+
+CLEAN_CACHE_SIZE = 8192    # Names cleaned again and again: titles, credits, search results
+
+
+def _apostrophe(match):
+    return 'and' if len(match.group()) == 3 else ''
+
+
+@lru_cache(maxsize=CLEAN_CACHE_SIZE)
+def clean_text(text):
+    """Clean up text by removing special characters and normalizing spaces."""
+    if "'" in text:
+        text = APOSTROPHES.sub(_apostrophe, text)
+    # Remove text in parentheses, then brackets
+    if '(' in text:
+        text = PARENTHESES.sub('', text)
+    if '[' in text:
+        text = BRACKETS.sub('', text)
+    text = FEATURING.sub('', text)
+    # Special characters become spaces; letters and numbers stay
+    text = PUNCTUATION.sub(' ', text)
+    return ' '.join(text.split())
+
+
+def clean_guess(text):
+    """clean_text for what a player typed. Not cached: a guess is cleaned
+    once, and any string sent in would otherwise be kept.
+    """
+    return clean_text.__wrapped__(text)
+
+
+def cleaned_artist(artist):
+    """A credit as guesses are judged against it: the lead alone, cleaned."""
+    # Only the lead has to be named - guests don't count either way.
+    # Must run before clean_text, which strips the word "featuring" itself.
+    return clean_text(primary_artist(artist).lower())
+
+
+def cleaned_title(song):
+    """A title as guesses are judged against it."""
+    return clean_text(song.lower())
+
+
+class Term:
+    """A string to be scored, with its characters counted once."""
+
+    __slots__ = ('text', 'counts')
+
+    def __init__(self, text):
+        self.text = text
+        self.counts = Counter(text)
+
+
+def similar(a, b, threshold):
+    """Is SequenceMatcher's ratio for Terms `a` and `b` at least `threshold`?
+
+    The same yes or no as scoring them, found sooner. The ratio is twice the
+    matched characters over both lengths, and a pair can't match more than
+    the shorter holds, nor more than the characters they share. So most
+    pairs are turned away on their lengths, or on their counts, before any
+    matching is done at all.
+    """
+    total = len(a.text) + len(b.text)
+    if not total:
+        return threshold <= 1.0
+    if 2.0 * min(len(a.text), len(b.text)) / total < threshold:
+        return False
+    if 2.0 * sum((a.counts & b.counts).values()) / total < threshold:
+        return False
+    return SequenceMatcher(None, a.text, b.text).ratio() >= threshold
+
+
+def consonant_skeleton(value):
+    """The consonants of a name, which survive most phonetic misspellings.
+
+    "tpayne" and "tpain" both reduce to "tpn". Character-similarity scores them
+    at 0.67 and reject them; people type artist names by ear all the time.
+    """
+    return ''.join(c for c in value if c.isalnum() and c not in VOWELS)
+
+
+class Guess:
+    """What a player typed, cleaned, in every form it's compared in."""
+
+    __slots__ = ('text', 'tight', 'skeleton', '_words')
+
+    def __init__(self, cleaned):
+        self.text = Term(cleaned)
+        # Names vary in how they're spaced and hyphenated - T-Pain, T Pain,
+        # tpain - and cleaning turns punctuation into spaces. Comparing without
+        # any spacing judges the letters rather than the styling.
+        self.tight = Term(cleaned.replace(' ', ''))
+        self.skeleton = consonant_skeleton(self.tight.text)
+        self._words = None
+
+    @property
+    def words(self):
+        """Each different word, only counted once some answer asks."""
+        if self._words is None:
+            self._words = [Term(word) for word in dict.fromkeys(self.text.text.split())]
+        return self._words
+
+
+class Answer:
+    """One name that counts as a right answer, ready to judge guesses.
+
+    Built from the cleaned name (cleaned_artist or cleaned_title). Holds no
+    state between guesses, so one can be shared across threads.
+    """
+
+    __slots__ = ('text', 'tight', 'skeleton', 'words')
+
+    def __init__(self, cleaned):
+        self.text = Term(cleaned)
+        self.tight = Term(cleaned.replace(' ', ''))
+        skeleton = consonant_skeleton(self.tight.text)
+        self.skeleton = skeleton if len(skeleton) >= MIN_SKELETON_LENGTH else None
+        # Only words distinctive enough to count on their own
+        self.words = tuple(Term(word) for word in dict.fromkeys(cleaned.split())
+                           if len(word) >= MIN_TOKEN_LENGTH and word not in ANSWER_STOPWORDS)
+
+    def matches(self, guess):
+        """Is the Guess `guess` close enough to count?"""
+        if not guess.text.text or not self.text.text:
+            return False
+
+        # The full name somewhere in the answer
+        if self.text.text in guess.text.text:
+            return True
+
+        # The whole answer, allowing for typos
+        if similar(guess.text, self.text, WHOLE_MATCH_RATIO):
+            return True
+
+        # The same, however it was spaced
+        if len(self.tight.text) >= MIN_TIGHT_LENGTH and self.tight.text in guess.tight.text:
+            return True
+        if similar(guess.tight, self.tight, WHOLE_MATCH_RATIO):
+            return True
+
+        # Spelled by ear: same consonants, different vowels
+        if self.skeleton is not None and self.skeleton == guess.skeleton:
+            return True
+
+        # A distinctive word on its own - surname only, or one word misspelled
+        return any(similar(word, other, TOKEN_MATCH_RATIO)
+                   for word in self.words for other in guess.words)
+
+
+@lru_cache(maxsize=ANSWER_CACHE_SIZE)
+def answer_for(cleaned):
+    """The Answer for a cleaned name, reduced once while it's in use."""
+    return Answer(cleaned)
+
+
+def answer_matches(guess, correct):
+    """Is `guess` close enough to `correct` to count? Both come in cleaned."""
+    return Answer(correct).matches(Guess(guess))
@@ -1,5 +1,6 @@
-from flask import Flask, render_template, request, jsonify, session
+from flask import Blueprint, Flask, render_template, request, jsonify, session
 from werkzeug.middleware.proxy_fix import ProxyFix
+import numpy as np
 import pandas as pd
 import random
 import os
@@ -7,24 +8,37 @@ import html
 import sys
 import logging
 import secrets
-from difflib import SequenceMatcher
+import tempfile
+import threading
+import time
+import hashlib
+import itertools
+import json
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 import library
-from artists import is_female_vocal, primary_artist
-from library import USE_POSTGRES, get_db, sql
-from previews import (EXPIRING_SOURCES, clean_text, get_preview_url,
-                      refresh_preview)
+import migrations
+import snapshot
+from answers import Guess, answer_for, clean_guess, cleaned_artist, cleaned_title
+from artist_index import ArtistIndex
+from artists import primary_artist
+from library import USE_POSTGRES, execute_prepared, get_db
+from library import PLAY_FAILURE_LIMIT
+from lookahead import Lookahead
+from play_reports import PlayReports
+from previews import (EXPIRING_SOURCES, FRESH_FOR, LookupFailed,
+                      find_preview, get_preview_url, preview_cache, refresh_preview,
+                      warm_preview_cache)
+from quiz_library import derivation, prepare_song_data, replayed_weights
+from song_index import SongIndex
 
 # Configure logging
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-
-# Heroku terminates TLS at its router, so Flask sees a plain http request and
-# would write http:// into the share-card image URL. Trusting the forwarded
-# scheme keeps that link https, which is what chat apps will fetch.
-app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1)
+# The quiz's pages and endpoints; create_app puts them on an app
+routes = Blueprint('quiz', __name__)
 
 # Gunicorn imports this module as "app"; running it directly means local dev.
 RUNNING_LOCALLY = __name__ == '__main__'
@@ -62,137 +76,34 @@ def load_secret_key():
     return os.urandom(32)
 
 
-app.secret_key = load_secret_key()
-
-app.config.update(
-    SESSION_COOKIE_SECURE=os.environ.get(
-        'SESSION_COOKIE_SECURE', '0' if RUNNING_LOCALLY else '1'
-    ) != '0',
-    SESSION_COOKIE_HTTPONLY=True,
-    SESSION_COOKIE_SAMESITE='Lax',
-    PERMANENT_SESSION_LIFETIME=1800  # 30 minutes
-)
-
 # Where the library and the leaderboard live is decided in library.py, which
 # picks Postgres when DATABASE_URL is set and SQLite otherwise.
 DB_PATH = library.SQLITE_PATH
 
 MAX_SONGS = 6              # Songs per game
 MAX_GUESSES = 2            # Tries per song; the second one comes with a hint
-MIN_YEAR = 1960            # Songs released before this are left out of the quiz
 MAX_RECENT_SONGS = 50      # Per-player replay memory
 MAX_USERNAME_LENGTH = 32
+MAX_GUESS_LENGTH = 2000    # Characters of a guess read at all; clean_guess is
+                           # quadratic on unclosed brackets
+MAX_ANSWER_LENGTH = 1000   # Characters of a cleaned guess judged; far past any name
 LEADERBOARD_SIZE = 10
 MIN_RECORDED_SCORE = 1     # A game with nothing right doesn't go on the board
 PREVIEW_SEARCH_ATTEMPTS = 5
 
-# How often a song comes up. Two independent pulls, multiplied together:
-#   RECENCY_WEIGHT      what the newest year weighs against the oldest
-#   FEMALE_VOCAL_WEIGHT what a female-fronted song weighs against the rest
-# Set either to 1.0 to switch that pull off.
-RECENCY_WEIGHT = 3.0
-FEMALE_VOCAL_WEIGHT = 2.0
-
-# Genre mapping
-GENRE_MAPPING = {
-    'rock': ['rock', 'alternative rock', 'classic rock', 'hard rock', 'indie rock', 'progressive rock',
-             'psychedelic rock', 'art rock', 'garage rock', 'southern rock', 'rock-and-roll', 'rockabilly',
-             'rock and roll', 'album rock', 'modern rock', 'soft rock', 'yacht rock', 'dance rock',
-             'roots rock', 'post-grunge', 'modern hard rock', 'modern alternative rock', 'baroque pop',
-             'glam rock', 'progressive metal', 'rock en espanol', 'latin rock', 'mexican classic rock',
-             'piano rock', 'surf punk', 'indie surf', 'modern folk rock', 'modern power pop', 'new wave',
-             'electronic rock', 'country rock', 'grunge', 'hair metal', 'blues-rock', 'rock ballads',
-             'rock n roll', 'acoustic rock'],
-
-    'pop': ['pop', 'pop rock', 'indie pop', 'synth-pop', 'dance pop', 'electropop', 'dream pop',
-            'chamber pop', 'sophisti-pop', 'art pop', 'k-pop', 'j-pop', 'power pop', 'indie poptimism',
-            'pop dance', 'pop folk', 'pop nacional', 'pop soul', 'pop emo', 'pop punk', 'pop r&b',
-            'pop rap', 'canadian pop', 'uk pop', 'latin pop', 'adult standards', 'neo mellow',
-            'contemporary vocal jazz', 'vocal jazz', 'show tunes', 'easy listening', 'bedroom pop',
-            'bubblegum', 'adult contemporary', 'puerto rican pop', 'colombian pop', 'pop-soul',
-            'bubblegum pop', 'candy pop', 'dark pop'],
-
-    'electronic': ['electronic', 'electronica', 'edm', 'house', 'techno', 'trance', 'dubstep', 'ambient',
-                  'drum and bass', 'electro', 'electronic trap', 'electro house', 'progressive house',
-                  'deep house', 'tech house', 'tropical house', 'future bass', 'complextro', 'big room',
-                  'brostep', 'filthstep', 'future garage', 'intelligent dance music', 'neo-synthpop',
-                  'alternative dance', 'dance-punk', 'indietronica', 'canadian electronic', 'slap house',
-                  'filter house', 'disco house', 'nu disco', 'compositional ambient', 'ambient pop',
-                  'synthwave', 'retrowave', 'acid house', 'drumstep', 'hard trance', 'uk dance',
-                  'uk funky', 'cyberpunk'],
-
-    'hip hop': ['hip hop', 'rap', 'trap', 'gangster rap', 'underground hip hop', 'conscious hip hop',
-                'alternative hip hop', 'east coast hip hop', 'west coast rap', 'southern hip hop',
-                'atlanta hip hop', 'chicago rap', 'detroit hip hop', 'memphis rap', 'miami hip hop',
-                'houston rap', 'jazz rap', 'political hip hop', 'emo rap', 'cloud rap', 'melodic rap',
-                'rage rap', 'atl hip hop', 'atl trap', 'canadian hip hop', 'canadian trap',
-                'country rap', 'dfw rap', 'latin hip hop', 'lgbtq+ hip hop', 'plugg', 'pluggnb',
-                'dirty south', 'southern rap', 'g funk', 'east coast rap', 'crunk', 'trap latino',
-                'queens hip hop', 'underground hip-hop', 'golden age hip hop'],
-
-    'r&b': ['r&b', 'soul', 'funk', 'contemporary r&b', 'neo soul', 'motown', 'quiet storm',
-            'new jack swing', 'gospel', 'southern soul', 'chicago soul', 'memphis soul', 'philly soul',
-            'northern soul', 'soul blues', 'soul jazz', 'funk rock', 'funk metal', 'p funk',
-            'synth funk', 'funk pop', 'jazz funk', 'alternative r&b', 'british soul', 'indie soul',
-            'trap soul', 'urban contemporary', 'classic soul', 'neo-soul', 'latin soul', 'rhythm and blues',
-            'slow jams', 'funk paulista', 'funk rj', 'funk carioca', 'latin alternative',
-            'tropical alternativo'],
-
-    'metal': ['metal', 'heavy metal', 'thrash metal', 'death metal', 'black metal', 'doom metal',
-              'power metal', 'progressive metal', 'folk metal', 'gothic metal', 'industrial metal',
-              'symphonic metal', 'alternative metal', 'nu metal', 'metalcore', 'melodic metalcore',
-              'canadian metal', 'neo classical metal', 'old school thrash', 'prog metal',
-              'uk metalcore', 'rap metal', 'melodic black metal', 'traditional doom metal',
-              'glam metal', 'progressive metalcore'],
-
-    'jazz': ['jazz', 'swing', 'bebop', 'big band', 'jazz fusion', 'cool jazz', 'hard bop',
-             'contemporary jazz', 'smooth jazz', 'latin jazz', 'modal jazz', 'post-bop', 'free jazz',
-             'jazz blues', 'jazz funk', 'jazz pop', 'jazz rap', 'jazz trio', 'jazz trumpet',
-             'new orleans jazz', 'dixieland', 'smooth saxophone', 'jazz-funk', 'soul jazz'],
-
-    'folk': ['folk', 'folk rock', 'indie folk', 'contemporary folk',
-             'traditional folk',
-             'american folk revival', 'folk-pop', 'boston folk', 'stomp and holler',
-             'irish singer-songwriter', 'singer-songwriter', 'singer-songwriter pop',
-             'folk-country', 'irish folk'],
-
-    'blues': ['blues', 'chicago blues', 'delta blues', 'electric blues', 'country blues',
-              'contemporary blues', 'blues rock', 'modern blues', 'modern blues rock',
-              'piano blues', 'punk blues', 'soul blues', 'swamp blues', 'classic blues',
-              'harmonica blues'],
-
-    'classical': ['classical', 'orchestra', 'chamber music', 'symphony', 'opera', 'baroque',
-                  'romantic', 'contemporary classical', 'minimalism', 'modern classical',
-                  'orchestral', 'choral', 'classical performance', 'classical era',
-                  'early romantic era', 'late romantic era', 'post-romantic era',
-                  'british contemporary classical', 'polish classical', 'japanese classical',
-                  'classical cello', 'classical tenor', 'early music', 'impressionism',
-                  'neo-classical', 'orchestral performance', 'orchestral soundtrack',
-                  'german baroque', 'italian baroque', 'german romanticism'],
-
-    'world': ['world', 'latin', 'reggae', 'ska', 'afrobeat', 'brazilian', 'caribbean',
-              'cumbia', 'salsa', 'samba', 'bossa nova', 'reggaeton', 'tropical',
-              'urbano latino', 'reggaeton flow', 'reggaeton chileno', 'reggaeton colombiano',
-              'roots reggae', 'reggae fusion', 'ska punk', 'ska mexicano', 'dancehall',
-              'funk paulista', 'funk rj', 'funk carioca', 'latin alternative',
-              'tropical alternativo'],
-
-    'punk': ['punk', 'punk rock', 'pop punk', 'hardcore punk', 'post-punk', 'art punk',
-             'skatepunk', 'melodic punk', 'melodic punk rock', 'canadian pop punk']
-}
-
-# Reverse mapping for O(1) subgenre -> parent lookups
-GENRE_REVERSE_MAPPING = {}
-for parent, children in GENRE_MAPPING.items():
-    GENRE_REVERSE_MAPPING[parent] = parent
-    for child in children:
-        GENRE_REVERSE_MAPPING[child] = parent
-
-
-def map_to_parent_genre(genre):
-    """Map a subgenre to its parent genre."""
-    genre = genre.lower().strip()
-    return GENRE_REVERSE_MAPPING.get(genre, genre)
+# Threads resolving each player's next song while they guess; 0 switches it off
+LOOKAHEAD_WORKERS = int(os.environ.get('LOOKAHEAD_WORKERS', '4'))
+# Most-likely songs whose fresh preview URLs are fetched at boot; 0 switches it off
+PREVIEW_WARM_COUNT = int(os.environ.get('PREVIEW_WARM_COUNT', '100'))
+# Seconds between checks for a changed library; 0 switches reloading off
+LIBRARY_RELOAD_INTERVAL = int(os.environ.get('LIBRARY_RELOAD_INTERVAL', '300'))
+# Seconds a worker serves the board it last read. Its own players' games show
+# at once; other workers' within this long. 0 reads it every time.
+STANDINGS_CACHE_SECONDS = float(os.environ.get('STANDINGS_CACHE_SECONDS', '5'))
+# Where workers share one mapped copy of the library (see snapshot.py); empty
+# switches sharing off. Memory-backed where the host has it.
+LIBRARY_SNAPSHOT_DIR = os.environ.get('LIBRARY_SNAPSHOT_DIR', os.path.join(
+    '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'music_quizzer'))
 
 CORRECT_RESPONSES = [
     "Correct! That was pure metal—like your amp cranked all the way to eleven! ",
@@ -230,129 +141,274 @@ INCORRECT_RESPONSES = [
 ]
 
 
-def female_fronted(df):
-    """Which songs count as female-fronted, decided per artist.
+def load_song_data(version=None):
+    """Load the song library.
 
-    Last.fm tags arrive unevenly - one Taylor Swift row carries "female
-    vocalists" while twenty-seven carry only "pop". So if any song by an artist
-    is marked, all of theirs are.
+    The snapshot the library tools store is tried first, if it was made from
+    the catalog at `version`; otherwise the songs are read and derived here.
+    Returns (songs, decades, played): a song_store.SongStore, or None if
+    nothing could be loaded, and the plays generation its play counts are
+    current to.
     """
-    leads = df['Artist'].apply(primary_artist).str.lower().str.strip()
-    marked = [is_female_vocal(a, g) for a, g in zip(df['Artist'], df['Genres'])]
-    marked = pd.Series(marked, index=df.index)
-
-    known = set(leads[marked])
-    return leads.isin(known)
+    stored = stored_snapshot(version)
+    if stored is not None:
+        return stored
+    try:
+        df = library.load_songs()
+    except Exception as e:
+        logger.error(f"Could not load the song library: {e}")
+        df = None
+    return (*prepare_song_data(df), version[1] if version else None)
 
 
-def recency_weight(year, oldest, newest):
-    """Newer songs come up more often, rising evenly across the years."""
-    if newest <= oldest:
-        return 1.0
+def stored_snapshot(version):
+    """(songs, decades, played) from the snapshot stored for `version`'s
+    catalog, or None if there isn't a good one.
+    """
+    if version is None:
+        return None
     try:
-        position = (int(year) - oldest) / (newest - oldest)
-    except (TypeError, ValueError):
-        return 1.0
-    position = min(max(position, 0.0), 1.0)
-    return 1.0 + (RECENCY_WEIGHT - 1.0) * position
+        data = library.load_snapshot(derivation(), version[0])
+        if data is None:
+            logger.info("No current library snapshot stored; reading the songs table")
+            return None
+        songs, meta = snapshot.loads(data)
+        if meta.get('plays') is None:
+            logger.info("The stored library snapshot predates plays; reading the songs table")
+            return None
+    except Exception as e:
+        logger.warning(f"Could not use the stored library snapshot: {e}")
+        return None
+    logger.info(f"Loaded {len(songs)} songs from the stored library snapshot")
+    return songs, meta['decades'], meta['plays']
 
 
-def song_weights(df):
-    """A pick-likelihood for every song, from recency and vocal tags."""
-    years = pd.to_numeric(df['Year'], errors='coerce')
-    oldest, newest = int(years.min()), int(years.max())
+# The loaded library and everything built from it, swapped in as one. Request
+# code reads `loaded` once and works from that, so a reload landing mid-request
+# can't pair new songs with an old index. `version` is library.library_version
+# as of the load, or None when there's nothing to reload from. `plays` are the
+# play counts written since the songs were derived, laid over them (see
+# with_plays), or None.
+Loaded = namedtuple('Loaded', 'data index decades version artists plays')
 
-    weights = years.apply(lambda y: recency_weight(y, oldest, newest))
 
-    if 'Genres' in df.columns:
-        female = female_fronted(df)
-        weights = weights * female.map({True: FEMALE_VOCAL_WEIGHT, False: 1.0})
-        logger.info(f'{int(female.sum())} songs tagged as female-fronted')
+def snapshot_path(version):
+    """Where the shared snapshot of the library at `version` lives, or None
+    if it can't be shared.
 
-    return weights
+    The name covers everything the snapshot was derived from, so a worker
+    never maps one built from another library or under other settings.
+    """
+    if not LIBRARY_SNAPSHOT_DIR or version is None:
+        return None
+    # Plays don't date it; each worker lays those over it itself
+    source = repr((version[0], library.DATABASE_URL or library.SQLITE_PATH, derivation()))
+    digest = hashlib.sha1(source.encode()).hexdigest()[:16]
+    return os.path.join(LIBRARY_SNAPSHOT_DIR, f'library-{digest}{snapshot.SUFFIX}')
 
 
-def load_song_data():
-    """Load the song library once, at startup.
+def share_library(version, build):
+    """(songs, decades, played) as `build()` returns them, mapped from the
+    snapshot every worker shares when there is one.
 
-    Returns (dataframe, decades). Dataframe is None if nothing could be loaded.
+    Only the first worker to get here for a version runs `build`; the rest
+    map what it wrote.
     """
+    path = snapshot_path(version)
+    if path is None:
+        return build()
+
+    built = []
+
+    def publish():
+        built.append(build())
+        songs, decades, played = built[0]
+        if songs is None:
+            return None
+        return snapshot.dumps(songs, decades=decades, plays=played)
+
     try:
-        df = library.load_songs()
-    except Exception as e:
-        logger.error(f"Could not load the song library: {e}")
-        df = None
+        songs, meta = snapshot.shared(path, publish)
+    except OSError as e:
+        logger.warning(f"Could not share the library snapshot; holding a private copy: {e}")
+        return built[0] if built else build()
+    if songs is None:
+        return None, [], None
+    return songs, meta['decades'], meta.get('plays')
 
-    if df is None or df.empty:
-        logger.error("No song data available")
-        return None, []
-
-    # The quiz only covers MIN_YEAR onward. This also drops rows with an
-    # unreadable Year, which could not be placed in a decade anyway.
-    if 'Year' in df.columns:
-        year = pd.to_numeric(df['Year'], errors='coerce')
-        dropped = int((~(year >= MIN_YEAR)).sum())
-        df = df[year >= MIN_YEAR].copy()
-        if dropped:
-            logger.info(f"Dropped {dropped} songs released before {MIN_YEAR}")
-
-    # Derive Decade from Year when the dataset does not carry it
-    if 'Decade' not in df.columns and 'Year' in df.columns:
-        year = pd.to_numeric(df['Year'], errors='coerce')
-        df['Decade'] = ((year // 10) * 10).astype(int).astype(str) + 's'
-        logger.info("Created Decade column from Year")
-
-    df = df[df['Decade'].notna()].copy()
-    df['Weight'] = song_weights(df)
-
-    # Precompute parent genres per row so filtering does not re-parse on every request
-    if 'Genres' in df.columns:
-        df['ParentGenres'] = df['Genres'].fillna('').apply(
-            lambda value: {
-                map_to_parent_genre(genre)
-                for genre in str(value).split(',')
-                if genre.strip()
-            }
-        )
-    else:
-        df['ParentGenres'] = [set() for _ in range(len(df))]
 
-    decades = sorted({
-        int(str(d).replace('s', ''))
-        for d in df['Decade'].unique()
-        if str(d).replace('s', '').isdigit()
-    })
-    logger.info(f"Available decades: {decades}")
-    return df, decades
+def indexed(data, decades, version=None, played=None):
+    """The library with its indexes built, ready to swap in.
 
+    `played` is the plays generation the songs' play counts are current to;
+    plays written since are read and laid over them.
+    """
+    if data is None:
+        return Loaded(None, None, decades, version, None, None)
+    plays = None
+    if version is not None and played is not None and played != version[1]:
+        plays = library.load_plays(played)
+    # Filters are answered from the index rather than by scanning the rows
+    return with_plays(Loaded(data, None, decades, version, ArtistIndex(data), None), plays)
+
+
+def with_plays(current, plays):
+    """`current` with `plays`, as from library.load_plays, laid over it.
+
+    A play doesn't change what a song is, only how likely it is to come up -
+    or, past PLAY_FAILURE_LIMIT, whether it can at all. So instead of deriving
+    the library again, its index is rebuilt with the weights those counts
+    would have given it, and songs taken out weighted zero.
+    """
+    if current.plays is not None:
+        plays = current.plays if plays is None else pd.concat(
+            [current.plays.drop(index=plays.index, errors='ignore'), plays])
+    data = current.data
+    weights = None
+    if plays is not None and len(plays) and 'Weight' in data.columns:
+        weights = np.array(data.column('Weight'), dtype=float)
+        known = plays[plays.index.isin(data.labels)]
+        at = data.positions_of(known.index)
+        stored = data.column('PlayFailures')[at] if 'PlayFailures' in data.columns else 0
+        weights[at] = replayed_weights(weights[at], stored, known['PlayFailures'])
+        weights[at[~known['Playable'].to_numpy()]] = 0.0
+    return current._replace(index=SongIndex(data, weights), plays=plays)
+
+
+def current_version():
+    """library.library_version, or None when there's nothing to reload from."""
+    if not USE_POSTGRES:
+        return None
+    try:
+        return library.library_version()
+    except Exception as e:
+        logger.warning(f"Could not read the library version: {e}")
+        return None
 
-song_data, all_decades = load_song_data()
 
+def load_library():
+    """The whole library, read fresh."""
+    # Read before the rows, so a write that lands mid-load is picked up by
+    # the next check rather than lost
+    version = current_version()
+    songs, decades, played = share_library(version, lambda: load_song_data(version))
+    return indexed(songs, decades, version, played)
 
-# Answer matching. Requiring the exact name as a substring meant one wrong
-# letter failed the round, so guesses are matched three ways, loosest last.
-WHOLE_MATCH_RATIO = 0.8    # "alanis morisett" vs "alanis morissette"
-TOKEN_MATCH_RATIO = 0.85   # a single misspelled word
-MIN_TOKEN_LENGTH = 5       # short words like "john" are too common to accept alone
-MIN_SKELETON_LENGTH = 3    # below this, consonants alone collide too easily
 
-VOWELS = set('aeiouy')
+# None until start() has loaded the library in this process
+loaded = None
 
-ANSWER_STOPWORDS = {'the', 'and', 'featuring', 'with', 'their', 'band'}
 
+def __getattr__(name):
+    # song_data, song_index and all_decades, for tools and tests that read them
+    field = {'song_data': 'data', 'song_index': 'index', 'all_decades': 'decades'}.get(name)
+    if field is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return getattr(start(), field)
 
-def _similar(a, b, threshold):
-    return SequenceMatcher(None, a, b).ratio() >= threshold
 
+def reload_library():
+    """Swap in the library as it is now, if it changed. True if it did.
 
-def consonant_skeleton(value):
-    """The consonants of a name, which survive most phonetic misspellings.
+    Only songs written since the last load are read; the rest are carried
+    over - unless some were deleted, when it's all read again. Weights and the indexes are rebuilt over everything, since both
+    depend on the library as a whole. The first worker to notice a change
+    publishes the new snapshot and the others map it.
 
-    "tpayne" and "tpain" both reduce to "tpn". Character-similarity scores them
-    at 0.67 and reject them; people type artist names by ear all the time.
+    When only plays were written, they're laid over the library as it is,
+    with nothing derived or published again (see with_plays).
     """
-    return ''.join(c for c in value if c.isalnum() and c not in VOWELS)
+    global loaded
+    current = loaded
+    version = library.library_version()
+    if version == current.version:
+        return False
+
+    if current.data is None or current.version is None:
+        fresh = load_library()
+    elif version[0] != current.version[0] and library.deleted_since(current.version[0]):
+        # The deleted rows can't be read back, so nothing says which to drop
+        logger.info("Songs were deleted since the library loaded; reading it all again")
+        fresh = load_library()
+    elif version[0] == current.version[0]:
+        plays = library.load_plays(current.version[1])
+        fresh = with_plays(current, plays)._replace(version=version)
+        logger.info(f"Laying plays of {len(plays)} songs over the library")
+    else:
+        def changed_library():
+            changed, written = library.load_changes(current.version[0])
+            kept = current.data.to_frame().drop(index=written, errors='ignore')
+            if current.plays is not None:
+                # Derived with the plays laid over it, so it's current to them
+                plays = current.plays.drop(index=written, errors='ignore')
+                kept = kept.drop(index=plays.index[~plays['Playable']], errors='ignore')
+                counted = plays.index.intersection(kept.index)
+                kept.loc[counted, 'PlayFailures'] = plays.loc[counted, 'PlayFailures']
+            return (*prepare_song_data(pd.concat([kept, changed])), current.version[1])
+        songs, decades, played = share_library(version, changed_library)
+        fresh = indexed(songs, decades, version, played)
+
+    if fresh.data is None:
+        logger.warning("Reloaded library came back empty; keeping the old one")
+        return False
+
+    loaded = fresh
+    with failing_lock:
+        # What was seen here has been written back and read in with the rest;
+        # counted on, it would be counted twice, and a song the audit put
+        # back would stay out
+        failing_songs.clear()
+        dead_songs.clear()
+    logger.info(f"Library reloaded: {len(fresh.data)} songs")
+    return True
+
+
+def watch_library(interval=LIBRARY_RELOAD_INTERVAL):
+    """Check for library changes every `interval` seconds, in the background."""
+    if not USE_POSTGRES or interval <= 0:
+        return None
+
+    def watch():
+        while True:
+            time.sleep(interval)
+            try:
+                reload_library()
+            except Exception as e:
+                logger.warning(f"Library reload failed, keeping the old one: {e}")
 
+    thread = threading.Thread(target=watch, name='library-reload', daemon=True)
+    thread.start()
+    return thread
+
+
+def start_preview_warmup(songs, count=PREVIEW_WARM_COUNT):
+    """Fill the shared preview cache for the heaviest songs, in the background.
+
+    Only songs whose stored URL expires need it; the rest play from the library.
+    """
+    if songs is None or count <= 0 or 'PreviewSource' not in songs.columns:
+        return None
+
+    sources, track_ids = songs.column('PreviewSource'), songs.column('PreviewId')
+    expiring = np.flatnonzero(np.isin(sources, list(EXPIRING_SOURCES))
+                              & pd.notna(track_ids))
+    # Heaviest first; a stable sort keeps library order among equals
+    likely = expiring[np.argsort(-songs.column('Weight')[expiring], kind='stable')][:count]
+    tracks = list(zip(sources[likely], track_ids[likely]))
+    if not tracks:
+        return None
+
+    thread = threading.Thread(target=warm_preview_cache, args=(tracks,),
+                              name='preview-warmup', daemon=True)
+    thread.start()
+    return thread
+
+# What happens when songs come up is written back to the library, so a song
+# that won't play stops costing every worker retries. The CSV can't take it.
+play_reports = PlayReports(library.record_plays) if USE_POSTGRES else None
+failing_songs = Counter()   # Failed lookups this process has seen, by label
+dead_songs = set()          # Songs that reached PLAY_FAILURE_LIMIT here
+failing_lock = threading.Lock()
 
 
 def hint_for(current_song):
@@ -378,44 +434,17 @@ def hint_for(current_song):
     return 'The artist ' + ' and '.join(parts) + '.'
 
 
-def answer_matches(guess, correct):
-    """Is `guess` close enough to `correct` to count? Both come in cleaned."""
-    if not guess or not correct:
-        return False
+def answers_for(current_song):
+    """The artist, then the title, that a guess at `current_song` is judged
+    against.
 
-    # The full name somewhere in the answer
-    if correct in guess:
-        return True
-
-    # The whole answer, allowing for typos
-    if _similar(guess, correct, WHOLE_MATCH_RATIO):
-        return True
-
-    # Names vary in how they're spaced and hyphenated - T-Pain, T Pain, tpain -
-    # and cleaning turns punctuation into spaces. Comparing without any spacing
-    # judges the letters rather than the styling.
-    tight_guess = guess.replace(' ', '')
-    tight_correct = correct.replace(' ', '')
-    if len(tight_correct) >= 4 and tight_correct in tight_guess:
-        return True
-    if _similar(tight_guess, tight_correct, WHOLE_MATCH_RATIO):
-        return True
-
-    # Spelled by ear: same consonants, different vowels
-    skeleton = consonant_skeleton(tight_correct)
-    if (len(skeleton) >= MIN_SKELETON_LENGTH
-            and skeleton == consonant_skeleton(tight_guess)):
-        return True
-
-    # A distinctive word on its own - surname only, or one word misspelled
-    guess_words = guess.split()
-    for word in correct.split():
-        if len(word) < MIN_TOKEN_LENGTH or word in ANSWER_STOPWORDS:
-            continue
-        if any(_similar(word, other, TOKEN_MATCH_RATIO) for other in guess_words):
-            return True
-
-    return False
+    A round carries both names as the library cleaned them when it loaded;
+    a round from a session older than that is cleaned here.
+    """
+    artist = current_song.get('artist_answer')
+    yield answer_for(artist if artist is not None else cleaned_artist(current_song['artist']))
+    title = current_song.get('song_answer')
+    yield answer_for(title if title is not None else cleaned_title(current_song['song']))
 
 
 def playable_url(song):
@@ -432,13 +461,60 @@ def playable_url(song):
     if isinstance(source, str) and isinstance(track_id, str) and track_id:
         fresh = refresh_preview(source, track_id)
         if fresh:
+            note_play(song, True)
             return fresh
 
     stored = song.get('PreviewUrl')
     if source not in EXPIRING_SOURCES and isinstance(stored, str) and stored:
         return stored
 
-    return get_preview_url(song['Song'], song['Artist'])
+    try:
+        preview, _source, _track_id = find_preview(song['Song'], song['Artist'])
+    except LookupFailed as e:
+        # Nobody answered, which says nothing about the song
+        logger.warning(f'Preview lookup unavailable: {e}')
+        return None
+    if not preview:
+        logger.info(f"No preview found for {song['Artist']} - {song['Song']}")
+    note_play(song, bool(preview))
+    return preview
+
+
+def stored_failures(song):
+    """The failures the library holds against `song`: as last read back with
+    the plays (see with_plays), or as the song was loaded.
+    """
+    plays = loaded.plays if loaded is not None else None
+    if plays is not None and song.name in plays.index:
+        return int(plays.at[song.name, 'PlayFailures'])
+    stored = song.get('PlayFailures')
+    return 0 if pd.isna(stored) else int(stored)
+
+
+def note_play(song, played):
+    """Count a play-time lookup outcome, here and in the library.
+
+    Only news is reported: a play is, for a song with failures against it.
+    """
+    label = song.name
+    stored = stored_failures(song)
+    with failing_lock:
+        if played:
+            seen = failing_songs.pop(label, 0)
+            dead_songs.discard(label)
+        else:
+            failing_songs[label] += 1
+            seen = failing_songs[label]
+            if stored + seen >= PLAY_FAILURE_LIMIT:
+                dead_songs.add(label)
+    if play_reports and (not played or seen or stored):
+        play_reports.record(song['Song'], song['Artist'], played)
+
+
+def unplayable_here():
+    """Songs this process has given up on, until the library says otherwise."""
+    with failing_lock:
+        return set(dead_songs)
 
 
 def remember_song(index):
@@ -448,80 +524,269 @@ def remember_song(index):
     session['recent_songs'] = recent[-MAX_RECENT_SONGS:]
 
 
-def pick_song(selected_genres=None, selected_decades=None):
-    """Pick a playable song for the quiz. Returns (payload, status_code)."""
-    if song_data is None:
-        return {'error': 'Song data is unavailable. Please try again later.'}, 503
+# A song ready to serve. `expires` marks a URL that will stop working - see
+# previews.EXPIRING_SOURCES. `recent_cleared` says the player's replay memory
+# ran out and was started over to find it.
+Pick = namedtuple('Pick', 'song preview_url expires resolved_at recent_cleared')
 
-    filtered_songs = song_data
 
-    if selected_genres:
-        wanted = set(selected_genres)
-        filtered_songs = filtered_songs[
-            filtered_songs['ParentGenres'].apply(lambda genres: bool(genres & wanted))
-        ]
+def url_expires(song, url):
+    """Only a stored URL from a source that doesn't sign its links lasts."""
+    stored = song.get('PreviewUrl')
+    return not (isinstance(stored, str) and url == stored
+                and song.get('PreviewSource') not in EXPIRING_SOURCES)
 
-    if selected_decades:
-        decades = [d if str(d).endswith('s') else f"{d}s" for d in selected_decades]
-        filtered_songs = filtered_songs[filtered_songs['Decade'].isin(decades)]
-
-    if len(filtered_songs) == 0:
-        described = []
-        if selected_genres:
-            described.append("genres: " + ", ".join(selected_genres))
-        if selected_decades:
-            described.append("decades: " + ", ".join(selected_decades))
-        return {
-            'error': f'No songs found matching your selected {" and ".join(described)}. '
-                     'Try different filters!'
-        }, 200
-
-    recent = set(session.get('recent_songs', []))
 
-    for attempt in range(PREVIEW_SEARCH_ATTEMPTS):
-        available_songs = filtered_songs[~filtered_songs.index.isin(recent)]
+def choose_song(selected_genres, selected_decades, recent):
+    """Pick a song and find its audio, without touching the session.
 
-        if len(available_songs) == 0:
-            session['recent_songs'] = []
-            recent = set()
-            available_songs = filtered_songs
+    `recent` is what the player heard lately. Safe to run off the request
+    thread, which is what the lookahead does. The pick's song is None if
+    nothing playable turned up.
+    """
+    songs = loaded
+    sampler = songs.index.sampler(selected_genres, selected_decades)
+    recent = set(recent)
+    dead = unplayable_here()
+    cleared = False
 
+    for attempt in range(PREVIEW_SEARCH_ATTEMPTS):
         # Weighted, so newer and female-fronted songs come up more often
-        song = available_songs.sample(n=1, weights=available_songs['Weight']).iloc[0]
+        position = sampler.draw(rejected=songs.index.flags(recent | dead))
 
+        if position is None:
+            # Heard everything this filter allows - start the memory over
+            recent = set()
+            cleared = True
+            position = sampler.draw(rejected=songs.index.flags(dead))
+            if position is None:
+                break
+
+        song = songs.data.row(position)
         preview_url = playable_url(song)
 
         if preview_url:
-            remember_song(song.name)
-            # The answer stays server-side; the browser only gets audio.
-            session['current_song'] = {
-                'artist': str(song['Artist']),
-                'song': str(song['Song']),
-                'year': str(song['Year']),
-            }
-            session['attempts'] = 0
-            return {'preview_url': preview_url}, 200
+            return Pick(song, preview_url, url_expires(song, preview_url),
+                        time.time(), cleared)
 
         recent.add(song.name)
         logger.info(f"Attempt {attempt + 1}: no preview, trying another song")
 
-    return {'error': 'Could not find a song with preview. Please try different filters.'}, 200
+    return Pick(None, None, False, time.time(), cleared)
+
+
+def refresh_pick(pick):
+    """A pick made a while ago, with its URL fetched again."""
+    preview_url = playable_url(pick.song)
+    if not preview_url:
+        return None
+    return pick._replace(preview_url=preview_url, resolved_at=time.time())
+
+
+lookahead = (Lookahead(choose_song, refresh_pick, LOOKAHEAD_WORKERS)
+             if LOOKAHEAD_WORKERS > 0 else None)
+
+
+def deal_deck(selected_genres, selected_decades, recent, count):
+    """Draw `count` different songs and find all their audio at once.
+
+    Weighted like any single pick, but without replacement, and the lookups run
+    side by side so a whole game waits on one slow lookup rather than six.
+    Songs with no audio are replaced from the same filter. Comes back short if
+    the filter doesn't allow enough unheard songs.
+    """
+    library_now = loaded
+    sampler = library_now.index.sampler(selected_genres, selected_decades)
+    rejected = library_now.index.flags(set(recent) | unplayable_here())
+    deck = []
+
+    for attempt in range(PREVIEW_SEARCH_ATTEMPTS):
+        songs = []
+        while len(deck) + len(songs) < count:
+            position = sampler.draw(rejected)
+            if position is None:
+                break
+            rejected[position] = True
+            songs.append(library_now.data.row(position))
+        if not songs:
+            break
+
+        with ThreadPoolExecutor(max_workers=len(songs)) as pool:
+            urls = list(pool.map(playable_url, songs))
+        resolved_at = time.time()
+
+        for song, url in zip(songs, urls):
+            if url:
+                deck.append(Pick(song, url, url_expires(song, url), resolved_at, False))
+        if len(deck) == count:
+            break
+        logger.info(f"Deal attempt {attempt + 1}: {count - len(deck)} songs had no preview")
+
+    return deck
+
+
+def round_entry(pick):
+    """What the session keeps about a song that is, or will be, a round."""
+    song = pick.song
+    return {
+        'index': int(song.name),
+        'artist': str(song['Artist']),
+        'song': str(song['Song']),
+        'year': str(song['Year']),
+        # The names a guess is judged against, cleaned when the library loaded
+        'artist_answer': song.get('ArtistAnswer'),
+        'song_answer': song.get('SongAnswer'),
+        'preview_url': pick.preview_url,
+        'expires': pick.expires,
+        'resolved_at': pick.resolved_at,
+    }
+
+
+def fresh_url(entry):
+    """The entry's URL, fetched again if it's a signed one getting old.
+
+    Updates the entry, so callers must write it back to the session.
+    """
+    if entry['expires'] and time.time() - entry['resolved_at'] > FRESH_FOR:
+        label = entry['index']
+        song = loaded.data.by_label(label) if loaded.data is not None else None
+        if song is not None:
+            url = playable_url(song)
+        else:
+            url = get_preview_url(entry['song'], entry['artist'])
+        if url:
+            entry['preview_url'] = url
+            entry['resolved_at'] = time.time()
+    return entry['preview_url']
+
+
+def start_round(entry):
+    """Make `entry` the song being guessed. Returns the URL to play."""
+    remember_song(entry['index'])
+    # The answer stays server-side; the browser only gets audio.
+    session['current_song'] = {
+        'artist': entry['artist'],
+        'song': entry['song'],
+        'year': entry['year'],
+        'artist_answer': entry.get('artist_answer'),
+        'song_answer': entry.get('song_answer'),
+    }
+    session['attempts'] = 0
+    return entry['preview_url']
+
+
+def no_songs_error(selected_genres, selected_decades):
+    """The filter allows nothing, or nothing we can play."""
+    described = []
+    if selected_genres:
+        described.append("genres: " + ", ".join(selected_genres))
+    if selected_decades:
+        described.append("decades: " + ", ".join(selected_decades))
+    return {
+        'error': f'No songs found matching your selected {" and ".join(described)}. '
+                 'Try different filters!'
+    }
+
+
+NO_PREVIEW_ERROR = {'error': 'Could not find a song with preview. Please try different filters.'}
+
+
+def pick_song(selected_genres=None, selected_decades=None):
+    """Pick a playable song for the quiz. Returns (payload, status_code)."""
+    songs = loaded
+    if songs.data is None:
+        return {'error': 'Song data is unavailable. Please try again later.'}, 503
+
+    # A game dealt up front plays out its deck, already resolved
+    deck = session.get('deck')
+    if deck:
+        entry = deck.pop(0)
+        preview_url = fresh_url(entry)
+        session['deck'] = deck
+        start_round(entry)
+        return {'preview_url': preview_url}, 200
+
+    if len(songs.index.sampler(selected_genres, selected_decades)) == 0:
+        return no_songs_error(selected_genres, selected_decades), 200
+
+    # Identifies the player's lookahead slot; carries no answer
+    player = session.setdefault('player', secrets.token_hex(8))
+
+    pick = None
+    if lookahead:
+        pick = lookahead.take(player, selected_genres, selected_decades)
+    if pick is None:
+        pick = choose_song(selected_genres, selected_decades,
+                           session.get('recent_songs', []))
+
+    if pick.recent_cleared:
+        session['recent_songs'] = []
+    if pick.song is None:
+        return NO_PREVIEW_ERROR, 200
+
+    preview_url = start_round(round_entry(pick))
+
+    # Have the next one ready by the time this round is answered
+    if lookahead:
+        lookahead.prepare(player, selected_genres, selected_decades,
+                          session['recent_songs'])
+
+    return {'preview_url': preview_url}, 200
 
 
-@app.route('/update_filters', methods=['POST'])
+def deal_game(selected_genres=None, selected_decades=None):
+    """Deal the rest of this game and start its first round.
+
+    Returns (payload, status_code). The answers go in the session with the
+    deck; the browser gets the first clip and how many rounds were dealt.
+    """
+    songs = loaded
+    if songs.data is None:
+        return {'error': 'Song data is unavailable. Please try again later.'}, 503
+
+    if len(songs.index.sampler(selected_genres, selected_decades)) == 0:
+        return no_songs_error(selected_genres, selected_decades), 200
+
+    # Identifies the player's lookahead slot; carries no answer
+    player = session.setdefault('player', secrets.token_hex(8))
+    recent = session.get('recent_songs', [])
+    count = max(MAX_SONGS - session.get('total', 0), 1)
+
+    # The first song may already be waiting, picked as the last game ended
+    first = lookahead.take(player, selected_genres, selected_decades) if lookahead else None
+    deck = []
+    if first is not None:
+        if first.recent_cleared:
+            recent = session['recent_songs'] = []
+        deck = [first]
+        recent = recent + [int(first.song.name)]
+    if count > len(deck):
+        deck += deal_deck(selected_genres, selected_decades, recent, count - len(deck))
+    if not deck:
+        return NO_PREVIEW_ERROR, 200
+
+    entries = [round_entry(pick) for pick in deck]
+    preview_url = start_round(entries.pop(0))
+    session['deck'] = entries
+    return {'preview_url': preview_url, 'rounds': len(deck)}, 200
+
+
+@routes.route('/update_filters', methods=['POST'])
 def update_filters():
     """Update the genre and decade filters."""
     try:
         data = request.get_json(silent=True) or {}
         session['selected_genres'] = [str(g).lower() for g in data.get('genres', [])]
         session['selected_decades'] = [str(d) for d in data.get('decades', [])]
+        # Songs already dealt were drawn for the old filters
+        session.pop('deck', None)
         return jsonify({'success': True})
     except Exception as e:
         logger.error(f"Error updating filters: {e}")
         return jsonify({'error': 'Could not update filters'}), 500
 
 
-@app.route('/new-song')
+@routes.route('/new-song')
 def new_song():
     """Get a new song."""
     try:
@@ -535,61 +800,120 @@ def new_song():
         return jsonify({'error': 'Could not load a song. Please try again.'}), 500
 
 
-# Leaderboard storage. `get_db` and `sql` come from library.py so both tables
-# share one connection story.
-def init_db():
-    id_column = ('id SERIAL PRIMARY KEY' if USE_POSTGRES
-                 else 'id INTEGER PRIMARY KEY AUTOINCREMENT')
-    with get_db() as conn:
-        conn.cursor().execute(f'''
-        CREATE TABLE IF NOT EXISTS scores (
-            {id_column},
-            username TEXT NOT NULL,
-            score INTEGER NOT NULL,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+@routes.route('/deck', methods=['POST'])
+def new_deck():
+    """Deal every remaining song of the game at once."""
+    try:
+        payload, status = deal_game(
+            session.get('selected_genres', []),
+            session.get('selected_decades', []),
         )
-        ''')
-        conn.commit()
-    logger.info(f"Leaderboard storage: {'Postgres' if USE_POSTGRES else DB_PATH}")
+        return jsonify(payload), status
+    except Exception as e:
+        logger.error(f"Error dealing a game: {e}")
+        return jsonify({'error': 'Could not load a song. Please try again.'}), 500
 
 
-# Initialize database
-init_db()
+# Leaderboard storage. `get_db` and `execute_prepared` come from library.py so
+# both tables share one connection pool.
+#
+# Every finished game is a row in `scores`. `player_totals` is each player's
+# career rolled up from those rows, kept in step as each game is recorded, so
+# the board is a read of its top rows rather than a pass over every game.
+# Players are grouped case-insensitively, so "Mark" and "mark" are one, and
+# shown by the first of their spellings in sort order.
+def init_db():
+    """Bring the tables up to date; see migrations.py."""
+    migrations.migrate()
+    logger.info(f"Leaderboard storage: {'Postgres' if USE_POSTGRES else DB_PATH}")
 
 
-@app.after_request
+@routes.after_app_request
 def add_header(response):
-    """Add headers to prevent caching."""
-    response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0, max-age=0'
+    """Add headers to prevent caching.
+
+    A response with an ETag may be kept, but is checked with the server
+    before every reuse.
+    """
+    if 'ETag' in response.headers:
+        response.headers['Cache-Control'] = 'no-cache, must-revalidate, max-age=0'
+    else:
+        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0, max-age=0'
     response.headers['Pragma'] = 'no-cache'
     response.headers['Expires'] = '-1'
     return response
 
 
-@app.route('/')
+@routes.route('/')
 def index():
     """Render the main page."""
-    if song_data is None:
+    if loaded.data is None:
         return render_template('error.html', message="Failed to load song data")
 
     return render_template('index.html', max_songs=MAX_SONGS)
 
 
-# Career totals, grouped case-insensitively so "Mark" and "mark" are one player.
-# Every finished game is already a row, so the history needs no extra table.
+# Career totals, best first; fewer games breaks a tie
 STANDINGS_QUERY = '''
-    SELECT MIN(username), SUM(score), COUNT(*), MAX(score)
-    FROM scores
-    GROUP BY LOWER(username)
-    ORDER BY SUM(score) DESC, COUNT(*) ASC
+    SELECT username, total, games, best
+    FROM player_totals
+    ORDER BY total DESC, games ASC, player ASC
+'''
+
+# One finished game added to its player's totals, in the same transaction as
+# its row in `scores`
+ADD_TO_PLAYER_TOTALS = '''
+    INSERT INTO player_totals (player, username, total, games, best)
+    VALUES (LOWER(?), ?, ?, 1, ?)
+    ON CONFLICT (player) DO UPDATE SET
+        username = CASE WHEN excluded.username < player_totals.username
+                        THEN excluded.username ELSE player_totals.username END,
+        total = player_totals.total + excluded.total,
+        games = player_totals.games + 1,
+        best = CASE WHEN excluded.best > player_totals.best
+                    THEN excluded.best ELSE player_totals.best END
+'''
+
+# Where `{row}` stands on the board: one plus the players ahead of it, in
+# STANDINGS_QUERY's order to the last tiebreak, so a rank inside the board
+# is a place on it
+RANK_ON_BOARD = '''
+    1 + (SELECT COUNT(*) FROM player_totals AS other
+         WHERE other.player <> {row}.player
+           AND other.total >= {row}.total
+           AND (other.total > {row}.total OR other.games < {row}.games
+                OR (other.games = {row}.games AND other.player < {row}.player)))
 '''
 
+# A finished game recorded, its player's totals updated, and their new total
+# and rank returned, all in one statement. The rank counts the other players
+# as they stood before it; this player's own row is left out.
+RECORD_SCORE = {
+    # Postgres runs both writes as CTEs of one statement
+    'postgres': f'''
+    WITH game AS (
+        INSERT INTO scores (username, score) VALUES (?, ?)
+    ), player_totals_now AS (
+        {ADD_TO_PLAYER_TOTALS}
+        RETURNING player, total, games
+    )
+    SELECT total, {RANK_ON_BOARD.format(row='player_totals_now')}
+    FROM player_totals_now
+''',
+    # SQLite can't write from a CTE; the game goes in just before, on the
+    # same in-process connection, and the totals return what Postgres does
+    'sqlite': f'''
+    {ADD_TO_PLAYER_TOTALS}
+    RETURNING total, {RANK_ON_BOARD.format(row='player_totals')}
+''',
+}
+
 
 def standings(limit=LEADERBOARD_SIZE):
     """All-time totals per player, best first."""
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute(sql(STANDINGS_QUERY + ' LIMIT ?'), (limit,))
+        execute_prepared(cursor, 'standings', STANDINGS_QUERY + ' LIMIT ?', (limit,))
         return [
             {'username': name, 'total': int(total), 'games': int(games),
              'best': int(best),
@@ -600,6 +924,64 @@ def standings(limit=LEADERBOARD_SIZE):
         ]
 
 
+Board = namedtuple('Board', 'rows etag read_at')
+
+
+class StandingsCache:
+    """The top of the board as this worker last read it.
+
+    Reused for `ttl` seconds, or until a game recorded here invalidates it.
+    Readers arriving while it's being refilled wait for that one read rather
+    than each making their own. A read that a game lands in the middle of is
+    handed to its caller but not kept.
+    """
+
+    def __init__(self, read, ttl=STANDINGS_CACHE_SECONDS):
+        self.read = read
+        self.ttl = ttl
+        self._board = None
+        self._lock = threading.Lock()
+        self._writes = itertools.count()
+        self._written = next(self._writes)
+        self.hits = 0
+        self.misses = 0
+
+    def _fresh(self):
+        board = self._board
+        if board is not None and time.monotonic() - board.read_at < self.ttl:
+            return board
+        return None
+
+    def get(self):
+        """The board, as a Board of its rows and their ETag."""
+        board = self._fresh()
+        if board is None:
+            with self._lock:
+                board = self._fresh()
+                if board is None:
+                    written = self._written
+                    rows = self.read()
+                    body = json.dumps(rows, sort_keys=True).encode()
+                    board = Board(rows, hashlib.sha1(body).hexdigest(), time.monotonic())
+                    if written == self._written:
+                        self._board = board
+                    self.misses += 1
+                    return board
+        self.hits += 1
+        return board
+
+    def invalidate(self):
+        """Drop the board; a game has just been recorded."""
+        self._written = next(self._writes)
+        self._board = None
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'ttl': self.ttl}
+
+
+standings_cache = StandingsCache(standings)
+
+
 def record_score(username, final_score):
     """Save a finished game and report whether the player is now in the top ten.
 
@@ -610,18 +992,33 @@ def record_score(username, final_score):
         logger.info(f'Not recording a score of {final_score} for {username}')
         return False
 
+    totals = (username, username, final_score, final_score)
     with get_db() as db:
         cursor = db.cursor()
-        cursor.execute(sql('INSERT INTO scores (username, score) VALUES (?, ?)'),
-                       (username, final_score))
-        db.commit()
+        if USE_POSTGRES:
+            # One statement is its own transaction, so it goes without a
+            # BEGIN or COMMIT of its own: one round trip
+            db.autocommit = True
+            try:
+                execute_prepared(cursor, 'record_score', RECORD_SCORE['postgres'],
+                                 (username, final_score) + totals)
+                total, rank = cursor.fetchone()
+            finally:
+                db.autocommit = False
+        else:
+            cursor.execute('INSERT INTO scores (username, score) VALUES (?, ?)',
+                           (username, final_score))
+            cursor.execute(RECORD_SCORE['sqlite'], totals)
+            total, rank = cursor.fetchone()
+            db.commit()
+    standings_cache.invalidate()
 
-    # Judge against the board people actually see: all-time totals
-    return any(row['username'].lower() == username.lower()
-               for row in standings(LEADERBOARD_SIZE))
+    logger.info(f'{username} scored {final_score}: {total} all told, #{rank}')
+    # Judged against the board people see: all-time totals
+    return rank <= LEADERBOARD_SIZE
 
 
-@app.route('/check-answer', methods=['POST'])
+@routes.route('/check-answer', methods=['POST'])
 def check_answer():
     """Check if the answer is correct against the song held in the session."""
     try:
@@ -636,14 +1033,11 @@ def check_answer():
                 'reason': 'no_song',
             }), 400
 
-        user_answer = clean_text(str(data.get('answer', '')).lower())
-        # Only the lead has to be named - guests don't count either way.
-        # Must run before clean_text, which strips the word "featuring" itself.
-        correct_artist = clean_text(primary_artist(current_song['artist']).lower())
-        correct_song = clean_text(current_song['song'].lower())
-
-        is_correct = (answer_matches(user_answer, correct_artist)
-                      or answer_matches(user_answer, correct_song))
+        # Cut well past any name before cleaning, and again after, so what
+        # cleaning drops can't push the answer out
+        typed = str(data.get('answer', ''))[:MAX_GUESS_LENGTH]
+        guess = Guess(clean_guess(typed.lower())[:MAX_ANSWER_LENGTH])
+        is_correct = any(answer.matches(guess) for answer in answers_for(current_song))
 
         attempts = session.get('attempts', 0) + 1
         session['attempts'] = attempts
@@ -679,13 +1073,20 @@ def check_answer():
 
         game_over = session.get('total', 0) >= MAX_SONGS
         if not game_over:
-            return jsonify({
+            payload = {
                 'correct': is_correct,
                 'message': message,
                 'score': session.get('score', 0),
                 'total': session.get('total', 0),
                 'game_over': False
-            })
+            }
+            # With a dealt game, hand over the next clip now so the browser
+            # can load it while the player reads this one's result
+            deck = session.get('deck')
+            if deck:
+                payload['next_preview_url'] = fresh_url(deck[0])
+                session['deck'] = deck
+            return jsonify(payload)
 
         final_score = session.get('score', 0)
         final_total = session.get('total', 0)
@@ -698,8 +1099,17 @@ def check_answer():
                 message = "FUCK!!! NEW LEADERBOARD ENTRY!! " + message
 
         # Clear game state but keep the player signed in
+        player = session.get('player')
+        heard = session.get('recent_songs', [])
         session.clear()
         session['username'] = username
+        if player:
+            session['player'] = player
+            # Find the next game's first song while they read the results;
+            # its deal takes it from the slot (see deal_game)
+            if lookahead:
+                lookahead.prepare(player, session.get('selected_genres', []),
+                                  session.get('selected_decades', []), heard)
 
         return jsonify({
             'correct': is_correct,
@@ -715,17 +1125,48 @@ def check_answer():
         return jsonify({'error': 'Could not check that answer.'}), 500
 
 
-@app.route('/leaderboard')
+@routes.route('/suggest')
+def suggest():
+    """Artists whose names start the way the player is typing.
+
+    Drawn from the whole library and ranked the same for everyone, so the
+    list says nothing about the song being played.
+    """
+    artists = loaded.artists
+    typed = request.args.get('q', '')[:MAX_ANSWER_LENGTH]
+    return jsonify({'suggestions': artists.suggest(typed) if artists is not None else []})
+
+
+@routes.route('/leaderboard')
 def leaderboard():
-    """All-time standings by player."""
+    """All-time standings by player, or 304 if the browser has them already."""
     try:
-        return jsonify(standings())
+        board = standings_cache.get()
+        response = jsonify(board.rows)
+        response.set_etag(board.etag)
+        return response.make_conditional(request)
     except Exception as e:
         logger.error(f"Error fetching leaderboard: {e}")
         return jsonify({'error': 'Could not load the leaderboard.'}), 500
 
 
-@app.route('/set_username', methods=['POST'])
+@routes.route('/stats')
+def stats():
+    """How often the caches saved a lookup, for judging them under load."""
+    payload = {'preview_cache': preview_cache.stats(),
+               'standings_cache': standings_cache.stats(),
+               'db_pool': library.connection_pool().stats()}
+    if lookahead:
+        lookups = lookahead.hits + lookahead.misses
+        payload['lookahead'] = {
+            'hits': lookahead.hits,
+            'misses': lookahead.misses,
+            'hit_rate': round(lookahead.hits / lookups, 3) if lookups else None,
+        }
+    return jsonify(payload)
+
+
+@routes.route('/set_username', methods=['POST'])
 def set_username():
     """Set the username in the session."""
     try:
@@ -734,8 +1175,11 @@ def set_username():
         if not username:
             return jsonify({'error': 'No username provided'}), 400
 
+        player = session.get('player')
         session.clear()  # Start a fresh game
         session['username'] = username
+        if player:
+            session['player'] = player
         session['score'] = 0
         return jsonify({'status': 'success'})
     except Exception as e:
@@ -747,7 +1191,7 @@ CLIENT_ERROR_CONTEXT_LENGTH = 60
 CLIENT_ERROR_DETAIL_LENGTH = 300
 
 
-@app.route('/log-error', methods=['POST'])
+@routes.route('/log-error', methods=['POST'])
 def log_error():
     """Record a browser-side failure in the server log.
 
@@ -770,19 +1214,87 @@ def log_error():
     return '', 204
 
 
-@app.route('/check-session')
+@routes.route('/check-session')
 def check_session():
     """Check if there's an active session."""
     username = session.get('username')
     return jsonify({'has_session': bool(username), 'username': username})
 
 
+# How long each phase of start() took in this process, in seconds
+startup_timings = {}
+start_lock = threading.Lock()
+
+
+def timed(phase, work):
+    """Run `work()`, noting how long it took as a phase of startup."""
+    started = time.perf_counter()
+    result = work()
+    startup_timings[phase] = time.perf_counter() - started
+    return result
+
+
+def start():
+    """Open storage and load the library, once per process. Returns `loaded`.
+
+    Runs before the first request a process serves, and gunicorn runs it as
+    each worker boots (see gunicorn.conf.py), so importing this module opens
+    nothing. Safe to call from any thread; only the first call does any work.
+    """
+    global loaded
+    if loaded is not None:
+        return loaded
+    with start_lock:
+        if loaded is None:
+            timed('storage', init_db)
+            version = timed('library version', current_version)
+            songs, decades, played = timed('library', lambda: share_library(
+                version, lambda: load_song_data(version)))
+            loaded = timed('index', lambda: indexed(songs, decades, version, played))
+            timed('background', lambda: (watch_library(), start_preview_warmup(loaded.data)))
+            logger.info('Started in %.0f ms: %s', sum(startup_timings.values()) * 1000,
+                        ', '.join(f'{phase} {seconds * 1000:.0f} ms'
+                                  for phase, seconds in startup_timings.items()))
+    return loaded
+
+
+@routes.before_app_request
+def ensure_started():
+    start()
+
+
+def create_app():
+    """The quiz as a Flask app, ready to serve but with nothing loaded yet."""
+    quiz_app = Flask(__name__)
+
+    # Heroku terminates TLS at its router, so Flask sees a plain http request and
+    # would write http:// into the share-card image URL. Trusting the forwarded
+    # scheme keeps that link https, which is what chat apps will fetch.
+    quiz_app.wsgi_app = ProxyFix(quiz_app.wsgi_app, x_for=1, x_proto=1, x_host=1)
+
+    quiz_app.secret_key = load_secret_key()
+    quiz_app.config.update(
+        SESSION_COOKIE_SECURE=os.environ.get(
+            'SESSION_COOKIE_SECURE', '0' if RUNNING_LOCALLY else '1'
+        ) != '0',
+        SESSION_COOKIE_HTTPONLY=True,
+        SESSION_COOKIE_SAMESITE='Lax',
+        PERMANENT_SESSION_LIFETIME=1800  # 30 minutes
+    )
+    quiz_app.register_blueprint(routes)
+
+    if not RUNNING_LOCALLY:
+        # Configure Gunicorn logging
+        gunicorn_logger = logging.getLogger('gunicorn.error')
+        quiz_app.logger.handlers = gunicorn_logger.handlers
+        quiz_app.logger.setLevel(gunicorn_logger.level)
+    return quiz_app
+
+
+app = create_app()
+
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8080))
     debug = os.environ.get('FLASK_DEBUG', '0') != '0'
     app.run(host='0.0.0.0', port=port, debug=debug)
-else:
-    # Configure Gunicorn logging
-    gunicorn_logger = logging.getLogger('gunicorn.error')
-    app.logger.handlers = gunicorn_logger.handlers
-    app.logger.setLevel(gunicorn_logger.level)
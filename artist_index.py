@@ -0,0 +1,75 @@
+"""Artist names as a player types them, for /suggest.
+
+Built alongside the song index each time the library loads, from the cleaned
+artist column the store already carries (see answers.cleaned_artist), so it
+costs one pass over the few thousand distinct leads. Every word of a name is a
+way in - "swi" finds Taylor Swift - and all of them sit in one sorted list, so
+a lookup is two binary searches and a sort of whatever falls between.
+
+Suggestions come from the whole library, ranked the same way whatever is being
+played and whatever the filters, so what comes back can't give the answer away.
+"""
+from bisect import bisect_left
+
+import numpy as np
+
+from answers import clean_guess
+from artists import primary_artist
+
+SUGGESTION_LIMIT = 8
+MIN_QUERY_LENGTH = 2       # One letter narrows nothing down
+
+
+class ArtistIndex:
+    """Every lead artist in one loaded library, a song_store.SongStore.
+
+    Names starting with what was typed come first, then names with a later
+    word starting with it. Within each, artists with more songs come first.
+    """
+
+    def __init__(self, songs):
+        keys = songs.column('ArtistAnswer') if 'ArtistAnswer' in songs.columns else []
+        keys = np.asarray(keys, dtype=object)
+        present = np.flatnonzero([bool(key) for key in keys])
+        leads, first, counts = np.unique(keys[present], return_index=True, return_counts=True)
+        credits = songs.column('Artist')
+        # Shown as the library credits them, without any guests
+        self.names = [primary_artist(credits[present[at]]) for at in first]
+
+        # Most songs first, then alphabetical; an artist's rank is its place here
+        rank = np.empty(len(leads), dtype=np.int64)
+        rank[np.lexsort((leads, -counts))] = np.arange(len(leads))
+
+        entries = []
+        for artist, lead in enumerate(leads):
+            start = 0
+            for word in lead.split(' '):
+                # A name's later words rank after every name's first
+                entries.append((lead[start:], int(rank[artist]) + (len(leads) if start else 0)))
+                start += len(word) + 1
+        entries.sort()
+        self.keys = [key for key, _ in entries]
+        self.priority = np.array([priority for _, priority in entries], dtype=np.int64)
+        self.by_rank = np.argsort(rank)
+
+    def __len__(self):
+        return len(self.names)
+
+    def suggest(self, typed, limit=SUGGESTION_LIMIT):
+        """Up to `limit` artist names that what's been typed could be heading for."""
+        query = clean_guess(str(typed).lower())
+        if len(query) < MIN_QUERY_LENGTH:
+            return []
+        low = bisect_left(self.keys, query)
+        high = bisect_left(self.keys, query + '\U0010ffff', low)
+        if low == high:
+            return []
+
+        found = []
+        for priority in np.sort(self.priority[low:high]):
+            artist = self.by_rank[priority % len(self.names)]
+            if artist not in found:
+                found.append(artist)
+                if len(found) == limit:
+                    break
+        return [self.names[artist] for artist in found]
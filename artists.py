@@ -3,6 +3,8 @@
 Both are applied when the library is loaded, not when it's built, so rebuilding
 from the charts can't quietly undo them. Edit and restart.
 """
+import re
+from functools import lru_cache
 
 # Artist -> which of their songs to leave out:
 #   None            everything they did
@@ -45,20 +47,18 @@ FEATURED_SEPARATORS = (
 )
 
 
+# The separators as one pattern; the earliest one found marks where guests start
+FEATURED = re.compile('|'.join(re.escape(separator) for separator in FEATURED_SEPARATORS))
+
+
 def primary_artist(artist):
     """The billed lead, without any guests.
 
     "Chris Brown featuring Usher and Rick Ross" -> "Chris Brown"
     """
     name = ' '.join(str(artist).split())
-    padded = ' ' + name.lower() + ' '
-
-    cut = len(name)
-    for separator in FEATURED_SEPARATORS:
-        found = padded.find(separator)
-        if found != -1:
-            cut = min(cut, found)
-
+    found = FEATURED.search(' ' + name.lower() + ' ')
+    cut = min(found.start(), len(name)) if found else len(name)
     return name[:cut].strip() or name
 
 
@@ -114,23 +114,47 @@ FEMALE_VOCAL_TAGS = {
 }
 
 
+@lru_cache(maxsize=1)
+def _female_credit_pattern(names):
+    # Prefix match on the whole credit, so joint billings count when she is
+    # named first ("Ella Langley & Morgan Wallen") but not when she is a guest
+    either = '|'.join(re.escape(name) for name in names)
+    return re.compile(rf'(?:{either})(?= |\Z)') if names else re.compile(r'(?!)')
+
+
+def female_credits(credits):
+    """Judge many credits against FEMALE_VOCAL_ARTISTS at once.
+
+    Returns (named, leads): for each credit, whether the list names who leads
+    it, and that lead, normalised.
+    """
+    pattern = _female_credit_pattern(tuple(sorted(FEMALE_VOCAL_ARTISTS)))
+    leads = [normalise_artist(primary_artist(credit)) for credit in credits]
+    named = [lead in FEMALE_VOCAL_ARTISTS or pattern.match(normalise_artist(credit)) is not None
+             for credit, lead in zip(credits, leads)]
+    return named, leads
+
+
+def is_female_credit(artist):
+    """Does FEMALE_VOCAL_ARTISTS name whoever leads this credit?"""
+    named, _ = female_credits([artist])
+    return named[0]
+
+
+def has_female_vocal_tag(genres):
+    """Does a comma-separated tag string carry one of FEMALE_VOCAL_TAGS?"""
+    if not isinstance(genres, str):
+        return False
+    return not FEMALE_VOCAL_TAGS.isdisjoint(tag.strip().lower() for tag in genres.split(','))
+
+
 def is_female_vocal(artist, genres=None):
     """Is this song female-fronted?
 
     The named list wins; tags are the fallback. Judged on the billed lead, so
     "Tim McGraw featuring Taylor Swift" is not counted.
     """
-    # Prefix match on the whole credit, so joint billings count when she is
-    # named first ("Ella Langley & Morgan Wallen") but not when she is a guest.
-    credit = normalise_artist(artist)
-    lead = normalise_artist(primary_artist(artist))
-    for known in FEMALE_VOCAL_ARTISTS:
-        if credit == known or credit.startswith(known + ' ') or lead == known:
-            return True
-
-    if not isinstance(genres, str):
-        return False
-    return any(tag.strip().lower() in FEMALE_VOCAL_TAGS for tag in genres.split(','))
+    return is_female_credit(artist) or has_female_vocal_tag(genres)
 
 
 def normalise_artist(artist):
@@ -142,27 +166,44 @@ def canonical_artist(artist):
     return ARTIST_ALIASES.get(normalise_artist(artist), artist)
 
 
-def is_excluded(artist, year=None):
-    """Should this song be kept out of the quiz?"""
-    name = normalise_artist(artist)
+# exclusion_rule's answer for an artist no rule names
+NOT_EXCLUDED = object()
+
 
-    for excluded, span in EXCLUDED_ARTISTS.items():
-        # Prefix match so joint credits go too ("The Beatles with Billy Preston")
-        if name != excluded and not name.startswith(excluded + ' '):
-            continue
+@lru_cache(maxsize=1)
+def _exclusion_pattern(names):
+    # One regex for every rule, rather than a startswith per rule per song.
+    # Alternatives are tried in the order they're listed, so an artist two
+    # rules could match gets the first one's span, as the loop over the dict
+    # used to give it.
+    if not names:
+        return re.compile(r'(?!)')
+    either = '|'.join(re.escape(name) for name in names)
+    # Prefix match so joint credits go too ("The Beatles with Billy Preston")
+    return re.compile(rf'(?:{either})(?= |\Z)')
 
-        if span is None:
-            return True
 
-        try:
-            released = int(year)
-        except (TypeError, ValueError):
-            # No usable year on a ranged rule - leave it out rather than risk
-            # serving the thing we were asked to remove
-            return True
+def exclusion_rule(artist):
+    """The span EXCLUDED_ARTISTS gives this artist, or NOT_EXCLUDED."""
+    match = _exclusion_pattern(tuple(EXCLUDED_ARTISTS)).match(normalise_artist(artist))
+    return EXCLUDED_ARTISTS[match.group()] if match else NOT_EXCLUDED
 
-        start, until = span
-        return ((start is None or released >= start)
-                and (until is None or released < until))
 
-    return False
+def is_excluded(artist, year=None):
+    """Should this song be kept out of the quiz?"""
+    span = exclusion_rule(artist)
+    if span is NOT_EXCLUDED:
+        return False
+    if span is None:
+        return True
+
+    try:
+        released = int(year)
+    except (TypeError, ValueError):
+        # No usable year on a ranged rule - leave it out rather than risk
+        # serving the thing we were asked to remove
+        return True
+
+    start, until = span
+    return ((start is None or released >= start)
+            and (until is None or released < until))
@@ -0,0 +1,8 @@
+"""Gunicorn settings. Gunicorn reads this from the working directory."""
+
+
+def post_worker_init(worker):
+    # Importing the app loads nothing, so load the library as each worker
+    # boots rather than during whichever request reaches it first
+    from app import start
+    start()
@@ -9,12 +9,17 @@ Year, Decade, Genres, plus PreviewUrl when the library has one stored.
 """
 import logging
 import os
+import re
 import sqlite3
+import threading
+import time
 from contextlib import contextmanager
+from datetime import datetime
 
+import numpy as np
 import pandas as pd
 
-from artists import canonical_artist, is_excluded
+from artists import NOT_EXCLUDED, canonical_artist, exclusion_rule, is_excluded
 
 logger = logging.getLogger(__name__)
 
@@ -29,8 +34,28 @@ if DATABASE_URL.startswith('postgres://'):
     DATABASE_URL = 'postgresql://' + DATABASE_URL[len('postgres://'):]
 USE_POSTGRES = DATABASE_URL.startswith('postgresql://')
 
+# Idle connections each process keeps open for reuse
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '4'))
+# Connections each process has open at once, idle or lent out, and the
+# seconds a borrower waits for one to come free past that
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '10'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+DB_POOL_PING_AFTER = 30     # Seconds idle before a connection is checked on reuse
+
+# Rows upsert_songs writes in one statement
+UPSERT_BATCH_SIZE = int(os.environ.get('UPSERT_BATCH_SIZE', '500'))
+
 if USE_POSTGRES:
     import psycopg2
+    import psycopg2.extensions
+    import psycopg2.extras
+
+    class PreparingConnection(psycopg2.extensions.connection):
+        """A connection that remembers the statements it has prepared."""
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.prepared = set()
 
 
 def sql(query):
@@ -38,64 +63,197 @@ def sql(query):
     return query.replace('?', '%s') if USE_POSTGRES else query
 
 
+def _connect():
+    if USE_POSTGRES:
+        return psycopg2.connect(DATABASE_URL, connection_factory=PreparingConnection)
+    # Pooled connections move between threads, one borrower at a time
+    return sqlite3.connect(SQLITE_PATH, check_same_thread=False)
+
+
+class PoolTimeout(Exception):
+    """No connection came free within the pool's timeout."""
+
+
+class ConnectionPool:
+    """Open connections to one database, kept for reuse by one process.
+
+    Every leaderboard read and score used to open its own connection, which
+    on Heroku Postgres is a TCP, TLS and auth handshake each time. Up to
+    `size` connections are kept idle here; a busier moment opens more, up to
+    `max_size` in all, and they're closed as they come back. Past that a
+    borrower waits up to `timeout` seconds for one, then gets PoolTimeout.
+    One idle longer than `ping_after` seconds is checked before it's handed
+    out, and replaced if it's gone.
+    """
+
+    def __init__(self, connect, target=None, size=DB_POOL_SIZE, max_size=DB_POOL_MAX,
+                 timeout=DB_POOL_TIMEOUT, ping_after=DB_POOL_PING_AFTER):
+        self.connect = connect
+        self.target = target
+        self.size = size
+        self.max_size = max(size, max_size)
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self.idle = []          # (connection, when it came back), newest last
+        self.lock = threading.Lock()
+        self.returned = threading.Condition(self.lock)
+        self.open = 0           # Idle or lent out
+        self.opened = 0
+        self.reused = 0
+
+    def _usable(self, conn, idle_for):
+        if getattr(conn, 'closed', 0):      # psycopg2 knows when it's been cut off
+            return False
+        if idle_for < self.ping_after:
+            return True
+        try:
+            conn.cursor().execute('SELECT 1')
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _take(self, deadline):
+        """An idle connection, or None once one may be opened in its place."""
+        with self.lock:
+            while not self.idle and self.open >= self.max_size:
+                left = deadline - time.monotonic()
+                if left <= 0 or not self.returned.wait(left):
+                    raise PoolTimeout(f'All {self.max_size} connections stayed busy '
+                                      f'for {self.timeout:g}s')
+            if self.idle:
+                return self.idle.pop()
+            self.open += 1
+            self.opened += 1
+            return None
+
+    def acquire(self):
+        """An open connection, reused if one is idle."""
+        deadline = time.monotonic() + self.timeout
+        while True:
+            taken = self._take(deadline)
+            if taken is None:
+                break
+            conn, since = taken
+            if self._usable(conn, time.monotonic() - since):
+                with self.lock:
+                    self.reused += 1
+                return conn
+            self._discard(conn)
+        try:
+            return self.connect()
+        except BaseException:
+            self._closed()
+            raise
+
+    def release(self, conn):
+        """Take `conn` back. Whatever it left uncommitted is rolled back, as
+        closing it used to; one that can't be is closed instead.
+        """
+        try:
+            conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append((conn, time.monotonic()))
+                self.returned.notify()
+                return
+        self._discard(conn)
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self.lock:
+            return {'size': self.size, 'max_size': self.max_size, 'open': self.open,
+                    'idle': len(self.idle), 'opened': self.opened, 'reused': self.reused}
+
+    def _closed(self):
+        with self.lock:
+            self.open -= 1
+            self.returned.notify()
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        self._closed()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+# Pools a forked child inherited. Their connections share the parent's sockets,
+# so the child must neither use them nor close them - closing would end the
+# parent's sessions - and holding them here keeps them from being collected.
+_inherited = []
+
+
+def connection_pool():
+    """This process's pool for the configured database."""
+    global _pool
+    target = DATABASE_URL if USE_POSTGRES else SQLITE_PATH
+    pool = _pool
+    if pool is None or pool.target != target:
+        with _pool_lock:
+            if _pool is None or _pool.target != target:
+                if _pool is not None:
+                    _pool.close()
+                _pool = ConnectionPool(_connect, target)
+            pool = _pool
+    return pool
+
+
+def _after_fork_in_child():
+    # A gunicorn worker starts with a pool of its own
+    global _pool, _pool_lock
+    if _pool is not None:
+        _inherited.append(_pool)
+    _pool, _pool_lock = None, threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):     # Not on Windows, which has no fork
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
 @contextmanager
 def get_db():
-    conn = psycopg2.connect(DATABASE_URL) if USE_POSTGRES else sqlite3.connect(SQLITE_PATH)
+    """A connection from this process's pool, handed back when the block ends."""
+    pool = connection_pool()
+    conn = pool.acquire()
     try:
         yield conn
     finally:
-        conn.close()
-
-
-SONGS_SCHEMA = '''
-CREATE TABLE IF NOT EXISTS songs (
-    {id_column},
-    song TEXT NOT NULL,
-    artist TEXT NOT NULL,
-    year INTEGER NOT NULL,
-    decade TEXT NOT NULL,
-    genres TEXT,
-    year_end_rank INTEGER,
-    chart_peak INTEGER,
-    weeks_on_chart INTEGER,
-    last_charted DATE,
-    preview_url TEXT,
-    preview_source TEXT,
-    preview_id TEXT,
-    preview_checked_at TIMESTAMP,
-    playable BOOLEAN,
-    UNIQUE (song, artist)
-)
-'''
+        pool.release(conn)
 
 
-# Columns added after the table first shipped, so existing databases get them
-LATER_COLUMNS = {'preview_id': 'TEXT'}
+PLACEHOLDER = re.compile(r'\?')
 
 
-def _existing_columns(cursor):
-    if USE_POSTGRES:
-        cursor.execute("SELECT column_name FROM information_schema.columns "
-                       "WHERE table_name = 'songs'")
-        return {row[0] for row in cursor.fetchall()}
-    cursor.execute('PRAGMA table_info(songs)')
-    return {row[1] for row in cursor.fetchall()}
-
+def execute_prepared(cursor, name, query, params=()):
+    """Run `query`, written with '?' placeholders, as the statement `name`.
 
-def init_songs_table():
-    id_column = ('id SERIAL PRIMARY KEY' if USE_POSTGRES
-                 else 'id INTEGER PRIMARY KEY AUTOINCREMENT')
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute(SONGS_SCHEMA.format(id_column=id_column))
-
-        present = _existing_columns(cursor)
-        for column, column_type in LATER_COLUMNS.items():
-            if column not in present:
-                cursor.execute(f'ALTER TABLE songs ADD COLUMN {column} {column_type}')
-                logger.info(f'Added missing column songs.{column}')
-
-        conn.commit()
+    On Postgres it's prepared once per connection and executed by name from
+    then on, so the server parses and plans it once rather than per call.
+    sqlite3 already keeps each connection's compiled statements, which pooled
+    connections now live long enough to reuse.
+    """
+    prepared = getattr(cursor.connection, 'prepared', None)
+    if prepared is None:
+        cursor.execute(sql(query), params)
+        return
+    if name not in prepared:
+        numbers = iter(range(1, len(params) + 1))
+        cursor.execute(f'PREPARE {name} AS '
+                       + PLACEHOLDER.sub(lambda _: f'${next(numbers)}', query))
+        prepared.add(name)
+    arguments = f' ({", ".join(["%s"] * len(params))})' if params else ''
+    cursor.execute(f'EXECUTE {name}{arguments}', params)
 
 
 def songs_table_exists():
@@ -115,57 +273,186 @@ def decade_for(year):
 
 COLUMNS = ['song', 'artist', 'year', 'decade', 'genres', 'year_end_rank',
            'chart_peak', 'weeks_on_chart', 'last_charted', 'preview_url',
-           'preview_source', 'preview_id', 'preview_checked_at', 'playable']
+           'preview_source', 'preview_id', 'preview_checked_at', 'playable',
+           'play_failures', 'updated_at', 'generation', 'play_generation']
+
+# As the songs table declares them (see migrations.songs_table)
+COLUMN_TYPES = {
+    'song': 'TEXT', 'artist': 'TEXT', 'year': 'INTEGER', 'decade': 'TEXT',
+    'genres': 'TEXT', 'year_end_rank': 'INTEGER', 'chart_peak': 'INTEGER',
+    'weeks_on_chart': 'INTEGER', 'last_charted': 'DATE', 'preview_url': 'TEXT',
+    'preview_source': 'TEXT', 'preview_id': 'TEXT', 'preview_checked_at': 'TIMESTAMP',
+    'playable': 'BOOLEAN', 'play_failures': 'INTEGER', 'updated_at': 'TIMESTAMP',
+    'generation': 'INTEGER', 'play_generation': 'INTEGER',
+}
 
 # A row can only be inserted if it carries everything the schema requires
 REQUIRED = ('song', 'artist', 'year', 'decade')
 
 
-def upsert_songs(rows):
-    """Insert or update songs, keyed on (song, artist). Never deletes.
+def next_generation(cursor, kind='songs'):
+    """Claim the next generation of `kind` for a write to the songs table, in
+    the transaction `cursor` is in. Every song written is stamped with it.
 
-    `rows` is a list of dicts. Only the keys present are written, so an audio
-    pass doesn't wipe chart data and vice versa.
+    'songs' is the catalog - what a song is and where its audio comes from -
+    and 'plays' what happened when it came up (see record_plays). The
+    counter's row stays locked until that transaction ends, so another write
+    of the same kind waits here and generations are handed out in commit
+    order. See library_version.
+    """
+    cursor.execute(sql('UPDATE library_changes SET generation = generation + 1 '
+                       'WHERE kind = ? RETURNING generation'), (kind,))
+    return cursor.fetchone()[0]
+
+
+def delete_songs(cursor, where, params=()):
+    """Delete the songs matching `where`, in the transaction `cursor` is in.
+    Returns how many went.
+
+    A deleted row leaves nothing behind to be read back since a generation,
+    so the delete claims a catalog generation and records it as the last
+    one that deleted; see deleted_since.
+    """
+    generation = next_generation(cursor)
+    cursor.execute(sql("UPDATE library_changes SET generation = ? WHERE kind = 'deletes'"),
+                   (generation,))
+    cursor.execute(sql(f'DELETE FROM songs WHERE {where}'), params)
+    return cursor.rowcount
+
+
+def _write_batch(cursor, present, rows):
+    """Write rows that all carry the columns `present`: one statement on
+    Postgres, one executemany on SQLite. No two rows may be the same song.
 
     Rows carrying the required columns are inserted or merged. Partial rows -
     an audio or genre pass, say - are updates only: Postgres checks NOT NULL
     before ON CONFLICT can resolve, so they can't go through an insert.
     """
+    updatable = [c for c in present if c not in ('song', 'artist')]
+    columns = ', '.join(present)
+    insert = all(c in present for c in REQUIRED)
+    updates = ', '.join(f'{c} = excluded.{c}' for c in updatable)
+    conflict = ('ON CONFLICT (song, artist) '
+                + (f'DO UPDATE SET {updates}' if updates else 'DO NOTHING'))
+
+    if USE_POSTGRES:
+        if insert:
+            statement = f'INSERT INTO songs ({columns}) VALUES %s {conflict}'
+        else:
+            assignments = ', '.join(f'{c} = batch.{c}' for c in updatable)
+            statement = (f'UPDATE songs SET {assignments} '
+                         f'FROM (VALUES %s) AS batch ({columns}) '
+                         f'WHERE songs.song = batch.song AND songs.artist = batch.artist')
+        # Typed, since a VALUES column that's all NULL would otherwise be text
+        template = '(' + ', '.join(f'%s::{COLUMN_TYPES[c]}' for c in present) + ')'
+        psycopg2.extras.execute_values(cursor, statement,
+                                       [[row[c] for c in present] for row in rows],
+                                       template=template, page_size=len(rows))
+    elif insert:
+        placeholders = ', '.join('?' for _ in present)
+        cursor.executemany(f'INSERT INTO songs ({columns}) VALUES ({placeholders}) {conflict}',
+                           [[row[c] for c in present] for row in rows])
+    else:
+        assignments = ', '.join(f'{c} = ?' for c in updatable)
+        cursor.executemany(f'UPDATE songs SET {assignments} WHERE song = ? AND artist = ?',
+                           [[row[c] for c in updatable] + [row['song'], row['artist']]
+                            for row in rows])
+
+
+def upsert_songs(rows, batch_size=None):
+    """Insert or update songs, keyed on (song, artist). Never deletes.
+
+    `rows` is a list of dicts. Only the keys present are written, so an audio
+    pass doesn't wipe chart data and vice versa. Every row written is stamped
+    with updated_at and the write's generation, which is how a running app
+    notices - see library_version.
+
+    Rows with the same columns are written together, up to `batch_size`
+    (UPSERT_BATCH_SIZE) at a time. A song that comes up twice is written in
+    the order given: everything pending goes out before its second row.
+    A row that can't be inserted and has nothing to set but its key is
+    skipped. Returns the number of rows written.
+    """
+    # Decided on the caller's columns, before the stamps give every row some
+    rows = [row for row in rows
+            if all(c in row for c in REQUIRED)
+            or any(c in COLUMNS for c in row if c not in ('song', 'artist'))]
     if not rows:
         return 0
+    batch_size = batch_size or UPSERT_BATCH_SIZE
 
     written = 0
+    updated_at = datetime.now()
+    pending = {}        # Columns present -> rows carrying them
+    keys = set()        # The songs in `pending`
     with get_db() as conn:
         cursor = conn.cursor()
+        generation = next_generation(cursor)
         for row in rows:
-            present = [c for c in COLUMNS if c in row]
-            updatable = [c for c in present if c not in ('song', 'artist')]
-
-            if all(c in row for c in REQUIRED):
-                placeholders = ', '.join('?' for _ in present)
-                updates = ', '.join(f'{c} = excluded.{c}' for c in updatable)
-                statement = (
-                    f"INSERT INTO songs ({', '.join(present)}) "
-                    f"VALUES ({placeholders}) ON CONFLICT (song, artist) "
-                    + (f"DO UPDATE SET {updates}" if updates else "DO NOTHING")
-                )
-                cursor.execute(sql(statement), [row[c] for c in present])
-            elif updatable:
-                assignments = ', '.join(f'{c} = ?' for c in updatable)
-                cursor.execute(
-                    sql(f'UPDATE songs SET {assignments} '
-                        f'WHERE song = ? AND artist = ?'),
-                    [row[c] for c in updatable] + [row['song'], row['artist']],
-                )
-            else:
-                continue
-
+            row = {**row, 'updated_at': updated_at, 'generation': generation}
+            key = (row['song'], row['artist'])
+            if key in keys:
+                for present, batch in pending.items():
+                    _write_batch(cursor, present, batch)
+                pending.clear()
+                keys.clear()
+
+            present = tuple(c for c in COLUMNS if c in row)
+            batch = pending.setdefault(present, [])
+            batch.append(row)
+            keys.add(key)
             written += 1
+            if len(batch) >= batch_size:
+                _write_batch(cursor, present, batch)
+                del pending[present]
+                keys.difference_update((done['song'], done['artist']) for done in batch)
+
+        for present, batch in pending.items():
+            _write_batch(cursor, present, batch)
         conn.commit()
 
     return written
 
 
+# Failed play-time lookups in a row before a song is taken out of play. The
+# next tools.refresh_library audit looks again and puts it back if it can.
+PLAY_FAILURE_LIMIT = 3
+
+# By whether the song played: a play clears the count, a failure adds to it
+RECORD_PLAY = {
+    played: (f'UPDATE songs SET play_failures = {count}, '
+             f'playable = CASE WHEN {count} >= ? THEN ? ELSE playable END, '
+             'updated_at = ?, play_generation = ? WHERE song = ? AND artist = ?')
+    for played, count in ((True, '?'), (False, 'COALESCE(play_failures, 0) + ?'))
+}
+
+
+def record_plays(outcomes):
+    """Write back what happened when songs came up in a game.
+
+    `outcomes` maps (song, artist) to (played, failures): whether the song
+    played at all, and how many failures followed. A play clears the count;
+    failures add to it, and reaching PLAY_FAILURE_LIMIT marks the song
+    unplayable. See play_reports.py.
+    """
+    if not outcomes:
+        return 0
+
+    updated_at = datetime.now()
+    with get_db() as conn:
+        cursor = conn.cursor()
+        # Not the catalog's generation: a play leaves the library as derived,
+        # and stored snapshots, current (see load_plays)
+        generation = next_generation(cursor, 'plays')
+        for (song, artist), (played, failures) in outcomes.items():
+            cursor.execute(sql(RECORD_PLAY[played]),
+                           (failures, failures, PLAY_FAILURE_LIMIT, False, updated_at,
+                            generation, song, artist))
+        conn.commit()
+
+    return len(outcomes)
+
+
 def _load_from_csv():
     for path, encoding in ((CSV_FILE, 'utf-8'), (FALLBACK_CSV_FILE, 'latin1')):
         try:
@@ -177,23 +464,28 @@ def _load_from_csv():
     return None
 
 
-def _load_from_postgres():
-    columns = ['song', 'artist', 'year', 'decade', 'genres', 'year_end_rank',
-               'preview_url', 'preview_source', 'preview_id', 'playable']
+LOADED_COLUMNS = ['id', 'song', 'artist', 'year', 'decade', 'genres', 'year_end_rank',
+                  'preview_url', 'preview_source', 'preview_id', 'playable',
+                  'play_failures']
+
+
+def _read_songs(where='', params=()):
+    """Rows in the shape app.py expects, indexed by songs.id, with Playable."""
     # A plain cursor rather than pandas.read_sql_query, which only officially
     # supports SQLAlchemy connectables and warns about a raw DBAPI connection
     with get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute(f"SELECT {', '.join(columns)} FROM songs")
-        df = pd.DataFrame(cursor.fetchall(), columns=columns)
+        cursor.execute(sql(f"SELECT {', '.join(LOADED_COLUMNS)} FROM songs {where}"),
+                       params)
+        df = pd.DataFrame(cursor.fetchall(), columns=LOADED_COLUMNS)
+
+    # The row id is the song's label in the app, so it survives a reload
+    df = df.set_index('id')
+    df.index.name = None
 
     # A song with no preview can never be a round, so keep it out of play.
     # Not yet checked (NULL) still counts as fair game.
-    playable = df['playable'].apply(lambda v: True if pd.isna(v) else bool(v))
-    excluded = int((~playable).sum())
-    if excluded:
-        logger.info(f'Excluded {excluded} songs with no preview')
-    df = df[playable]
+    df['playable'] = df['playable'].apply(lambda v: True if pd.isna(v) else bool(v)).astype(bool)
 
     return df.rename(columns={
         'song': 'Song',
@@ -205,28 +497,177 @@ def _load_from_postgres():
         'preview_url': 'PreviewUrl',
         'preview_source': 'PreviewSource',
         'preview_id': 'PreviewId',
+        'playable': 'Playable',
+        'play_failures': 'PlayFailures',
     })
 
 
+def _load_from_postgres():
+    df = _read_songs()
+    excluded = int((~df['Playable']).sum())
+    if excluded:
+        logger.info(f'Excluded {excluded} songs with no preview')
+    return df[df['Playable']].drop(columns='Playable')
+
+
 def _apply_artist_rules(df):
-    """Tidy artist names, then drop the ones held out. See artists.py."""
+    """Tidy artist names, then drop the ones held out. See artists.py.
+
+    The rules are looked up once per distinct credit - a few thousand, however
+    many songs carry them - and the answers spread back over the songs.
+    """
     if df is None or df.empty or 'Artist' not in df.columns:
         return df
 
     df = df.copy()
-    df['Artist'] = [canonical_artist(a) for a in df['Artist']]
-
-    years = pd.to_numeric(df.get('Year'), errors='coerce')
-    excluded = [
-        is_excluded(artist, None if pd.isna(year) else year)
-        for artist, year in zip(df['Artist'], years)
-    ]
-
-    dropped = sum(excluded)
+    codes, credits = pd.factorize(df['Artist'])
+    names = np.array([canonical_artist(credit) for credit in credits], dtype=object)
+    known = codes >= 0
+    artists = df['Artist'].to_numpy(dtype=object, copy=True)
+    artists[known] = names[codes[known]]
+    df['Artist'] = artists
+
+    # Each credit's rule: all their songs, a span of years, or none
+    held = np.zeros(len(names), dtype=bool)
+    start = np.full(len(names), np.nan)
+    until = np.full(len(names), np.nan)
+    for position, rule in enumerate(exclusion_rule(name) for name in names):
+        if rule is None:
+            held[position] = True
+        elif rule is not NOT_EXCLUDED:
+            start[position] = -np.inf if rule[0] is None else rule[0]
+            until[position] = np.inf if rule[1] is None else rule[1]
+
+    years = (pd.to_numeric(df['Year'], errors='coerce') if 'Year' in df.columns
+             else pd.Series(np.nan, index=df.index))
+    # Whole years, as is_excluded's int() takes them
+    released = np.trunc(years.to_numpy(dtype=float))
+
+    excluded = np.zeros(len(df), dtype=bool)
+    credit, year = codes[known], released[known]
+    # A ranged rule with no usable year holds the song out, as is_excluded does
+    in_span = np.isnan(year) | ((year >= start[credit]) & (year < until[credit]))
+    excluded[known] = held[credit] | (~np.isnan(start[credit]) & in_span)
+    for position in np.flatnonzero(~known):
+        # A missing credit; rare enough to ask the slow way
+        excluded[position] = is_excluded(
+            artists[position], None if np.isnan(released[position]) else years.iloc[position])
+
+    dropped = int(excluded.sum())
     if dropped:
         logger.info(f'Excluded {dropped} songs by held-out artists')
 
-    return df[[not flag for flag in excluded]]
+    return df[~excluded]
+
+
+LIBRARY_VERSION = ("SELECT kind, generation FROM library_changes "
+                   "WHERE kind IN ('songs', 'plays')")
+
+
+def library_version():
+    """The songs table's generations, (catalog, plays): the last write of
+    each kind that committed. See next_generation.
+
+    Generations commit in order, so a song written after a read of this
+    carries a later one - however the writers' clocks disagree. Two rows'
+    read, so an app can afford to ask every few minutes.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(LIBRARY_VERSION)
+        generations = dict(cursor.fetchall())
+    return generations.get('songs'), generations.get('plays')
+
+
+def load_changes(since):
+    """Songs written after `since`, a catalog generation from library_version.
+
+    Returns (songs, written): the ones still in play, shaped and filtered as
+    load_songs would, and the labels of every song written - including those
+    now unplayable or held out - so a caller can drop its stale copies.
+    """
+    df = _read_songs('WHERE generation > ?', (since,))
+    written = df.index
+    songs = _apply_artist_rules(df[df['Playable']].drop(columns='Playable'))
+    logger.info(f'{len(written)} songs written since {since}, {len(songs)} in play')
+    return songs, written
+
+
+PLAYS_SINCE = 'SELECT id, play_failures, playable FROM songs WHERE play_generation > ?'
+
+
+def deleted_since(since):
+    """Whether any song was deleted after `since`, a catalog generation.
+    load_changes can't see those, so a caller has to read everything again.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT generation FROM library_changes WHERE kind = 'deletes'")
+        row = cursor.fetchone()
+    return row is not None and row[0] > since
+
+
+def load_plays(since):
+    """What came of songs' plays after `since`, a plays generation from
+    library_version: PlayFailures and Playable by label, as they stand now.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(sql(PLAYS_SINCE), (since,))
+        df = pd.DataFrame(cursor.fetchall(), columns=['id', 'PlayFailures', 'Playable'])
+    df = df.set_index('id')
+    df.index.name = None
+    df['PlayFailures'] = pd.to_numeric(df['PlayFailures']).fillna(0).astype(int)
+    df['Playable'] = df['Playable'].apply(lambda v: True if pd.isna(v) else bool(v)).astype(bool)
+    return df
+
+
+SNAPSHOT_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS library_snapshots (
+    derivation TEXT PRIMARY KEY,
+    library_version TEXT NOT NULL,
+    data {blob_type} NOT NULL,
+    created_at TIMESTAMP
+)
+'''
+
+
+def save_snapshot(derivation, version, data):
+    """Store snapshot bytes for the library at `version`, the catalog
+    generation from library_version. Plays don't date a snapshot; the app
+    lays those written since it was made over it.
+
+    `derivation` names how the snapshot was made (see
+    quiz_library.derivation); one is kept for each, replacing the last.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(SNAPSHOT_SCHEMA.format(blob_type='BYTEA' if USE_POSTGRES else 'BLOB'))
+        cursor.execute(sql(
+            'INSERT INTO library_snapshots (derivation, library_version, data, created_at) '
+            'VALUES (?, ?, ?, ?) ON CONFLICT (derivation) DO UPDATE SET '
+            'library_version = excluded.library_version, data = excluded.data, '
+            'created_at = excluded.created_at'
+        ), (derivation, repr(version), data, datetime.now()))
+        conn.commit()
+
+
+def load_snapshot(derivation, version):
+    """The stored snapshot bytes for `derivation` at exactly `version`, a
+    catalog generation, or None if there aren't any - never stored, or the
+    catalog has moved on.
+    """
+    with get_db() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(sql('SELECT data FROM library_snapshots '
+                               'WHERE derivation = ? AND library_version = ?'),
+                           (derivation, repr(version)))
+        except Exception as e:
+            logger.info(f'No stored library snapshot: {e}')
+            return None
+        row = cursor.fetchone()
+    return bytes(row[0]) if row else None
 
 
 def load_songs():
@@ -0,0 +1,114 @@
+"""Resolving each player's next clip while they're still guessing this one.
+
+Finding audio is most of a round's wait: a Deezer call at best, a full search
+at worst. So once a song is served, a background worker picks and resolves the
+player's next one for the same filters, and the next /new-song just hands it
+over.
+
+Slots live in this process only. Under several gunicorn workers a player's next
+request may land elsewhere; that worker finds no slot and picks as usual.
+"""
+import logging
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from threading import Lock
+
+from previews import FRESH_FOR
+
+logger = logging.getLogger(__name__)
+
+MAX_SLOTS = 500          # Players with a clip waiting; the oldest go first
+# Seconds to wait on a slot that's still resolving. Short: picking afresh is
+# what the request would have done anyway, so waiting long only adds to it.
+TAKE_TIMEOUT = 0.25
+
+
+class Slot:
+    """A pick being made ahead of time, and the filters it was made for."""
+
+    def __init__(self, filters, future):
+        self.filters = filters
+        self.future = future
+
+
+class Lookahead:
+    """A pool of workers, each filling one player's next-song slot.
+
+    `choose` is called as choose(genres, decades, recent) and returns a pick
+    (see app.choose_song); `refresh` takes a stale pick and returns it with a
+    fresh URL, or None.
+    """
+
+    def __init__(self, choose, refresh, workers):
+        self.choose = choose
+        self.refresh = refresh
+        self.workers = workers
+        self._executor = None
+        self._slots = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _pool(self):
+        # Made on first use, so each gunicorn worker gets its own threads after
+        # the fork rather than a copy of a pool whose threads didn't survive it
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                thread_name_prefix='lookahead')
+        return self._executor
+
+    def prepare(self, player, genres, decades, recent):
+        """Start resolving `player`'s next song, replacing any slot they had."""
+        filters = (tuple(genres or ()), tuple(decades or ()))
+        future = self._pool().submit(self._resolve, genres, decades, frozenset(recent))
+        with self._lock:
+            self._slots[player] = Slot(filters, future)
+            self._slots.move_to_end(player)
+            while len(self._slots) > MAX_SLOTS:
+                _, dropped = self._slots.popitem(last=False)
+                dropped.future.cancel()
+
+    def _resolve(self, genres, decades, recent):
+        try:
+            return self.choose(genres, decades, recent)
+        except Exception as e:
+            logger.warning(f'Lookahead pick failed: {e}')
+            return None
+
+    def take(self, player, genres, decades):
+        """The pick waiting for `player` under these filters, or None."""
+        with self._lock:
+            slot = self._slots.pop(player, None)
+
+        filters = (tuple(genres or ()), tuple(decades or ()))
+        if slot is None or slot.filters != filters:
+            if slot is not None:
+                slot.future.cancel()
+            self.misses += 1
+            return None
+
+        try:
+            pick = slot.future.result(timeout=TAKE_TIMEOUT)
+        except TimeoutError:
+            slot.future.cancel()
+            pick = None
+        if pick is None or pick.song is None:
+            self.misses += 1
+            return None
+
+        # A signed URL is only handed out while fresh; past that the song is
+        # kept but its URL fetched again. See previews.FRESH_FOR.
+        if pick.expires and time.time() - pick.resolved_at > FRESH_FOR:
+            pick = self.refresh(pick)
+            if pick is None:
+                self.misses += 1
+                return None
+
+        self.hits += 1
+        return pick
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
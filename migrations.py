@@ -0,0 +1,224 @@
+"""Schema changes to the songs and leaderboard tables, numbered and run once.
+
+Each database records the migrations it has had in schema_migrations, and
+migrate() applies whichever it's missing, in order - at app boot and before
+the library tools write. A change to the schema is a new entry at the end of
+MIGRATIONS; entries already shipped are never edited, since databases out
+there have run them.
+
+The first few describe the schema as it stood before this existed, so they
+are written to be harmless against a database that already has it: they
+create what's missing and leave the rest.
+"""
+import logging
+
+from library import USE_POSTGRES, get_db, sql
+
+logger = logging.getLogger(__name__)
+
+# Any fixed number; on Postgres, migrate() holds it so two processes booting
+# together don't both run the same migration
+LOCK_KEY = 7431
+
+SCHEMA_MIGRATIONS = '''
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at TIMESTAMP
+)
+'''
+
+
+def _id_column():
+    return 'id SERIAL PRIMARY KEY' if USE_POSTGRES else 'id INTEGER PRIMARY KEY AUTOINCREMENT'
+
+
+def _columns(cursor, table):
+    if USE_POSTGRES:
+        cursor.execute(sql('SELECT column_name FROM information_schema.columns '
+                           'WHERE table_name = ?'), (table,))
+        return {row[0] for row in cursor.fetchall()}
+    cursor.execute(f'PRAGMA table_info({table})')
+    return {row[1] for row in cursor.fetchall()}
+
+
+def songs_table(cursor):
+    cursor.execute(f'''
+    CREATE TABLE IF NOT EXISTS songs (
+        {_id_column()},
+        song TEXT NOT NULL,
+        artist TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        decade TEXT NOT NULL,
+        genres TEXT,
+        year_end_rank INTEGER,
+        chart_peak INTEGER,
+        weeks_on_chart INTEGER,
+        last_charted DATE,
+        preview_url TEXT,
+        preview_source TEXT,
+        preview_id TEXT,
+        preview_checked_at TIMESTAMP,
+        playable BOOLEAN,
+        play_failures INTEGER,
+        updated_at TIMESTAMP,
+        UNIQUE (song, artist)
+    )
+    ''')
+    # Added after the table first shipped, so databases from then lack them
+    present = _columns(cursor, 'songs')
+    for column, column_type in (('preview_id', 'TEXT'), ('play_failures', 'INTEGER'),
+                                ('updated_at', 'TIMESTAMP')):
+        if column not in present:
+            cursor.execute(f'ALTER TABLE songs ADD COLUMN {column} {column_type}')
+            logger.info(f'Added missing column songs.{column}')
+    # Kept MAX(updated_at) to an index lookup; library_changes does that job now
+    cursor.execute('CREATE INDEX IF NOT EXISTS songs_updated_at ON songs (updated_at)')
+
+
+def scores_table(cursor):
+    cursor.execute(f'''
+    CREATE TABLE IF NOT EXISTS scores (
+        {_id_column()},
+        username TEXT NOT NULL,
+        score INTEGER NOT NULL,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+
+# Each player's career rolled up from their games in `scores`, so the board
+# is a read of its top rows (see app.record_score). Players are grouped
+# case-insensitively and shown by the first of their spellings in sort order.
+BACKFILL_PLAYER_TOTALS = '''
+    INSERT INTO player_totals (player, username, total, games, best)
+    SELECT LOWER(username), MIN(username), SUM(score), COUNT(*), MAX(score)
+    FROM scores
+    GROUP BY LOWER(username)
+'''
+
+
+def player_totals_table(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS player_totals (
+        player TEXT PRIMARY KEY,
+        username TEXT NOT NULL,
+        total INTEGER NOT NULL,
+        games INTEGER NOT NULL,
+        best INTEGER NOT NULL
+    )
+    ''')
+    # The board's order, so its top rows are an index read
+    cursor.execute('CREATE INDEX IF NOT EXISTS player_totals_rank '
+                   'ON player_totals (total DESC, games ASC)')
+    # Games recorded before the rollup existed. A database that had the rollup
+    # before it had migrations already holds them.
+    cursor.execute('SELECT 1 FROM player_totals LIMIT 1')
+    if cursor.fetchone() is None:
+        cursor.execute(BACKFILL_PLAYER_TOTALS)
+        if cursor.rowcount > 0:
+            logger.info(f'Rolled up {cursor.rowcount} players from past scores')
+
+
+def refresh_indexes(cursor):
+    # The audio step: unchecked songs first, then the least recently checked
+    cursor.execute('CREATE INDEX IF NOT EXISTS songs_preview_checked_at '
+                   'ON songs (preview_checked_at)')
+    # The genre step: only the few songs still without genres are indexed
+    cursor.execute("CREATE INDEX IF NOT EXISTS songs_needing_genres ON songs (artist) "
+                   "WHERE genres IS NULL OR genres = ''")
+    # Writing an artist's genres; (song, artist) is unique, but song leads
+    cursor.execute('CREATE INDEX IF NOT EXISTS songs_artist ON songs (artist)')
+    # A player's games, grouped as the rollup groups them
+    cursor.execute('CREATE INDEX IF NOT EXISTS scores_player ON scores (LOWER(username))')
+
+
+def song_generations(cursor):
+    # One counter per kind of change, bumped inside each write's transaction.
+    # Writers queue on its row until they commit, so generations are handed
+    # out in commit order - which updated_at, an app-side clock, is not.
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS library_changes (
+        kind TEXT PRIMARY KEY,
+        generation INTEGER NOT NULL
+    )
+    ''')
+    cursor.execute("INSERT INTO library_changes (kind, generation) VALUES ('songs', 0) "
+                   "ON CONFLICT (kind) DO NOTHING")
+    if 'generation' not in _columns(cursor, 'songs'):
+        cursor.execute('ALTER TABLE songs ADD COLUMN generation INTEGER')
+    cursor.execute('UPDATE songs SET generation = 0 WHERE generation IS NULL')
+    # What a running app reads to catch up: songs written past a generation
+    cursor.execute('CREATE INDEX IF NOT EXISTS songs_generation ON songs (generation)')
+
+
+def play_generations(cursor):
+    # Plays get a counter of their own, so they don't date the catalog - and
+    # the snapshots keyed on it - every few minutes
+    cursor.execute("INSERT INTO library_changes (kind, generation) VALUES ('plays', 0) "
+                   "ON CONFLICT (kind) DO NOTHING")
+    if 'play_generation' not in _columns(cursor, 'songs'):
+        cursor.execute('ALTER TABLE songs ADD COLUMN play_generation INTEGER')
+    cursor.execute('UPDATE songs SET play_generation = 0 WHERE play_generation IS NULL')
+    cursor.execute('CREATE INDEX IF NOT EXISTS songs_play_generation ON songs (play_generation)')
+
+
+def song_deletions(cursor):
+    # The catalog generation of the last delete, which leaves no row to find
+    cursor.execute("INSERT INTO library_changes (kind, generation) VALUES ('deletes', 0) "
+                   "ON CONFLICT (kind) DO NOTHING")
+
+
+def board_tiebreak(cursor):
+    # The board's order now ends on the player, so that a tie at the cut-off
+    # is settled the same way the rank is counted
+    cursor.execute('DROP INDEX IF EXISTS player_totals_rank')
+    cursor.execute('CREATE INDEX player_totals_rank '
+                   'ON player_totals (total DESC, games ASC, player ASC)')
+
+
+# (version, name, apply); append only
+MIGRATIONS = [
+    (1, 'songs table', songs_table),
+    (2, 'scores table', scores_table),
+    (3, 'player totals', player_totals_table),
+    (4, 'indexes for the refresh job and players', refresh_indexes),
+    (5, 'song generations', song_generations),
+    (6, 'play generations', play_generations),
+    (7, 'song deletions', song_deletions),
+    (8, 'board tiebreak', board_tiebreak),
+]
+
+
+def migrate(migrations=MIGRATIONS):
+    """Apply the migrations this database hasn't had. Returns their versions.
+
+    Each one commits along with its schema_migrations row, so a failure
+    leaves every earlier migration in place and this one to run again.
+    """
+    ran = []
+    with get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(SCHEMA_MIGRATIONS)
+        conn.commit()
+        if USE_POSTGRES:
+            cursor.execute(sql('SELECT pg_advisory_lock(?)'), (LOCK_KEY,))
+        try:
+            # Read under the lock: whoever held it may have just run some
+            cursor.execute('SELECT version FROM schema_migrations')
+            done = {row[0] for row in cursor.fetchall()}
+            for version, name, apply in migrations:
+                if version in done:
+                    continue
+                apply(cursor)
+                cursor.execute(sql('INSERT INTO schema_migrations (version, name, applied_at) '
+                                   'VALUES (?, ?, CURRENT_TIMESTAMP)'), (version, name))
+                conn.commit()
+                ran.append(version)
+                logger.info(f'Schema migration {version}: {name}')
+        finally:
+            if USE_POSTGRES:
+                conn.rollback()
+                cursor.execute(sql('SELECT pg_advisory_unlock(?)'), (LOCK_KEY,))
+                conn.commit()
+    return ran
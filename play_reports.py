@@ -0,0 +1,75 @@
+"""Telling the library which songs failed to play.
+
+When a round can't find audio for a song, every other player - and every
+other gunicorn worker - would otherwise draw the same dead song and pay for
+the same failed lookups. So outcomes seen at play time are queued here and
+written back in batches by a background thread, never on the request path.
+library.record_plays does the writing; load_songs reads the counts back.
+"""
+import atexit
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+FLUSH_EVERY = 25        # Songs with news before the writer wakes early
+FLUSH_INTERVAL = 30     # Seconds between writes otherwise
+
+
+class PlayReports:
+    """Play-time outcomes by (song, artist), collapsed until written.
+
+    `write` is called with {(song, artist): (played, failures)}: whether the
+    song played since the last write, and how many failures came after that.
+    """
+
+    def __init__(self, write, flush_every=FLUSH_EVERY, interval=FLUSH_INTERVAL):
+        self.write = write
+        self.flush_every = flush_every
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.written = 0
+
+    def record(self, song, artist, played):
+        key = (song, artist)
+        with self._lock:
+            was_played, failures = self._pending.get(key, (False, 0))
+            self._pending[key] = (True, 0) if played else (was_played, failures + 1)
+            due = len(self._pending) >= self.flush_every
+            self._start()
+        if due:
+            self._wake.set()
+
+    def _start(self):
+        # Started on first use, so each gunicorn worker runs its own writer
+        # after the fork. Called with the lock held.
+        if self._thread is None:
+            atexit.register(self.flush)
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='play-reports',
+                                            daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """Write everything queued so far. Safe to call from any thread."""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+        try:
+            self.write(batch)
+        except Exception as e:
+            # Losing a batch only costs the next player a retry
+            logger.warning(f'Could not record {len(batch)} play outcomes: {e}')
+            return 0
+        self.written += len(batch)
+        return len(batch)
@@ -7,11 +7,21 @@ take the game with it. Both are unauthenticated.
 """
 import json
 import logging
+import os
 import re
+import threading
+import time
 import urllib.parse
 import urllib.request
+from collections import OrderedDict
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
 import deezer
 
+from answers import clean_text
+
 logger = logging.getLogger(__name__)
 
 
@@ -29,36 +39,41 @@ client = deezer.Client()
 # at play time. Apple's URLs carry no signature and can be stored as-is.
 EXPIRING_SOURCES = {'deezer'}
 
+# How long after fetching we trust one of those URLs. Well inside the expiry,
+# so a clip handed out near the end of it still plays to the finish.
+FRESH_FOR = 5 * 60
+
+# Fresh URLs are shared between players: one fetched for a track serves anyone
+# who gets that track until it's too close to expiring to hand out.
+PREVIEW_CACHE_SIZE = int(os.environ.get('PREVIEW_CACHE_SIZE', '2000'))
+SIGNED_LIFETIME = 15 * 60   # Assumed when a URL doesn't say when it expires
+PLAY_MARGIN = 60            # Time to actually play a clip once it's handed out
+
+# Deezer's signature rides in the query string: ?hdnea=exp=1721234567~acl=...
+_EXPIRY_TOKEN = re.compile(r'[?&~=]exp=(\d+)')
+
 ITUNES_SEARCH = 'https://itunes.apple.com/search'
 USER_AGENT = 'music-quizzer/1.0 (https://github.com/markristaino/music_quizzer)'
 REQUEST_TIMEOUT = 15
 
+# Hedged lookups send every query at once instead of one after another, so a
+# slow Deezer doesn't hold up iTunes. Costs more calls per song, so it's opt-in.
+HEDGED = os.environ.get('PREVIEW_HEDGED', '0') != '0'
+ITUNES_HEDGE_DELAY = float(os.environ.get('PREVIEW_ITUNES_DELAY', '0'))
+LOOKUP_DEADLINE = float(os.environ.get('PREVIEW_LOOKUP_DEADLINE', str(REQUEST_TIMEOUT)))
+HEDGE_WORKERS = 16
 
-def clean_text(text):
-    """Clean up text by removing special characters and normalizing spaces."""
-    # Convert contractions to full words
-    text = text.replace("don't", "dont")
-    text = text.replace("couldn't", "couldnt")
-    text = text.replace("won't", "wont")
-    text = text.replace("can't", "cant")
-    text = text.replace("ain't", "aint")
-    text = text.replace("'bout", "bout")
-    text = text.replace("'n'", "and")
-    text = text.replace("'", "")  # Remove remaining apostrophes
-
-    # Remove text in parentheses and brackets
-    text = re.sub(r'\([^)]*\)', '', text)
-    text = re.sub(r'\[[^\]]*\]', '', text)
+_hedge_executor = None
+_hedge_lock = threading.Lock()
 
-    # Remove featuring, feat., ft., etc.
-    text = re.sub(r'feat\.?|ft\.?|featuring', '', text, flags=re.IGNORECASE)
+# Per-provider throttles (throttle.ProviderGate) by source name. Empty in the
+# app; tools.refresh_library installs them for its bulk runs.
+gates = {}
 
-    # Remove special characters but preserve letters and numbers
-    text = re.sub(r'[^\w\s]', ' ', text)
 
-    # Normalize whitespace
-    text = ' '.join(text.split())
-    return text.strip()
+def _gate(source):
+    gate = gates.get(source)
+    return gate.call() if gate is not None else nullcontext()
 
 
 def is_match(song_words, artist_words, candidate_song, candidate_artist):
@@ -71,28 +86,38 @@ def is_match(song_words, artist_words, candidate_song, candidate_artist):
     return title_matches and artist_matches
 
 
-def _deezer_preview(clean_song, clean_artist, song_words, artist_words):
-    """Returns (preview_url, track_id)."""
-    queries = [
+def _deezer_queries(clean_song, clean_artist):
+    return [
         f'track:"{clean_song}" artist:"{clean_artist}"',  # exact match on both
         f'{clean_song} {clean_artist}',                   # simple combined search
         clean_song,                                       # title only
     ]
 
+
+def _deezer_search(query, song_words, artist_words):
+    """One Deezer query. Returns (preview_url, track_id); raises if unreachable."""
+    # Results page in lazily, so the whole walk counts as one gated call
+    with _gate('deezer'):
+        for track in client.search(query):
+            if not track.preview:
+                continue
+            if is_match(song_words, artist_words, track.title, track.artist.name):
+                return track.preview, str(track.id)
+    return None, None
+
+
+def _deezer_preview(clean_song, clean_artist, song_words, artist_words):
+    """Returns (preview_url, track_id)."""
     reached = False
-    for query in queries:
+    for query in _deezer_queries(clean_song, clean_artist):
         try:
-            results = client.search(query)
+            preview, track_id = _deezer_search(query, song_words, artist_words)
             reached = True
         except Exception as e:
             logger.debug(f"Deezer search failed for '{query}': {e}")
             continue
-
-        for track in results:
-            if not track.preview:
-                continue
-            if is_match(song_words, artist_words, track.title, track.artist.name):
-                return track.preview, str(track.id)
+        if preview:
+            return preview, track_id
 
     if not reached:
         raise LookupFailed('deezer unreachable')
@@ -110,7 +135,8 @@ def _itunes_preview(clean_song, clean_artist, song_words, artist_words):
     request = urllib.request.Request(f'{ITUNES_SEARCH}?{query}',
                                      headers={'User-Agent': USER_AGENT})
     try:
-        with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
+        with _gate('itunes'), \
+                urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT) as response:
             results = json.load(response).get('results', [])
     except Exception as e:
         raise LookupFailed(f'itunes unreachable: {e}')
@@ -126,11 +152,77 @@ def _itunes_preview(clean_song, clean_artist, song_words, artist_words):
     return None, None
 
 
-def find_preview(song, artist):
+def _delayed(stop, delay, lookup, *args):
+    """Run `lookup` after `delay` seconds, unless `stop` is set first."""
+    if delay > 0 and stop.wait(delay):
+        return None, None
+    return lookup(*args)
+
+
+def _hedge_pool():
+    global _hedge_executor
+    with _hedge_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS,
+                                                 thread_name_prefix='preview-hedge')
+        return _hedge_executor
+
+
+def _hedged_find(clean_song, clean_artist, song_words, artist_words,
+                 deadline, itunes_delay):
+    """Every lookup at once; the answer is the best one that comes back.
+
+    "Best" is the order the sequential search would have reached them in:
+    Deezer's three queries, then iTunes. A match is taken as soon as every
+    lookup ranked above it has answered without one or run out of time, and
+    whatever is still out is ignored.
+
+    Returns (preview_url, source, track_id, reached).
+    """
+    stop = threading.Event()
+    lookups = [('deezer', _deezer_search, (query, song_words, artist_words), 0)
+               for query in _deezer_queries(clean_song, clean_artist)]
+    lookups.append(('itunes', _itunes_preview,
+                    (clean_song, clean_artist, song_words, artist_words), itunes_delay))
+
+    pool = _hedge_pool()
+    started = time.monotonic()
+    futures = [pool.submit(_delayed, stop, delay, lookup, *args)
+               for _source, lookup, args, delay in lookups]
+
+    reached = False
+    try:
+        for (source, _lookup, _args, delay), future in zip(lookups, futures):
+            remaining = started + delay + deadline - time.monotonic()
+            try:
+                preview, track_id = future.result(timeout=max(remaining, 0))
+            except FutureTimeout:
+                logger.info(f'{source} lookup missed its {deadline}s deadline')
+                continue
+            except Exception as e:
+                logger.debug(f'{source} lookup failed: {e}')
+                continue
+            reached = True
+            if preview:
+                return preview, source, track_id, reached
+    finally:
+        # A delayed iTunes lookup that hasn't started never will
+        stop.set()
+        for future in futures:
+            future.cancel()
+
+    return None, None, None, reached
+
+
+def find_preview(song, artist, hedged=None, deadline=None, itunes_delay=None):
     """Search both providers for a playable preview.
 
     Returns (preview_url, source, track_id) - all None if neither has one. The
     track id matters more than the URL: see EXPIRING_SOURCES below.
+
+    Hedged, every query goes out at once - iTunes after `itunes_delay` - and no
+    lookup is waited on past `deadline` seconds. Each defaults to its
+    PREVIEW_* setting.
     """
     clean_song = clean_text(song)
     clean_artist = clean_text(artist)
@@ -140,6 +232,18 @@ def find_preview(song, artist):
     if not song_words:
         return None, None, None
 
+    if (HEDGED if hedged is None else hedged):
+        preview, source, track_id, reached = _hedged_find(
+            clean_song, clean_artist, song_words, artist_words,
+            LOOKUP_DEADLINE if deadline is None else deadline,
+            ITUNES_HEDGE_DELAY if itunes_delay is None else itunes_delay,
+        )
+        if preview:
+            return preview, source, track_id
+        if not reached:
+            raise LookupFailed(f'no provider reachable for {artist} - {song}')
+        return None, None, None
+
     reached = False
     for source, lookup in (('deezer', _deezer_preview), ('itunes', _itunes_preview)):
         try:
@@ -169,15 +273,106 @@ def get_preview_url(song, artist):
     return preview
 
 
+def url_expiry(url, now=None):
+    """When a signed preview URL stops working, as a Unix time.
+
+    Read from the signature's exp token; URLs without one are assumed to last
+    SIGNED_LIFETIME from now.
+    """
+    found = _EXPIRY_TOKEN.search(url)
+    if found:
+        return float(found.group(1))
+    return (time.time() if now is None else now) + SIGNED_LIFETIME
+
+
+class PreviewCache:
+    """Fresh preview URLs by (source, track id), dropped before they expire.
+
+    An entry is only handed out while it has FRESH_FOR left to run plus time to
+    play, because whoever gets it may hold it that long before pressing play.
+    Least recently used entries go first once the cache is full.
+    """
+
+    def __init__(self, size=PREVIEW_CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                url, usable_until = entry
+                if now < usable_until:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return url
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, url):
+        usable_until = url_expiry(url) - FRESH_FOR - PLAY_MARGIN
+        if usable_until <= time.time():
+            return
+        with self._lock:
+            self._entries[key] = (url, usable_until)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            'entries': size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+        }
+
+
+preview_cache = PreviewCache()
+
+
 def refresh_preview(source, track_id):
     """A fresh URL for a preview we already identified, by track id.
 
-    One cheap call instead of re-running the whole search.
+    One cheap call instead of re-running the whole search - or none, when
+    another player's request fetched it recently enough.
     """
     if source != 'deezer' or not track_id:
         return None
+
+    key = (source, str(track_id))
+    cached = preview_cache.get(key)
+    if cached:
+        return cached
+
     try:
-        return client.get_track(int(track_id)).preview or None
+        with _gate('deezer'):
+            fresh = client.get_track(int(track_id)).preview or None
     except Exception as e:
         logger.info(f'Could not refresh deezer track {track_id}: {e}')
         return None
+    if fresh:
+        preview_cache.put(key, fresh)
+    return fresh
+
+
+def warm_preview_cache(tracks):
+    """Fetch fresh URLs for `tracks`, (source, track_id) pairs, most wanted first.
+
+    Meant for a background thread at boot, so the songs most likely to come up
+    don't each cost the first player to draw them a Deezer call.
+    """
+    warmed = 0
+    for source, track_id in tracks:
+        if source in EXPIRING_SOURCES and refresh_preview(source, track_id):
+            warmed += 1
+    logger.info(f'Preview cache warmed with {warmed} tracks')
+    return warmed
@@ -0,0 +1,211 @@
+"""What the quiz makes of the library's rows.
+
+Decades, pick weights, parent genres and the names answers are judged
+against, packed into a song store. The app runs this when it loads the
+library; the library tools run it too, to publish a snapshot the app can load
+instead (see build_snapshot). Nothing here needs Flask, and only the snapshot
+functions read or write the database.
+"""
+import hashlib
+import logging
+
+import numpy as np
+import pandas as pd
+
+import artists
+import library
+import snapshot
+import song_store
+from answers import cleaned_artist, cleaned_title
+from artists import female_credits, has_female_vocal_tag
+from song_store import SongStore
+from taxonomy import GENRE_MAPPING, map_to_parent_genre
+
+logger = logging.getLogger(__name__)
+
+MIN_YEAR = 1960            # Songs released before this are left out of the quiz
+
+# How often a song comes up. Two independent pulls, multiplied together:
+#   RECENCY_WEIGHT      what the newest year weighs against the oldest
+#   FEMALE_VOCAL_WEIGHT what a female-fronted song weighs against the rest
+# Set either to 1.0 to switch that pull off.
+RECENCY_WEIGHT = 3.0
+FEMALE_VOCAL_WEIGHT = 2.0
+
+
+def female_fronted(df):
+    """Which songs count as female-fronted, decided per artist.
+
+    Last.fm tags arrive unevenly - one Taylor Swift row carries "female
+    vocalists" while twenty-seven carry only "pop". So if any song by an artist
+    is marked, all of theirs are.
+
+    Each distinct credit, lead and tag string is judged once and the answers
+    spread back over the songs, so the cost follows the artists rather than
+    the library.
+    """
+    credit_codes, credits = pd.factorize(df['Artist'], use_na_sentinel=False)
+    named, leads = female_credits(credits)
+    tagged_codes, tags = pd.factorize(df['Genres'])
+    tagged = np.array([has_female_vocal_tag(value) for value in tags] + [False], dtype=bool)
+    # -1, a song with no tags, lands on the False at the end
+    marked = np.array(named, dtype=bool)[credit_codes] | tagged[tagged_codes]
+
+    # Credits sharing a lead count together: "Adele" and "Adele featuring X"
+    lead_of_credit, leads = pd.factorize(pd.Series(leads, dtype=object))
+    lead_codes = lead_of_credit[credit_codes]
+    known = np.zeros(len(leads), dtype=bool)
+    known[lead_codes[marked]] = True
+    return pd.Series(known[lead_codes], index=df.index)
+
+
+def recency_weights(years):
+    """Newer songs come up more often, rising evenly across the years.
+
+    `years` is a float array, NaN where a year is unknown. Those songs weigh
+    1.0, as every song does when all share one year.
+    """
+    released = np.trunc(years)
+    oldest, newest = int(np.nanmin(released)), int(np.nanmax(released))
+    if newest <= oldest:
+        return np.ones(len(years))
+    position = np.clip((released - oldest) / (newest - oldest), 0.0, 1.0)
+    weights = 1.0 + (RECENCY_WEIGHT - 1.0) * position
+    return np.where(np.isnan(weights), 1.0, weights)
+
+
+def song_weights(df):
+    """A pick-likelihood for every song, from recency and vocal tags."""
+    years = pd.to_numeric(df['Year'], errors='coerce').to_numpy(dtype=float)
+    weights = recency_weights(years)
+
+    # Songs that have failed to play lately come up less until they play again
+    if 'PlayFailures' in df.columns:
+        failures = pd.to_numeric(df['PlayFailures'], errors='coerce').fillna(0)
+        weights = weights / (1 + failures.to_numpy(dtype=float))
+
+    if 'Genres' in df.columns:
+        female = female_fronted(df).to_numpy()
+        weights = weights * np.where(female, FEMALE_VOCAL_WEIGHT, 1.0)
+        logger.info(f'{int(female.sum())} songs tagged as female-fronted')
+
+    return pd.Series(weights, index=df.index)
+
+
+def replayed_weights(weights, stored, failures):
+    """`weights` from song_weights, as they'd be with `failures` in place of
+    the `stored` failure counts they were weighted with.
+    """
+    stored = np.asarray(stored, dtype=float)
+    return weights * (1 + stored) / (1 + np.asarray(failures, dtype=float))
+
+
+def prepare_song_data(df):
+    """Everything the quiz derives from the library's rows - decades, weights,
+    parent genres and the names answers are judged against - packed into a
+    store. Returns (songs, decades), as load_song_data does.
+    """
+    df, decades = prepare_song_frame(df)
+    if df is None:
+        return None, []
+    df['ArtistAnswer'], df['SongAnswer'] = answer_names(df)
+    # Only the parents a filter can name get a bit; see song_store.py
+    songs = SongStore.from_frame(df, parent_genres(df), GENRE_MAPPING)
+    return songs, decades
+
+
+def answer_names(df):
+    """Each song's artist and title cleaned as answers.Answer takes them.
+
+    Returns (artists, titles). Credits repeat, so each is cleaned once.
+    """
+    codes, credits = pd.factorize(df['Artist'].astype(str))
+    leads = np.array([cleaned_artist(credit) for credit in credits], dtype=object)
+    return leads[codes], [cleaned_title(str(song)) for song in df['Song']]
+
+
+def parent_genres(df):
+    """Each row's parent genres, as a set."""
+    if 'Genres' not in df.columns:
+        return [set() for _ in range(len(df))]
+    # Most artists share a handful of tag strings, so map each one once
+    mapped = {}
+    for value in df['Genres'].fillna('').astype(str).unique():
+        mapped[value] = {map_to_parent_genre(genre)
+                         for genre in value.split(',') if genre.strip()}
+    return [mapped[value] for value in df['Genres'].fillna('').astype(str)]
+
+
+def prepare_song_frame(df):
+    """The library's rows trimmed to the quiz, with Decade and Weight filled
+    in. Returns (dataframe, decades); dataframe is None if nothing is left.
+    """
+    if df is None or df.empty:
+        logger.error("No song data available")
+        return None, []
+
+    # The quiz only covers MIN_YEAR onward. This also drops rows with an
+    # unreadable Year, which could not be placed in a decade anyway.
+    if 'Year' in df.columns:
+        year = pd.to_numeric(df['Year'], errors='coerce')
+        dropped = int((~(year >= MIN_YEAR)).sum())
+        df = df[year >= MIN_YEAR].copy()
+        if dropped:
+            logger.info(f"Dropped {dropped} songs released before {MIN_YEAR}")
+
+    # Derive Decade from Year when the dataset does not carry it
+    if 'Decade' not in df.columns and 'Year' in df.columns:
+        year = pd.to_numeric(df['Year'], errors='coerce')
+        df['Decade'] = ((year // 10) * 10).astype(int).astype(str) + 's'
+        logger.info("Created Decade column from Year")
+
+    df = df[df['Decade'].notna()].copy()
+    df['Weight'] = song_weights(df)
+
+    decades = sorted({
+        int(str(d).replace('s', ''))
+        for d in df['Decade'].unique()
+        if str(d).replace('s', '').isdigit()
+    })
+    logger.info(f"Available decades: {decades}")
+    return df, decades
+
+
+def derivation():
+    """A fingerprint of everything above that shapes the store.
+
+    A snapshot derived under other settings, artist rules, columns or file
+    format is stale even when the library hasn't changed.
+    """
+    source = repr((snapshot.FORMAT, song_store.TEXT_COLUMNS, song_store.CATEGORICAL_COLUMNS,
+                   sorted(song_store.NUMERIC_COLUMNS), MIN_YEAR, RECENCY_WEIGHT, FEMALE_VOCAL_WEIGHT,
+                   sorted(GENRE_MAPPING.items()), sorted(artists.ARTIST_ALIASES.items()),
+                   sorted(artists.EXCLUDED_ARTISTS.items()), artists.FEATURED_SEPARATORS,
+                   sorted(artists.FEMALE_VOCAL_ARTISTS), sorted(artists.FEMALE_VOCAL_TAGS)))
+    return hashlib.sha1(source.encode()).hexdigest()[:16]
+
+
+def build_snapshot():
+    """The library as the app would derive it, packed for library.save_snapshot.
+
+    Returns (version, data), where version is library.library_version as of
+    the read, or (version, None) if there's no library to pack. The plays
+    generation goes in with the data; the app reads plays since.
+    """
+    # Read before the rows, so a write landing mid-read leaves it stale
+    version = library.library_version()
+    songs, decades = prepare_song_data(library.load_songs())
+    if songs is None:
+        return version, None
+    return version, snapshot.dumps(songs, decades=decades, plays=version[1])
+
+
+def publish_snapshot():
+    """Pack the library and store it where the app looks first. See build_snapshot."""
+    version, data = build_snapshot()
+    if data is None:
+        logger.warning('No library to snapshot')
+        return None
+    library.save_snapshot(derivation(), version[0], data)
+    logger.info(f'Stored a {len(data) / 1e6:.2f} MB library snapshot for version {version}')
+    return version
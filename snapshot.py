@@ -0,0 +1,232 @@
+"""The loaded library as one file that every gunicorn worker maps.
+
+Each worker used to read the whole songs table at boot and hold its own copy.
+Preloading in the gunicorn master wouldn't have fixed that: touching a pandas
+object bumps its refcount, which writes to the page holding it and unshares it.
+
+So the first worker to boot writes the song store out here - every column is
+already a plain NumPy array - and the rest map that file read-only. Array data
+carries no refcounts, so its pages stay shared between the workers through the
+page cache. Only the headers and the few hundred distinct values behind each
+categorical column are private to a worker.
+
+The file is written under a lock and renamed into place, so a reader sees
+either the whole snapshot or none. Snapshots are named by what they were built
+from (see app.snapshot_path): a library change gets a new file, and older ones
+are removed once it's in place.
+
+The same bytes are what the library tools store alongside the songs table
+(see quiz_library.publish_snapshot), so the first worker after a refresh reads
+one row instead of the whole table. Each snapshot carries its format number
+and a CRC-32, and one that fails either is treated as missing.
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import zlib
+from contextlib import contextmanager
+
+import numpy as np
+
+from song_store import Categorical, PackedText, SongStore
+
+try:
+    import fcntl
+except ImportError:     # Windows, which gunicorn doesn't run on anyway
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'MQSNAP'
+FORMAT = 2              # Bumped whenever the layout below changes
+# Magic, format, CRC-32 of everything after this, header length
+PREAMBLE = struct.Struct('<6sHIQ')
+ALIGN = 64              # Array offsets are aligned to this many bytes
+SUFFIX = '.snap'
+LOCK_NAME = 'publish.lock'
+
+
+class SnapshotError(ValueError):
+    """The file isn't a snapshot this code can read."""
+
+
+def _arrays(store):
+    """Every array in `store`, by name, and how to put each column back."""
+    arrays = {'labels': store.labels, 'by_label': store._by_label,
+              'sorted_labels': store._sorted_labels, 'genre_mask': store.genre_mask}
+    kinds = {}
+    for column in store.columns:
+        values = store._columns[column]
+        if isinstance(values, PackedText):
+            kinds[column] = 'text'
+            parts = {'present': values.present, 'offsets': values.offsets, 'data': values.data}
+        elif isinstance(values, Categorical):
+            kinds[column] = 'categorical'
+            names = PackedText(values.values)
+            parts = {'codes': values.codes, 'present': names.present,
+                     'offsets': names.offsets, 'data': names.data}
+        else:
+            kinds[column] = 'numeric'
+            parts = {'values': values}
+        for part, array in parts.items():
+            arrays[f'{column}.{part}'] = array
+    # The long tail of genres end to end, rather than hundreds of tiny arrays
+    others = list(store.other_genres.values())
+    arrays['other_genres.positions'] = (np.concatenate(others) if others
+                                        else np.empty(0, dtype=np.int32))
+    arrays['other_genres.offsets'] = np.cumsum([0] + [len(p) for p in others], dtype=np.int64)
+    return arrays, kinds
+
+
+def dumps(store, **meta):
+    """`store` as snapshot bytes, along with any JSON-able `meta`."""
+    arrays, kinds = _arrays(store)
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        layout[name] = {'dtype': array.dtype.str, 'count': array.size, 'offset': offset}
+        offset += -(-array.nbytes // ALIGN) * ALIGN
+    header = json.dumps({
+        'columns': kinds,
+        'arrays': layout,
+        'genre_names': store.genre_names,
+        'other_genres': list(store.other_genres),
+        'meta': meta,
+    }).encode()
+    # Arrays start on an aligned boundary after the header
+    start = -(-(PREAMBLE.size + len(header)) // ALIGN) * ALIGN
+
+    body = bytearray(start + offset)
+    body[PREAMBLE.size:PREAMBLE.size + len(header)] = header
+    for name, array in arrays.items():
+        at = start + layout[name]['offset']
+        body[at:at + array.nbytes] = array.tobytes()
+    checksum = zlib.crc32(memoryview(body)[PREAMBLE.size:])
+    PREAMBLE.pack_into(body, 0, MAGIC, FORMAT, checksum, len(header))
+    return bytes(body)
+
+
+def loads(data):
+    """The store in snapshot bytes - or anything else exposing a buffer, such
+    as a mapped file - as (store, meta). The arrays are views of `data`, not
+    copies, and read-only if `data` is.
+    """
+    if len(data) < PREAMBLE.size:
+        raise SnapshotError('Too short to be a library snapshot')
+    magic, version, checksum, length = PREAMBLE.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise SnapshotError('Not a library snapshot')
+    if version != FORMAT:
+        raise SnapshotError(f'Snapshot format {version}; this code reads {FORMAT}')
+    if zlib.crc32(memoryview(data)[PREAMBLE.size:]) != checksum:
+        raise SnapshotError('Snapshot checksum does not match; the file is damaged')
+    header = json.loads(bytes(data[PREAMBLE.size:PREAMBLE.size + length]))
+    start = -(-(PREAMBLE.size + length) // ALIGN) * ALIGN
+
+    def array(name):
+        found = header['arrays'][name]
+        return np.frombuffer(data, dtype=np.dtype(found['dtype']), count=found['count'],
+                             offset=start + found['offset'])
+
+    def text(column):
+        return PackedText.from_arrays(array(f'{column}.present'), array(f'{column}.offsets'),
+                                      array(f'{column}.data'))
+
+    columns = {}
+    for column, kind in header['columns'].items():
+        if kind == 'text':
+            columns[column] = text(column)
+        elif kind == 'categorical':
+            columns[column] = Categorical.from_arrays(array(f'{column}.codes'),
+                                                      text(column).decode())
+        else:
+            columns[column] = array(f'{column}.values')
+    positions, offsets = array('other_genres.positions'), array('other_genres.offsets')
+    other_genres = {genre: positions[offsets[number]:offsets[number + 1]]
+                    for number, genre in enumerate(header['other_genres'])}
+    store = SongStore(array('labels'), columns, array('genre_mask'), header['genre_names'],
+                      other_genres, lookup=(array('by_label'), array('sorted_labels')))
+    return store, header['meta']
+
+
+def write(path, data):
+    """Put snapshot bytes at `path` in one step; readers never see half of it."""
+    handle, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                         suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as out:
+            out.write(data)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def read(path):
+    """Map the snapshot at `path`. Returns (store, meta); the arrays are read-only."""
+    with open(path, 'rb') as handle:
+        try:
+            mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError as e:     # An empty file
+            raise SnapshotError(f'{path} is empty') from e
+    return loads(mapped)
+
+
+@contextmanager
+def _locked(path):
+    """Hold an exclusive lock on `path` across processes."""
+    with open(path, 'a') as handle:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _prune(keep):
+    """Remove the snapshots beside `keep` that it replaces.
+
+    A worker still mapping one keeps its pages; the file only goes once
+    nobody has it open.
+    """
+    directory = os.path.dirname(keep)
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.endswith(SUFFIX) and path != keep:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+def shared(path, build):
+    """The snapshot at `path`, built first if no worker has yet.
+
+    `build()` returns snapshot bytes, as from dumps. It runs in one process
+    at a time, and only when nobody else got there first. Returns (store,
+    meta), or (None, None) without writing anything if `build` returned None.
+    """
+    try:
+        return read(path)
+    except (FileNotFoundError, SnapshotError):
+        pass
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with _locked(os.path.join(os.path.dirname(path), LOCK_NAME)):
+        try:
+            return read(path)   # Written while we waited for the lock
+        except (FileNotFoundError, SnapshotError):
+            pass
+        data = build()
+        if data is None:
+            return None, None
+        write(path, data)
+        logger.info(f'Published a {len(data) / 1e6:.2f} MB library snapshot at {path}')
+    _prune(path)
+    return read(path)
@@ -0,0 +1,176 @@
+"""Which songs a genre and decade filter allows, without scanning the library.
+
+Built once when the library loads, over the song store's genre bits. Every
+decade gets a bitmap - one flag per song - so a filter is a few ORs and one AND
+over arrays a few thousand long, instead of a pandas pass with a Python lambda
+per row.
+
+Picking is cached the same way. Only a few dozen filter combinations ever
+come up, so each gets a cumulative-weight array the first time it's asked for,
+and a draw is one binary search rather than a re-normalised pandas sample.
+
+Songs are addressed by position in the store. The session remembers songs by
+label, so the index carries the mapping between the two.
+"""
+import random
+from collections import OrderedDict
+from threading import Lock
+
+import numpy as np
+
+SAMPLER_CACHE_SIZE = 64   # Filter combinations kept ready to draw from
+MAX_REJECTIONS = 32       # Draws that may land on a recent song before we stop guessing
+
+
+def decade_key(decade):
+    """Filters arrive as "1980" or "1980s"; the library stores "1980s"."""
+    decade = str(decade)
+    return decade if decade.endswith('s') else f'{decade}s'
+
+
+class WeightedSampler:
+    """Weighted draws from a fixed set of songs, in O(log n) each.
+
+    Songs the player heard recently are rejected and redrawn rather than cut
+    out of a copy. Rejection leaves the others' relative odds untouched, so
+    this picks exactly as `DataFrame.sample(weights=...)` over the songs that
+    remain would.
+    """
+
+    def __init__(self, positions, weights):
+        """`weights` covers the whole library; `positions` picks the songs."""
+        self.positions = positions
+        self.weights = weights
+        self.cumulative = np.cumsum(weights[positions], dtype=float)
+        self.total = float(self.cumulative[-1]) if len(positions) else 0.0
+
+    def __len__(self):
+        return len(self.positions)
+
+    def _draw_one(self, rng):
+        slot = np.searchsorted(self.cumulative, rng.random() * self.total, side='right')
+        # random() * total can round up to exactly the total
+        return int(self.positions[min(slot, len(self.positions) - 1)])
+
+    def draw(self, rejected=None, rng=random):
+        """A song position, or None if every song here is rejected.
+
+        `rejected` is a flag per song in the library, as from `SongIndex.flags`.
+        """
+        if not self.total:
+            return None
+        if rejected is None:
+            return self._draw_one(rng)
+
+        for _ in range(MAX_REJECTIONS):
+            position = self._draw_one(rng)
+            if not rejected[position]:
+                return position
+
+        # Nearly everything here is rejected. Draw from what's left directly,
+        # which costs a copy but can't spin.
+        remaining = self.positions[~rejected[self.positions]]
+        return WeightedSampler(remaining, self.weights).draw(rng=rng)
+
+
+class SongIndex:
+    """Genre and decade filters over one loaded library, a song_store.SongStore.
+
+    The named parent genres are already bits in the store, so a filter over
+    them is one AND across the mask. The long tail of other genres is kept as
+    lists of songs, and decades get a bitmap each.
+    """
+
+    def __init__(self, songs, weights=None):
+        """`weights`, one per song, stand in for the store's Weight column."""
+        self.size = len(songs)
+        self.labels = songs.labels
+        self.songs = songs
+
+        self.genre_mask = songs.genre_mask
+        self.genre_bits = {name: 1 << bit for bit, name in enumerate(songs.genre_names)}
+        self.other_genres = songs.other_genres
+        self.genres = set(self.genre_bits) | set(self.other_genres)
+
+        self.decades = {}
+        if 'Decade' in songs.columns:
+            decades = songs.column('Decade').astype(str)
+            for decade in np.unique(decades):
+                self.decades[decade] = decades == decade
+
+        if weights is not None:
+            self.weights = np.asarray(weights, dtype=float)
+        elif 'Weight' in songs.columns:
+            # Read in place: a store mapped from a snapshot shares its pages
+            self.weights = np.asarray(songs.column('Weight'), dtype=float)
+        else:
+            self.weights = np.ones(self.size)
+        self._samplers = OrderedDict()
+        self._samplers_lock = Lock()
+
+    def _any_genre(self, genres):
+        """Songs carrying at least one of `genres`. Unknown genres match nothing."""
+        bits = 0
+        for genre in genres:
+            bits |= self.genre_bits.get(genre, 0)
+        combined = (self.genre_mask & bits) != 0
+        for genre in genres:
+            positions = self.other_genres.get(genre)
+            if positions is not None:
+                combined[positions] = True
+        return combined
+
+    def _any_of(self, bitmaps, keys):
+        """Songs in at least one of `keys`. Unknown keys match nothing."""
+        combined = np.zeros(self.size, dtype=bool)
+        for key in keys:
+            bitmap = bitmaps.get(key)
+            if bitmap is not None:
+                combined |= bitmap
+        return combined
+
+    def mask(self, genres=None, decades=None):
+        """A bitmap of the songs matching both filters. Empty filters allow all."""
+        allowed = np.ones(self.size, dtype=bool)
+        if genres:
+            allowed &= self._any_genre(set(genres))
+        if decades:
+            allowed &= self._any_of(self.decades, {decade_key(d) for d in decades})
+        return allowed
+
+    def matching(self, genres=None, decades=None):
+        """Positions of the songs matching both filters, in library order."""
+        return np.flatnonzero(self.mask(genres, decades))
+
+    def positions_of(self, labels):
+        """Positions for labels, skipping any no longer loaded."""
+        return self.songs.positions_of(labels)
+
+    def flags(self, labels):
+        """A bitmap with the songs named by `labels` set."""
+        flagged = np.zeros(self.size, dtype=bool)
+        if len(labels):
+            flagged[self.positions_of(labels)] = True
+        return flagged
+
+    def excluding(self, positions, labels):
+        """`positions` without the songs named by `labels`."""
+        if not len(labels):
+            return positions
+        return positions[~self.flags(labels)[positions]]
+
+    def sampler(self, genres=None, decades=None):
+        """The weighted sampler for a filter, built on first use and kept."""
+        key = (frozenset(genres or ()), frozenset(decade_key(d) for d in decades or ()))
+        with self._samplers_lock:
+            sampler = self._samplers.get(key)
+            if sampler is not None:
+                self._samplers.move_to_end(key)
+                return sampler
+
+        sampler = WeightedSampler(self.matching(genres, decades), self.weights)
+        with self._samplers_lock:
+            self._samplers[key] = sampler
+            if len(self._samplers) > SAMPLER_CACHE_SIZE:
+                self._samplers.popitem(last=False)
+        return sampler
@@ -0,0 +1,259 @@
+"""The loaded library, held column by column.
+
+A DataFrame of the library spends most of its memory on Python objects: a str
+per cell, a set per row for parent genres, and every gunicorn worker holds its
+own. Here each column is one NumPy array. Artist, decade, genre tags and
+preview source are small integer codes into their distinct values; parent
+genres are bits in one integer per song; titles and preview URLs, which seldom
+repeat, are packed end to end as UTF-8. The cleaned artist and title answers
+are judged against are kept the same ways.
+
+Songs are addressed by position, as in song_index, and keep the label the
+library gave them. `row()` hands out a light view that reads like the pandas
+row it replaced - song['Artist'], song.get('PreviewId'), song.name - so code
+handling one song at a time doesn't care which it has.
+"""
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Library columns a store keeps, when the source has them
+TEXT_COLUMNS = ('Song', 'PreviewUrl', 'PreviewId', 'SongAnswer')
+CATEGORICAL_COLUMNS = ('Artist', 'Decade', 'Genres', 'PreviewSource', 'ArtistAnswer')
+NUMERIC_COLUMNS = {'Year': np.int16, 'Rank': np.float32, 'Weight': np.float64,
+                   'PlayFailures': np.int16}
+
+
+def _code_type(count):
+    """The narrowest signed integer that can hold `count` codes and -1."""
+    for dtype in (np.int8, np.int16, np.int32):
+        if count < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else None
+
+
+def _interned(values):
+    return np.array([_intern(v) for v in values], dtype=object)
+
+
+class Categorical:
+    """Codes into a column's distinct values. A code of -1 is missing."""
+
+    def __init__(self, values):
+        codes, distinct = pd.factorize(pd.Series(list(values), dtype=object))
+        self.codes = codes.astype(_code_type(len(distinct)))
+        self.values = _interned(distinct)
+
+    @classmethod
+    def from_arrays(cls, codes, values):
+        categorical = cls.__new__(cls)
+        categorical.codes = codes
+        categorical.values = _interned(values)
+        return categorical
+
+    def __getitem__(self, position):
+        code = self.codes[position]
+        return self.values[code] if code >= 0 else None
+
+    def decode(self):
+        decoded = np.empty(len(self.codes), dtype=object)
+        present = self.codes >= 0
+        decoded[present] = self.values[self.codes[present]]
+        return decoded
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.values.nbytes + sum(
+            sys.getsizeof(v) for v in self.values if v is not None)
+
+
+class PackedText:
+    """Strings that seldom repeat, packed end to end as UTF-8.
+
+    A title or URL per song as its own str object costs ~50 bytes of overhead
+    each, and the objects end up scattered through the heap. Packed, a column
+    is two arrays and a string is only made when someone reads it.
+    """
+
+    def __init__(self, values):
+        encoded = [v.encode() if isinstance(v, str) else None for v in values]
+        self.present = np.array([e is not None for e in encoded], dtype=bool)
+        lengths = np.fromiter((len(e) if e else 0 for e in encoded), dtype=np.int64,
+                              count=len(encoded))
+        self.offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+        self.data = np.frombuffer(b''.join(e for e in encoded if e), dtype=np.uint8)
+
+    @classmethod
+    def from_arrays(cls, present, offsets, data):
+        text = cls.__new__(cls)
+        text.present, text.offsets, text.data = present, offsets, data
+        return text
+
+    def __getitem__(self, position):
+        if not self.present[position]:
+            return None
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return self.data[start:end].tobytes().decode()
+
+    def decode(self):
+        return np.array([self[position] for position in range(len(self.present))],
+                        dtype=object)
+
+    @property
+    def nbytes(self):
+        return self.present.nbytes + self.offsets.nbytes + self.data.nbytes
+
+
+class SongRow:
+    """One song in a store, read like a pandas row."""
+
+    __slots__ = ('store', 'position')
+
+    def __init__(self, store, position):
+        self.store = store
+        self.position = position
+
+    @property
+    def name(self):
+        """The song's label, as a DataFrame row's .name was."""
+        return int(self.store.labels[self.position])
+
+    def __getitem__(self, column):
+        if column == 'ParentGenres':
+            return self.store.parent_genres(self.position)
+        return self.store.value(column, self.position)
+
+    def get(self, column, default=None):
+        try:
+            return self[column]
+        except KeyError:
+            return default
+
+    def __repr__(self):
+        return f'SongRow({self.name}: {self.get("Artist")} - {self.get("Song")})'
+
+
+class SongStore:
+    """The library as flat arrays, one slot per song."""
+
+    def __init__(self, labels, columns, genre_mask, genre_names, other_genres,
+                 lookup=None):
+        self.labels = labels
+        # Label lookups binary-search a sorted copy; a dict would cost more
+        # than the rest of the store put together. `lookup` is that pair as a
+        # snapshot saved it, so a worker mapping one needn't sort again.
+        if lookup is None:
+            order = np.argsort(labels, kind='stable')
+            lookup = (order, labels[order])
+        self._by_label, self._sorted_labels = lookup
+        self._columns = columns
+        self.columns = list(columns)
+        # Parent genres: a bit each for the named ones, positions for the rest
+        self.genre_mask = genre_mask
+        self.genre_names = list(genre_names)
+        self.other_genres = other_genres
+
+    @classmethod
+    def from_frame(cls, df, parent_genres=None, genre_names=()):
+        """A store holding `df`'s library columns.
+
+        `parent_genres` is a set per row. Those in `genre_names` - the ones a
+        filter is meant to name - get a bit each; any others are kept as a
+        list of the songs carrying them.
+        """
+        columns = {}
+        for column in TEXT_COLUMNS:
+            if column in df.columns:
+                columns[column] = PackedText(df[column])
+        for column in CATEGORICAL_COLUMNS:
+            if column in df.columns:
+                columns[column] = Categorical(df[column])
+        for column, dtype in NUMERIC_COLUMNS.items():
+            if column in df.columns:
+                values = pd.to_numeric(df[column], errors='coerce')
+                if np.issubdtype(dtype, np.integer):
+                    values = values.fillna(0)
+                columns[column] = values.to_numpy(dtype=dtype)
+
+        genre_names = list(genre_names)
+        if len(genre_names) > 64:
+            raise ValueError('At most 64 parent genres can be bits')
+        bits = {name: 1 << bit for bit, name in enumerate(genre_names)}
+        mask_type = next(t for t in (np.uint8, np.uint16, np.uint32, np.uint64)
+                         if len(genre_names) <= np.iinfo(t).bits)
+        genre_mask = np.zeros(len(df), dtype=mask_type)
+        others = {}
+        for position, genres in enumerate(parent_genres if parent_genres is not None else ()):
+            mask = 0
+            for genre in genres:
+                if genre in bits:
+                    mask |= bits[genre]
+                else:
+                    others.setdefault(_intern(genre), []).append(position)
+            genre_mask[position] = mask
+        other_genres = {genre: np.array(found, dtype=np.int32)
+                        for genre, found in others.items()}
+
+        labels = df.index.to_numpy(dtype=np.int64)
+        return cls(labels, columns, genre_mask, genre_names, other_genres)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def row(self, position):
+        return SongRow(self, int(position))
+
+    def positions_of(self, labels):
+        """Positions for labels, skipping any not loaded."""
+        labels = np.asarray(list(labels), dtype=np.int64)
+        if not len(self):
+            return np.empty(0, dtype=np.intp)
+        slots = np.searchsorted(self._sorted_labels, labels)
+        slots[slots == len(self)] = 0
+        return self._by_label[slots[self._sorted_labels[slots] == labels]]
+
+    def by_label(self, label):
+        """The song with this label, or None if it isn't loaded."""
+        try:
+            positions = self.positions_of([label])
+        except (TypeError, ValueError):
+            return None
+        return SongRow(self, positions[0]) if len(positions) else None
+
+    def value(self, column, position):
+        return self._columns[column][position]
+
+    def column(self, column):
+        """A whole column as an array, codes turned back into values."""
+        values = self._columns[column]
+        return values.decode() if isinstance(values, (Categorical, PackedText)) else values
+
+    def parent_genres(self, position):
+        mask = int(self.genre_mask[position])
+        found = {name for bit, name in enumerate(self.genre_names) if mask >> bit & 1}
+        for genre, positions in self.other_genres.items():
+            slot = np.searchsorted(positions, position)
+            if slot < len(positions) and positions[slot] == position:
+                found.add(genre)
+        return found
+
+    def to_frame(self):
+        """The library columns as a DataFrame, indexed by label."""
+        return pd.DataFrame({column: self.column(column) for column in self.columns},
+                            index=self.labels)
+
+    @property
+    def nbytes(self):
+        """Bytes held by the columns, strings included."""
+        total = (self.labels.nbytes + self._by_label.nbytes + self._sorted_labels.nbytes
+                 + self.genre_mask.nbytes)
+        for values in self._columns.values():
+            total += values.nbytes
+        total += sum(positions.nbytes for positions in self.other_genres.values())
+        return total
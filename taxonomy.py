@@ -0,0 +1,106 @@
+"""The quiz's parent genres and the tags that roll up into each.
+
+Nothing but data and one lookup, so anything that needs the taxonomy - the
+analysis scripts included - can import it without pulling in the app, the
+database or pandas.
+"""
+
+GENRE_MAPPING = {
+    'rock': ['rock', 'alternative rock', 'classic rock', 'hard rock', 'indie rock', 'progressive rock',
+             'psychedelic rock', 'art rock', 'garage rock', 'southern rock', 'rock-and-roll', 'rockabilly',
+             'rock and roll', 'album rock', 'modern rock', 'soft rock', 'yacht rock', 'dance rock',
+             'roots rock', 'post-grunge', 'modern hard rock', 'modern alternative rock', 'baroque pop',
+             'glam rock', 'progressive metal', 'rock en espanol', 'latin rock', 'mexican classic rock',
+             'piano rock', 'surf punk', 'indie surf', 'modern folk rock', 'modern power pop', 'new wave',
+             'electronic rock', 'country rock', 'grunge', 'hair metal', 'blues-rock', 'rock ballads',
+             'rock n roll', 'acoustic rock'],
+
+    'pop': ['pop', 'pop rock', 'indie pop', 'synth-pop', 'dance pop', 'electropop', 'dream pop',
+            'chamber pop', 'sophisti-pop', 'art pop', 'k-pop', 'j-pop', 'power pop', 'indie poptimism',
+            'pop dance', 'pop folk', 'pop nacional', 'pop soul', 'pop emo', 'pop punk', 'pop r&b',
+            'pop rap', 'canadian pop', 'uk pop', 'latin pop', 'adult standards', 'neo mellow',
+            'contemporary vocal jazz', 'vocal jazz', 'show tunes', 'easy listening', 'bedroom pop',
+            'bubblegum', 'adult contemporary', 'puerto rican pop', 'colombian pop', 'pop-soul',
+            'bubblegum pop', 'candy pop', 'dark pop'],
+
+    'electronic': ['electronic', 'electronica', 'edm', 'house', 'techno', 'trance', 'dubstep', 'ambient',
+                  'drum and bass', 'electro', 'electronic trap', 'electro house', 'progressive house',
+                  'deep house', 'tech house', 'tropical house', 'future bass', 'complextro', 'big room',
+                  'brostep', 'filthstep', 'future garage', 'intelligent dance music', 'neo-synthpop',
+                  'alternative dance', 'dance-punk', 'indietronica', 'canadian electronic', 'slap house',
+                  'filter house', 'disco house', 'nu disco', 'compositional ambient', 'ambient pop',
+                  'synthwave', 'retrowave', 'acid house', 'drumstep', 'hard trance', 'uk dance',
+                  'uk funky', 'cyberpunk'],
+
+    'hip hop': ['hip hop', 'rap', 'trap', 'gangster rap', 'underground hip hop', 'conscious hip hop',
+                'alternative hip hop', 'east coast hip hop', 'west coast rap', 'southern hip hop',
+                'atlanta hip hop', 'chicago rap', 'detroit hip hop', 'memphis rap', 'miami hip hop',
+                'houston rap', 'jazz rap', 'political hip hop', 'emo rap', 'cloud rap', 'melodic rap',
+                'rage rap', 'atl hip hop', 'atl trap', 'canadian hip hop', 'canadian trap',
+                'country rap', 'dfw rap', 'latin hip hop', 'lgbtq+ hip hop', 'plugg', 'pluggnb',
+                'dirty south', 'southern rap', 'g funk', 'east coast rap', 'crunk', 'trap latino',
+                'queens hip hop', 'underground hip-hop', 'golden age hip hop'],
+
+    'r&b': ['r&b', 'soul', 'funk', 'contemporary r&b', 'neo soul', 'motown', 'quiet storm',
+            'new jack swing', 'gospel', 'southern soul', 'chicago soul', 'memphis soul', 'philly soul',
+            'northern soul', 'soul blues', 'soul jazz', 'funk rock', 'funk metal', 'p funk',
+            'synth funk', 'funk pop', 'jazz funk', 'alternative r&b', 'british soul', 'indie soul',
+            'trap soul', 'urban contemporary', 'classic soul', 'neo-soul', 'latin soul', 'rhythm and blues',
+            'slow jams', 'funk paulista', 'funk rj', 'funk carioca', 'latin alternative',
+            'tropical alternativo'],
+
+    'metal': ['metal', 'heavy metal', 'thrash metal', 'death metal', 'black metal', 'doom metal',
+              'power metal', 'progressive metal', 'folk metal', 'gothic metal', 'industrial metal',
+              'symphonic metal', 'alternative metal', 'nu metal', 'metalcore', 'melodic metalcore',
+              'canadian metal', 'neo classical metal', 'old school thrash', 'prog metal',
+              'uk metalcore', 'rap metal', 'melodic black metal', 'traditional doom metal',
+              'glam metal', 'progressive metalcore'],
+
+    'jazz': ['jazz', 'swing', 'bebop', 'big band', 'jazz fusion', 'cool jazz', 'hard bop',
+             'contemporary jazz', 'smooth jazz', 'latin jazz', 'modal jazz', 'post-bop', 'free jazz',
+             'jazz blues', 'jazz funk', 'jazz pop', 'jazz rap', 'jazz trio', 'jazz trumpet',
+             'new orleans jazz', 'dixieland', 'smooth saxophone', 'jazz-funk', 'soul jazz'],
+
+    'folk': ['folk', 'folk rock', 'indie folk', 'contemporary folk',
+             'traditional folk',
+             'american folk revival', 'folk-pop', 'boston folk', 'stomp and holler',
+             'irish singer-songwriter', 'singer-songwriter', 'singer-songwriter pop',
+             'folk-country', 'irish folk'],
+
+    'blues': ['blues', 'chicago blues', 'delta blues', 'electric blues', 'country blues',
+              'contemporary blues', 'blues rock', 'modern blues', 'modern blues rock',
+              'piano blues', 'punk blues', 'soul blues', 'swamp blues', 'classic blues',
+              'harmonica blues'],
+
+    'classical': ['classical', 'orchestra', 'chamber music', 'symphony', 'opera', 'baroque',
+                  'romantic', 'contemporary classical', 'minimalism', 'modern classical',
+                  'orchestral', 'choral', 'classical performance', 'classical era',
+                  'early romantic era', 'late romantic era', 'post-romantic era',
+                  'british contemporary classical', 'polish classical', 'japanese classical',
+                  'classical cello', 'classical tenor', 'early music', 'impressionism',
+                  'neo-classical', 'orchestral performance', 'orchestral soundtrack',
+                  'german baroque', 'italian baroque', 'german romanticism'],
+
+    'world': ['world', 'latin', 'reggae', 'ska', 'afrobeat', 'brazilian', 'caribbean',
+              'cumbia', 'salsa', 'samba', 'bossa nova', 'reggaeton', 'tropical',
+              'urbano latino', 'reggaeton flow', 'reggaeton chileno', 'reggaeton colombiano',
+              'roots reggae', 'reggae fusion', 'ska punk', 'ska mexicano', 'dancehall',
+              'funk paulista', 'funk rj', 'funk carioca', 'latin alternative',
+              'tropical alternativo'],
+
+    'punk': ['punk', 'punk rock', 'pop punk', 'hardcore punk', 'post-punk', 'art punk',
+             'skatepunk', 'melodic punk', 'melodic punk rock', 'canadian pop punk']
+}
+
+# Reverse mapping for O(1) subgenre -> parent lookups
+GENRE_REVERSE_MAPPING = {}
+for parent, children in GENRE_MAPPING.items():
+    GENRE_REVERSE_MAPPING[parent] = parent
+    for child in children:
+        GENRE_REVERSE_MAPPING[child] = parent
+
+
+def map_to_parent_genre(genre):
+    """Map a subgenre to its parent genre."""
+    genre = genre.lower().strip()
+    return GENRE_REVERSE_MAPPING.get(genre, genre)
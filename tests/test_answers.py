@@ -0,0 +1,93 @@
+"""Tests for judging guesses: cleaning names and the bounded similarity."""
+import os
+import random
+import re
+import sys
+from difflib import SequenceMatcher
+
+import pytest
+from hypothesis import example, given, settings
+from hypothesis import strategies as st
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from answers import (TOKEN_MATCH_RATIO, WHOLE_MATCH_RATIO, Answer, Guess, Term,  # noqa: E402
+                     clean_text, similar)
+
+
+def scored(a, b, threshold):
+    return SequenceMatcher(None, a, b).ratio() >= threshold
+
+
+def misspelt(name, rng):
+    chars = list(name)
+    for _ in range(rng.randint(1, 3)):
+        if not chars:
+            break
+        at = rng.randrange(len(chars))
+        chars[at:at + 1] = rng.choice(([], [chars[at]] * 2, [rng.choice('aeinrst')]))
+    return ''.join(chars)
+
+
+@pytest.mark.parametrize('threshold', [WHOLE_MATCH_RATIO, TOKEN_MATCH_RATIO, 0.5, 1.0])
+def test_similar_decides_as_the_full_score_would(threshold):
+    rng = random.Random(threshold)
+    names = ['alanis morissette', 'whitney houston', 'fleetwood mac', 'morissette',
+             'simon garfunkel', 'tpain', 'the beatles', 'dont stop believin', 'a', '']
+    for _ in range(2000):
+        correct = rng.choice(names)
+        guess = misspelt(correct, rng) if correct and rng.random() < 0.7 else rng.choice(names)
+        assert similar(Term(guess), Term(correct), threshold) == scored(guess, correct, threshold), \
+            (guess, correct)
+
+
+def test_pairs_ruled_out_by_length_or_letters_are_never_scored(monkeypatch):
+    def unreachable(*args, **kwargs):
+        raise AssertionError('scored a pair the bounds rule out')
+
+    monkeypatch.setattr('answers.SequenceMatcher', unreachable)
+
+    assert not similar(Term('tpain'), Term('alanis morissette'), WHOLE_MATCH_RATIO)   # lengths
+    assert not similar(Term('xxxxxxxxxx'), Term('yyyyyyyyyy'), WHOLE_MATCH_RATIO)     # letters
+
+
+def test_a_long_guess_is_still_judged():
+    filler = ' '.join('morisete' if n % 2 else 'lorem' for n in range(5000))
+    answer = Answer(clean_text('alanis morissette'))
+
+    assert answer.matches(Guess(clean_text(filler)))
+    assert not Answer(clean_text('fleetwood mac')).matches(Guess(clean_text(filler)))
+
+
+def clean_text_as_it_was(text):
+    """clean_text before it was compiled, pass by pass."""
+    text = text.replace("don't", "dont")
+    text = text.replace("couldn't", "couldnt")
+    text = text.replace("won't", "wont")
+    text = text.replace("can't", "cant")
+    text = text.replace("ain't", "aint")
+    text = text.replace("'bout", "bout")
+    text = text.replace("'n'", "and")
+    text = text.replace("'", "")
+    text = re.sub(r'\([^)]*\)', '', text)
+    text = re.sub(r'\[[^\]]*\]', '', text)
+    text = re.sub(r'feat\.?|ft\.?|featuring', '', text, flags=re.IGNORECASE)
+    text = re.sub(r'[^\w\s]', ' ', text)
+    return ' '.join(text.split()).strip()
+
+
+# Pieces each pass looks for, so the generated text is mostly near misses
+PIECES = ["don't", "can't", "ain't", "'bout", "'n'", "'", 'n', 'bout', 't', '(', ')', '[', ']',
+          'feat', 'feat.', 'ft.', 'Ft', 'FEATURING', 'f', 'e', 'a', '.', ' ', '\t', '-', '_',
+          'é', 'ß', '1', 'Rock']
+
+
+@settings(max_examples=500)
+@given(st.one_of(st.text(), st.lists(st.sampled_from(PIECES), max_size=12).map(''.join)))
+@example("rock 'n' roll")
+@example("'n'bout")
+@example('fe(x)at')
+@example("f'eat")
+@example('[a (b] c)')
+def test_clean_text_matches_the_old_passes(text):
+    assert clean_text(text) == clean_text_as_it_was(text)
@@ -12,9 +12,18 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # Point the score database somewhere disposable before importing the app
 os.environ['SCORES_DB'] = os.path.join(tempfile.mkdtemp(), 'test_scores.db')
+os.environ['LIBRARY_SNAPSHOT_DIR'] = os.path.join(tempfile.mkdtemp(), 'snapshots')
 
+import answers  # noqa: E402
 import app as quiz  # noqa: E402
+import artist_index  # noqa: E402
+import quiz_library  # noqa: E402
+import taxonomy  # noqa: E402
 from artists import is_female_vocal  # noqa: E402
+from song_store import SongStore  # noqa: E402
+
+# Importing opens nothing; load the library as a worker would at boot
+quiz.start()
 
 FAKE_PREVIEW = 'https://example.invalid/preview.mp3'
 
@@ -27,15 +36,23 @@ NO_MATCH = 'zzzzzzzzzz qqqqqqqqqq'
 def client(monkeypatch):
     """A test client with Deezer stubbed and a clean score table."""
     monkeypatch.setattr(quiz, 'get_preview_url', lambda song, artist: FAKE_PREVIEW)
+    monkeypatch.setattr(quiz, 'find_preview',
+                        lambda song, artist: (FAKE_PREVIEW, 'itunes', '1'))
     quiz.app.config['TESTING'] = True
 
     with quiz.get_db() as db:
         db.cursor().execute('DELETE FROM scores')
+        db.cursor().execute('DELETE FROM player_totals')
         db.commit()
+    quiz.standings_cache.invalidate()
 
     with quiz.app.test_client() as client:
         yield client
 
+    # Let lookahead picks finish while Deezer is still stubbed
+    if quiz.lookahead:
+        quiz.lookahead.shutdown()
+
 
 def start_game(client, username='player'):
     return client.post('/set_username', json={'username': username})
@@ -49,6 +66,14 @@ def miss(client):
     return result
 
 
+def song_named(answer):
+    """The loaded song a session's answer refers to."""
+    songs = quiz.song_data.to_frame()
+    labels = songs.index[(songs['Song'] == answer['song'])
+                         & (songs['Artist'] == answer['artist'])]
+    return quiz.song_data.by_label(labels[0])
+
+
 def current_answer(client):
     """Read the song the server is holding for this session."""
     with client.session_transaction() as session:
@@ -400,12 +425,150 @@ def test_fewer_games_breaks_a_tie(client):
     assert [entry['username'] for entry in board] == ['efficient', 'grinder']
 
 
+def test_a_tie_at_the_cut_off_is_settled_as_the_board_shows_it(client):
+    for n in range(1, quiz.LEADERBOARD_SIZE + 1):
+        quiz.record_score(f'player{n:02}', 1)
+
+    # Level with all ten, one game each: the name settles it
+    assert quiz.record_score('zed', 1) is False
+    assert quiz.record_score('abe', 1) is True
+
+    board = client.get('/leaderboard').get_json()
+    names = [entry['username'] for entry in board]
+    assert names[0] == 'abe'
+    assert 'zed' not in names
+    assert len(names) == quiz.LEADERBOARD_SIZE
+
+
 def test_blank_games_do_not_add_a_player(client):
     play_game(client, 'shutout', 0)
 
     assert client.get('/leaderboard').get_json() == []
 
 
+GROUPED_FROM_SCORES = '''
+    SELECT MIN(username), SUM(score), COUNT(*), MAX(score)
+    FROM scores
+    GROUP BY LOWER(username)
+    ORDER BY SUM(score) DESC, COUNT(*) ASC, MIN(username)
+'''
+
+
+def totals_from_scores():
+    """The standings worked out from every game, as the board once was."""
+    with quiz.get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(GROUPED_FROM_SCORES)
+        return [(name, int(total), int(games), int(best))
+                for name, total, games, best in cursor.fetchall()]
+
+
+def test_the_rollup_keeps_step_with_every_game(client):
+    import random
+
+    rng = random.Random(21)
+    for _ in range(60):
+        quiz.record_score(rng.choice(['Ann', 'ann', 'ANN', 'bob', 'Cy', 'cy', 'Dee']),
+                          rng.randint(0, quiz.MAX_SONGS))
+
+    board = quiz.standings(limit=100)
+
+    assert sorted((row['username'], row['total'], row['games'], row['best'])
+                  for row in board) == sorted(totals_from_scores())
+    assert [row['username'] for row in board if row['username'].lower() == 'ann'] == ['ANN']
+
+
+def test_past_games_are_rolled_up_once(client):
+    with quiz.get_db() as conn:
+        cursor = conn.cursor()
+        # A database from before the rollup
+        cursor.execute('DROP TABLE player_totals')
+        cursor.execute('DELETE FROM schema_migrations WHERE version >= 3')
+        cursor.executemany(quiz.library.sql('INSERT INTO scores (username, score) VALUES (?, ?)'),
+                           [('old', 4), ('Old', 2), ('older', 5), ('old', 1)])
+        conn.commit()
+
+    quiz.init_db()
+    quiz.init_db()
+
+    assert [(row['username'], row['total'], row['games'], row['best'])
+            for row in quiz.standings()] == [('Old', 7, 3, 4), ('older', 5, 1, 5)]
+
+
+def test_recording_a_game_reports_a_place_on_the_board(client):
+    for n in range(quiz.LEADERBOARD_SIZE):
+        quiz.record_score(f'regular{n}', 3)
+        quiz.record_score(f'regular{n}', 3)
+
+    assert not quiz.record_score('newcomer', 2)     # 11th
+    assert quiz.record_score('newcomer', 5)         # 7 beats every 6
+    assert not quiz.record_score('another', 1)
+
+
+def test_recording_a_game_borrows_one_connection(client, monkeypatch):
+    borrowed = []
+    get_db = quiz.get_db
+
+    def counted():
+        borrowed.append(1)
+        return get_db()
+
+    monkeypatch.setattr(quiz, 'get_db', counted)
+    monkeypatch.setattr(quiz.standings_cache, 'read', lambda: pytest.fail('read the board'))
+
+    assert quiz.record_score('solo', 4)
+    assert len(borrowed) == 1
+
+
+def test_an_unchanged_board_is_not_sent_again(client):
+    play_game(client, 'steady', 2)
+    first = client.get('/leaderboard')
+
+    again = client.get('/leaderboard', headers={'If-None-Match': first.headers['ETag']})
+
+    assert first.status_code == 200
+    assert again.status_code == 304
+    assert not again.data
+    # Kept by the browser, but checked every time
+    assert 'no-store' not in first.headers['Cache-Control']
+    assert 'no-cache' in first.headers['Cache-Control']
+
+
+def test_a_game_recorded_here_shows_at_once(client):
+    play_game(client, 'steady', 2)
+    before = client.get('/leaderboard')
+
+    play_game(client, 'steady', 3)
+    after = client.get('/leaderboard', headers={'If-None-Match': before.headers['ETag']})
+
+    assert after.status_code == 200
+    assert after.get_json()[0]['total'] == 5
+
+
+def test_another_workers_game_shows_once_the_board_expires(client, monkeypatch):
+    play_game(client, 'steady', 2)
+    client.get('/leaderboard')
+    with quiz.get_db() as conn:
+        # As another worker records it: straight to the database
+        conn.cursor().execute(quiz.library.sql(quiz.ADD_TO_PLAYER_TOTALS),
+                              ('elsewhere', 'elsewhere', 4, 4))
+        conn.commit()
+
+    assert len(client.get('/leaderboard').get_json()) == 1
+
+    monkeypatch.setattr(quiz.standings_cache, 'ttl', 0)
+    assert len(client.get('/leaderboard').get_json()) == 2
+
+
+def test_a_cached_board_does_not_touch_the_database(client, monkeypatch):
+    play_game(client, 'steady', 2)
+    client.get('/leaderboard')
+    monkeypatch.setattr(quiz.standings_cache, 'read', lambda: pytest.fail('read the board'))
+
+    for _ in range(5):
+        assert client.get('/leaderboard').get_json()[0]['username'] == 'steady'
+
+
 def test_username_stays_after_game_over(client):
     start_game(client, 'persistent')
 
@@ -445,6 +608,88 @@ def test_wrong_answer_message_escapes_song_data(client, monkeypatch):
     assert '&lt;script&gt;' in message
 
 
+def test_a_long_answer_is_judged_as_cleaned(client):
+    start_game(client)
+    client.get('/new-song')
+    answer = current_answer(client)
+    # Cleaned down to just the artist, though it was typed far longer
+    typed = '... ' * (quiz.MAX_ANSWER_LENGTH // 4) + answer['artist'] + ' (live)' * 100
+
+    result = client.post('/check-answer', json={'answer': typed})
+    assert result.get_json()['correct'] is True
+
+
+def test_an_unclosed_bracket_flood_is_cut_before_cleaning(client, monkeypatch):
+    # clean_guess's bracket passes take seconds over 64k of unclosed brackets
+    cleaned = []
+    clean_guess = quiz.clean_guess
+    monkeypatch.setattr(quiz, 'clean_guess',
+                        lambda text: cleaned.append(len(text)) or clean_guess(text))
+    start_game(client)
+    client.get('/new-song')
+
+    for flood in ('(' * 64000, '[' * 64000):
+        result = client.post('/check-answer', json={'answer': flood})
+        assert result.get_json()['correct'] is False
+
+    assert cleaned and max(cleaned) <= quiz.MAX_GUESS_LENGTH
+
+
+def test_guesses_and_lookups_are_not_kept_in_the_clean_cache(client):
+    start_game(client)
+    client.get('/new-song')
+    before = answers.clean_text.cache_info().currsize
+
+    client.post('/check-answer', json={'answer': NO_MATCH + ' (a one-off)'})
+    client.get('/suggest', query_string={'q': NO_MATCH + ' [another]'})
+
+    assert answers.clean_text.cache_info().currsize == before
+
+
+def test_only_the_start_of_a_long_answer_is_judged(client):
+    start_game(client)
+    client.get('/new-song')
+    answer = current_answer(client)
+    padding = ' ' + 'q' * quiz.MAX_ANSWER_LENGTH
+
+    result = client.post('/check-answer', json={'answer': NO_MATCH + padding + answer['artist']})
+    assert result.get_json()['correct'] is False
+
+    result = client.post('/check-answer', json={'answer': answer['artist'] + padding * 300})
+    assert result.get_json()['correct'] is True
+
+
+# --- Suggesting artists ------------------------------------------------------
+
+def suggested(client, typed):
+    return client.get('/suggest', query_string={'q': typed}).get_json()['suggestions']
+
+
+def test_suggestions_complete_what_is_typed(client):
+    lead = quiz.loaded.artists.names[0]
+
+    found = suggested(client, lead[:3])
+
+    assert 0 < len(found) <= artist_index.SUGGESTION_LIMIT
+    assert lead in suggested(client, lead)
+
+
+def test_suggestions_do_not_depend_on_the_song_being_played(client):
+    start_game(client)
+    client.get('/new-song')
+    answer = current_answer(client)
+    typed = answers.clean_text(answer['artist'].lower())[:2]
+    during = suggested(client, typed)
+
+    with quiz.app.test_client() as stranger:
+        assert suggested(stranger, typed) == during
+
+
+def test_a_short_or_missing_query_suggests_nothing(client):
+    assert suggested(client, 'a') == []
+    assert client.get('/suggest').get_json() == {'suggestions': []}
+
+
 # --- Filtering ---------------------------------------------------------------
 
 def test_filters_are_applied(client):
@@ -454,10 +699,7 @@ def test_filters_are_applied(client):
     client.get('/new-song')
     answer = current_answer(client)
 
-    row = quiz.song_data[
-        (quiz.song_data['Song'] == answer['song'])
-        & (quiz.song_data['Artist'] == answer['artist'])
-    ].iloc[0]
+    row = song_named(answer)
 
     assert row['Decade'] == '1980s'
     assert 'rock' in row['ParentGenres']
@@ -500,6 +742,459 @@ def test_recent_songs_list_is_capped(client):
         assert len(session['recent_songs']) == quiz.MAX_RECENT_SONGS
 
 
+def test_the_next_song_is_ready_before_it_is_asked_for(client, monkeypatch):
+    if not quiz.lookahead:
+        pytest.skip('lookahead is switched off')
+    start_game(client)
+    client.get('/new-song')
+    first = current_answer(client)
+    hits = quiz.lookahead.hits
+
+    # Anything resolved now would have to come from the slot
+    monkeypatch.setattr(quiz, 'choose_song', None)
+    payload = client.get('/new-song').get_json()
+
+    assert payload['preview_url'] == FAKE_PREVIEW
+    assert quiz.lookahead.hits == hits + 1
+    assert current_answer(client) != first
+
+
+def test_the_next_game_deals_from_the_lookahead_slot(client):
+    if not quiz.lookahead:
+        pytest.skip('lookahead is switched off')
+    start_game(client)
+    client.post('/deck')
+    for round_number in range(quiz.MAX_SONGS):
+        if round_number:
+            client.get('/new-song')
+        miss(client)
+    hits = quiz.lookahead.hits
+
+    payload = client.post('/deck').get_json()
+
+    assert quiz.lookahead.hits == hits + 1
+    assert payload['rounds'] == quiz.MAX_SONGS
+    dealt = [current_answer(client)] + deck_of(client)
+    assert len({(song['song'], song['artist']) for song in dealt}) == quiz.MAX_SONGS
+
+
+def test_a_lookahead_slot_is_not_used_for_other_filters(client):
+    if not quiz.lookahead:
+        pytest.skip('lookahead is switched off')
+    start_game(client)
+    client.get('/new-song')
+    client.post('/update_filters', json={'genres': ['rock'], 'decades': ['1980s']})
+
+    client.get('/new-song')
+    answer = current_answer(client)
+    row = song_named(answer)
+
+    assert row['Decade'] == '1980s'
+
+
+# --- Dealing a whole game ----------------------------------------------------
+
+def deck_of(client):
+    with client.session_transaction() as session:
+        return session.get('deck', [])
+
+
+def test_a_deal_starts_the_first_round_without_the_answer(client):
+    start_game(client)
+    response = client.post('/deck')
+    payload = response.get_json()
+
+    assert response.status_code == 200
+    assert payload == {'preview_url': FAKE_PREVIEW, 'rounds': quiz.MAX_SONGS}
+    assert current_answer(client)['artist']
+    assert len(deck_of(client)) == quiz.MAX_SONGS - 1
+
+
+def test_a_dealt_game_has_no_repeats(client):
+    start_game(client)
+    client.post('/deck')
+
+    dealt = [current_answer(client)] + deck_of(client)
+    assert len({(song['song'], song['artist']) for song in dealt}) == quiz.MAX_SONGS
+
+
+def test_rounds_come_from_the_deck_in_order(client, monkeypatch):
+    start_game(client)
+    client.post('/deck')
+    upcoming = deck_of(client)
+
+    # Nothing may be looked up between rounds of a dealt game
+    monkeypatch.setattr(quiz, 'playable_url', None)
+    for expected in upcoming:
+        miss(client)
+        client.get('/new-song')
+        assert current_answer(client)['song'] == expected['song']
+
+
+def test_the_next_clip_rides_on_the_answer(client):
+    start_game(client)
+    client.post('/deck')
+    upcoming = deck_of(client)[0]
+
+    result = miss(client)
+
+    assert result['next_preview_url'] == upcoming['preview_url']
+    assert upcoming['artist'] not in result['message']   # only this round's answer
+
+
+def test_a_stale_signed_url_is_fetched_again_when_handed_out(client, monkeypatch):
+    start_game(client)
+    client.post('/deck')
+    with client.session_transaction() as session:
+        deck = session['deck']
+        deck[0].update(expires=True, resolved_at=0, preview_url='https://old.invalid')
+        session['deck'] = deck
+
+    monkeypatch.setattr(quiz, 'playable_url', lambda song: 'https://fresh.invalid')
+    result = miss(client)
+
+    assert result['next_preview_url'] == 'https://fresh.invalid'
+    assert client.get('/new-song').get_json()['preview_url'] == 'https://fresh.invalid'
+
+
+def test_a_whole_dealt_game_reaches_the_leaderboard(client):
+    start_game(client, 'dealt')
+    client.post('/deck')
+
+    for round_number in range(quiz.MAX_SONGS):
+        if round_number:
+            client.get('/new-song')
+        answer = current_answer(client)
+        result = client.post('/check-answer', json={'answer': answer['artist']}).get_json()
+
+    assert result['game_over'] is True
+    assert result['score'] == quiz.MAX_SONGS
+    assert deck_of(client) == []
+
+
+def test_changing_filters_drops_the_deck(client):
+    start_game(client)
+    client.post('/deck')
+
+    client.post('/update_filters', json={'genres': ['rock'], 'decades': ['1980s']})
+
+    assert deck_of(client) == []
+
+
+def test_songs_without_audio_are_dealt_around(client, monkeypatch):
+    calls = []
+
+    def every_other(song):
+        calls.append(song.name)
+        return FAKE_PREVIEW if len(calls) % 2 else None
+
+    monkeypatch.setattr(quiz, 'playable_url', every_other)
+    start_game(client)
+    payload = client.post('/deck').get_json()
+
+    assert payload['rounds'] == quiz.MAX_SONGS
+    assert len(calls) > quiz.MAX_SONGS
+
+
+def test_an_impossible_filter_deals_nothing(client):
+    start_game(client)
+    client.post('/update_filters', json={'genres': ['classical'], 'decades': ['1930s']})
+
+    payload = client.post('/deck').get_json()
+
+    assert 'No songs found' in payload['error']
+
+
+def test_warmup_picks_the_heaviest_expiring_songs(monkeypatch):
+    import pandas as pd
+
+    df = pd.DataFrame({
+        'PreviewSource': ['deezer', 'deezer', 'itunes', 'deezer'],
+        'PreviewId': ['1', '2', '3', None],
+        'Weight': [1.0, 3.0, 5.0, 9.0],
+    })
+    warmed = []
+    monkeypatch.setattr(quiz, 'warm_preview_cache', warmed.extend)
+
+    quiz.start_preview_warmup(SongStore.from_frame(df), count=5).join()
+
+    assert warmed == [('deezer', '2'), ('deezer', '1')]
+
+
+def test_cache_counters_are_exposed(client):
+    stats = client.get('/stats').get_json()
+
+    assert set(stats['preview_cache']) >= {'hits', 'misses', 'entries'}
+    assert set(stats['db_pool']) >= {'opened', 'reused', 'idle'}
+
+
+# --- Play-time failures -------------------------------------------------------
+
+@pytest.fixture
+def reports(monkeypatch):
+    """Play outcomes the app would write back, captured instead."""
+    written = {}
+    monkeypatch.setattr(quiz, 'play_reports', quiz.PlayReports(written.update))
+    monkeypatch.setattr(quiz, 'failing_songs', quiz.Counter())
+    monkeypatch.setattr(quiz, 'dead_songs', set())
+    return written
+
+
+def test_a_song_with_no_audio_is_reported(client, reports, monkeypatch):
+    monkeypatch.setattr(quiz, 'find_preview', lambda song, artist: (None, None, None))
+    song = quiz.song_data.row(0)
+
+    assert quiz.playable_url(song) is None
+    quiz.play_reports.flush()
+
+    assert reports == {(song['Song'], song['Artist']): (False, 1)}
+
+
+def test_an_unreachable_provider_is_not_held_against_the_song(client, reports, monkeypatch):
+    def unreachable(song, artist):
+        raise quiz.LookupFailed('network down')
+
+    monkeypatch.setattr(quiz, 'find_preview', unreachable)
+
+    assert quiz.playable_url(quiz.song_data.row(0)) is None
+    quiz.play_reports.flush()
+
+    assert reports == {}
+    assert not quiz.failing_songs
+
+
+def test_an_ordinary_play_is_not_news(client, reports):
+    quiz.playable_url(quiz.song_data.row(0))
+    quiz.play_reports.flush()
+
+    assert reports == {}
+
+
+def test_a_song_that_keeps_failing_stops_coming_up(client, reports, monkeypatch):
+    monkeypatch.setattr(quiz, 'find_preview', lambda song, artist: (None, None, None))
+    dead = quiz.song_data.row(0)
+    for _ in range(quiz.PLAY_FAILURE_LIMIT):
+        quiz.playable_url(dead)
+
+    rejected = quiz.song_index.flags(quiz.unplayable_here())
+    assert rejected[0]
+
+    monkeypatch.setattr(quiz, 'find_preview',
+                        lambda song, artist: (FAKE_PREVIEW, 'itunes', '1'))
+    picks = {quiz.choose_song([], [], []).song.name for _ in range(50)}
+    assert dead.name not in picks
+
+
+def test_failures_read_back_with_the_plays_are_counted(client, reports, monkeypatch):
+    import pandas as pd
+
+    song = quiz.song_data.row(0)
+    plays = pd.DataFrame({'PlayFailures': [quiz.PLAY_FAILURE_LIMIT - 1], 'Playable': [True]},
+                         index=[song.name])
+    monkeypatch.setattr(quiz, 'loaded', quiz.loaded._replace(plays=plays))
+
+    # Other workers' failures are cleared by a play here...
+    quiz.playable_url(song)
+    quiz.play_reports.flush()
+    assert reports == {(song['Song'], song['Artist']): (True, 0)}
+
+    # ...and one more here is the last straw
+    monkeypatch.setattr(quiz, 'find_preview', lambda song, artist: (None, None, None))
+    quiz.playable_url(song)
+    assert song.name in quiz.unplayable_here()
+
+
+def test_a_reload_forgets_what_was_seen_here(client, reports, monkeypatch):
+    import pandas as pd
+
+    monkeypatch.setattr(quiz, 'find_preview', lambda song, artist: (None, None, None))
+    dead = quiz.song_data.row(0)
+    for _ in range(quiz.PLAY_FAILURE_LIMIT):
+        quiz.playable_url(dead)
+    assert dead.name in quiz.unplayable_here()
+
+    # The audit has put it back since
+    monkeypatch.setattr(quiz, 'loaded', quiz.loaded._replace(version=(1, 0)))
+    monkeypatch.setattr(quiz.library, 'library_version', lambda: (1, 1))
+    monkeypatch.setattr(quiz.library, 'load_plays', lambda since: pd.DataFrame(
+        {'PlayFailures': [0], 'Playable': [True]}, index=[dead.name]))
+    assert quiz.reload_library()
+
+    assert not quiz.unplayable_here()
+    assert not quiz.failing_songs
+
+
+def test_failing_songs_are_weighted_down():
+    import pandas as pd
+
+    df = pd.DataFrame({'Year': [2000, 2000], 'PlayFailures': [0, 1]})
+    weights = quiz_library.song_weights(df)
+
+    assert weights.iloc[1] == weights.iloc[0] / 2
+
+
+def test_recency_rises_evenly_across_the_years():
+    import numpy as np
+    import pandas as pd
+
+    df = pd.DataFrame({'Year': [1960, 1990, 2020, np.nan, 'unknown']})
+    weights = quiz_library.song_weights(df)
+
+    ramp = quiz_library.RECENCY_WEIGHT - 1.0
+    assert list(weights) == [1.0, 1.0 + ramp / 2, 1.0 + ramp, 1.0, 1.0]
+
+
+# --- Reloading the library ----------------------------------------------------
+
+def test_an_unchanged_library_is_not_reloaded(monkeypatch):
+    monkeypatch.setattr(quiz, 'loaded', quiz.loaded._replace(version=(1, 0)))
+    monkeypatch.setattr(quiz.library, 'library_version', lambda: (1, 0))
+    monkeypatch.setattr(quiz.library, 'load_changes', None)
+
+    assert not quiz.reload_library()
+
+
+def test_a_reload_swaps_in_only_what_changed(monkeypatch):
+    import numpy as np
+    import pandas as pd
+
+    before = quiz.loaded
+    monkeypatch.setattr(quiz, 'loaded', before._replace(version=(1, 0)))
+
+    frame = before.data.to_frame()
+    renamed, gone = frame.index[0], frame.index[1]
+    rows = frame.loc[[renamed]].drop(columns=['Weight'])
+    rows['Song'] = 'Renamed'
+    added = rows.rename(index={renamed: 10 ** 9}).assign(Song='Brand New', Artist='Zyzzyva Quartet')
+    monkeypatch.setattr(quiz.library, 'library_version', lambda: (2, 0))
+    monkeypatch.setattr(quiz.library, 'load_changes', lambda since: (
+        pd.concat([rows, added]), pd.Index([renamed, gone, 10 ** 9])))
+
+    assert quiz.reload_library()
+
+    after = quiz.loaded
+    assert after.version == (2, 0)
+    assert after.data.by_label(renamed)['Song'] == 'Renamed'
+    assert after.data.by_label(10 ** 9)['Song'] == 'Brand New'
+    assert after.data.by_label(gone) is None
+    assert len(after.data) == len(before.data)
+    assert after.index.size == len(after.data)
+    assert not np.isnan(after.data.column('Weight')).any()
+    # The old snapshot is untouched, for any request still holding it
+    assert before.data.by_label(renamed)['Song'] != 'Renamed'
+    assert quiz.song_data is after.data
+    assert after.artists.suggest('zyzz') == ['Zyzzyva Quartet']
+    assert before.artists.suggest('zyzz') == []
+
+
+def test_a_reload_after_a_delete_reads_everything_again(monkeypatch):
+    before = quiz.loaded
+    monkeypatch.setattr(quiz, 'loaded', before._replace(version=(1, 0)))
+    monkeypatch.setattr(quiz.library, 'library_version', lambda: (8, 0))
+    monkeypatch.setattr(quiz.library, 'deleted_since', lambda since: since < 8)
+    monkeypatch.setattr(quiz.library, 'load_changes', None)    # can't see what went
+    whole = before.data.to_frame().iloc[1:]
+    monkeypatch.setattr(quiz.library, 'load_songs', lambda: whole.drop(columns=['Weight']))
+    monkeypatch.setattr(quiz, 'current_version', lambda: (8, 0))
+    monkeypatch.setattr(quiz, 'stored_snapshot', lambda version: None)
+
+    assert quiz.reload_library()
+
+    after = quiz.loaded
+    assert after.version == (8, 0)
+    assert len(after.data) == len(before.data) - 1
+    assert after.data.by_label(before.data.labels[0]) is None
+
+
+def test_a_play_is_laid_over_the_library_without_deriving_it_again(monkeypatch):
+    import pandas as pd
+
+    before = quiz.loaded
+    monkeypatch.setattr(quiz, 'loaded', before._replace(version=(1, 0)))
+    flaky, dead = before.data.labels[0], before.data.labels[1]
+    monkeypatch.setattr(quiz.library, 'library_version', lambda: (1, 1))
+    monkeypatch.setattr(quiz.library, 'load_plays', lambda since: pd.DataFrame(
+        {'PlayFailures': [1, quiz.library.PLAY_FAILURE_LIMIT], 'Playable': [True, False]},
+        index=[flaky, dead]))
+    monkeypatch.setattr(quiz.library, 'load_changes', None)
+    monkeypatch.setattr(quiz, 'share_library', None)
+
+    assert quiz.reload_library()
+
+    after = quiz.loaded
+    assert after.version == (1, 1)
+    assert after.data is before.data
+    flaky_at, dead_at = after.data.positions_of([flaky, dead])
+    assert after.index.weights[flaky_at] == before.index.weights[flaky_at] / 2
+    assert after.index.weights[dead_at] == 0.0
+    assert dead_at not in {after.index.sampler().draw() for _ in range(50)}
+
+
+def test_a_reload_is_published_for_the_other_workers(monkeypatch):
+    import pandas as pd
+
+    monkeypatch.setattr(quiz, 'loaded', quiz.loaded._replace(version=(1, 0)))
+    monkeypatch.setattr(quiz.library, 'library_version', lambda: (3, 0))
+    monkeypatch.setattr(quiz.library, 'load_changes',
+                        lambda since: (quiz.loaded.data.to_frame().head(0), pd.Index([])))
+    assert quiz.reload_library()
+    mine = quiz.loaded
+
+    # Another worker noticing the same change maps what this one wrote
+    monkeypatch.setattr(quiz, 'loaded', mine._replace(version=(1, 0)))
+    monkeypatch.setattr(quiz.library, 'load_changes', None)
+    assert quiz.reload_library()
+
+    assert os.path.exists(quiz.snapshot_path((3, 0)))
+    assert not quiz.loaded.data.column('Weight').flags.writeable
+    assert len(quiz.loaded.data) == len(mine.data)
+    assert quiz.loaded.decades == mine.decades
+
+
+def test_a_stored_snapshot_is_booted_from(monkeypatch):
+    import snapshot
+
+    data = snapshot.dumps(quiz.song_data, decades=[1990], plays=4)
+    asked = []
+    monkeypatch.setattr(quiz.library, 'load_snapshot',
+                        lambda derivation, version: asked.append(version) or data)
+    monkeypatch.setattr(quiz.library, 'load_songs', None)   # the table isn't read
+
+    songs, decades, played = quiz.load_song_data((5, 6))
+
+    assert asked == [5]         # The catalog's generation; plays don't date it
+    assert decades == [1990]
+    assert played == 4
+    assert len(songs) == len(quiz.song_data)
+
+
+def test_a_missing_or_damaged_snapshot_falls_back_to_the_table(monkeypatch):
+    for stored in (None, b'not a snapshot'):
+        monkeypatch.setattr(quiz.library, 'load_snapshot', lambda d, v, stored=stored: stored)
+
+        songs, decades, played = quiz.load_song_data((5, 6))
+
+        assert len(songs) == len(quiz.song_data)
+        assert decades == quiz.all_decades
+        assert played == 6
+
+
+def test_the_tools_snapshot_matches_what_the_app_derives(monkeypatch):
+    import snapshot
+
+    monkeypatch.setattr(quiz.library, 'library_version', lambda: (7, 4))
+
+    version, data = quiz_library.build_snapshot()
+    songs, meta = snapshot.loads(data)
+
+    assert version == (7, 4)
+    assert meta['decades'] == quiz.all_decades
+    assert meta['plays'] == 4
+    assert list(songs.labels) == list(quiz.song_data.labels)
+    assert (songs.column('Weight') == quiz.song_data.column('Weight')).all()
+    assert (songs.genre_mask == quiz.song_data.genre_mask).all()
+
+
 # --- Data + genre mapping ----------------------------------------------------
 
 def test_song_data_loaded():
@@ -511,22 +1206,22 @@ def test_song_data_loaded():
 def test_songs_before_min_year_are_excluded():
     import pandas as pd
 
-    years = pd.to_numeric(quiz.song_data['Year'], errors='coerce')
-    assert years.min() >= quiz.MIN_YEAR
+    years = pd.to_numeric(pd.Series(quiz.song_data.column('Year')), errors='coerce')
+    assert years.min() >= quiz_library.MIN_YEAR
     assert years.notna().all()
 
 
 def test_decade_options_start_at_min_year():
-    assert min(quiz.all_decades) >= quiz.MIN_YEAR - (quiz.MIN_YEAR % 10)
+    assert min(quiz.all_decades) >= quiz_library.MIN_YEAR - (quiz_library.MIN_YEAR % 10)
     assert 1930 not in quiz.all_decades
     assert 1950 not in quiz.all_decades
 
 
 def test_parent_genre_mapping():
-    assert quiz.map_to_parent_genre('Hard Rock') == 'rock'
-    assert quiz.map_to_parent_genre('  TRAP ') == 'hip hop'
-    assert quiz.map_to_parent_genre('rock') == 'rock'
-    assert quiz.map_to_parent_genre('polka') == 'polka'  # unknown passes through
+    assert taxonomy.map_to_parent_genre('Hard Rock') == 'rock'
+    assert taxonomy.map_to_parent_genre('  TRAP ') == 'hip hop'
+    assert taxonomy.map_to_parent_genre('rock') == 'rock'
+    assert taxonomy.map_to_parent_genre('polka') == 'polka'  # unknown passes through
 
 
 @pytest.mark.parametrize('credit, lead', [
@@ -591,9 +1286,25 @@ def test_the_full_credit_still_counts(client):
     assert result['correct'] is True
 
 
+def test_rounds_carry_their_names_as_the_library_cleaned_them(client):
+    start_game(client)
+    client.get('/new-song')
+    answer = current_answer(client)
+
+    assert answer['artist_answer'] == answers.cleaned_artist(answer['artist'])
+    assert answer['song_answer'] == answers.cleaned_title(answer['song'])
+
+
+def test_every_song_is_stored_with_its_cleaned_names():
+    songs = quiz.song_data.to_frame()
+
+    assert list(songs['ArtistAnswer']) == [answers.cleaned_artist(a) for a in songs['Artist']]
+    assert list(songs['SongAnswer']) == [answers.cleaned_title(t) for t in songs['Song']]
+
+
 def matches(guess, correct):
-    return quiz.answer_matches(quiz.clean_text(guess.lower()),
-                               quiz.clean_text(correct.lower()))
+    return answers.answer_matches(answers.clean_text(guess.lower()),
+                                  answers.clean_text(correct.lower()))
 
 
 @pytest.mark.parametrize('guess, correct', [
@@ -648,9 +1359,9 @@ def test_answer_can_be_the_song_title(client):
 
 
 def test_clean_text():
-    assert quiz.clean_text("Don't Stop (Remastered)") == 'Dont Stop'
-    assert quiz.clean_text('Song feat. Someone') == 'Song Someone'
-    assert quiz.clean_text('  multiple   spaces  ') == 'multiple spaces'
+    assert answers.clean_text("Don't Stop (Remastered)") == 'Dont Stop'
+    assert answers.clean_text('Song feat. Someone') == 'Song Someone'
+    assert answers.clean_text('  multiple   spaces  ') == 'multiple spaces'
 
 
 # --- Female-vocal detection ---------------------------------------------------
@@ -690,6 +1401,64 @@ def test_one_tagged_song_marks_the_whole_artist():
         {'Artist': 'Marvin Gaye', 'Genres': 'soul'},
     ])
 
-    marked = quiz.female_fronted(df)
+    marked = quiz_library.female_fronted(df)
 
     assert list(marked) == [True, True, True, False]
+
+
+def test_songs_are_judged_as_one_song_at_a_time_would():
+    import pandas as pd
+    from artists import primary_artist
+
+    df = quiz.song_data.to_frame()[['Artist', 'Genres']]
+    leads = df['Artist'].apply(primary_artist).str.lower().str.strip()
+    marked = pd.Series([is_female_vocal(a, g) for a, g in zip(df['Artist'], df['Genres'])],
+                       index=df.index)
+
+    assert (quiz_library.female_fronted(df) == leads.isin(set(leads[marked]))).all()
+
+
+# --- Starting up --------------------------------------------------------------
+
+def run_python(code, tmp_path):
+    """Run `code` in a fresh interpreter, pointed at scratch storage."""
+    import subprocess
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, SCORES_DB=str(tmp_path / 'scores.db'),
+               LIBRARY_SNAPSHOT_DIR=str(tmp_path / 'snapshots'), PREVIEW_WARM_COUNT='0')
+    env.pop('DATABASE_URL', None)
+    return subprocess.run([sys.executable, '-c', code], cwd=root, env=env,
+                          capture_output=True, text=True, check=True).stdout
+
+
+def test_importing_the_app_opens_nothing(tmp_path):
+    run_python('import app; assert app.loaded is None', tmp_path)
+
+    assert not (tmp_path / 'scores.db').exists()
+    assert not (tmp_path / 'snapshots').exists()
+
+
+def test_the_first_request_loads_the_library(tmp_path):
+    output = run_python(
+        'import app\n'
+        'app.app.test_client().get("/check-session")\n'
+        'print(len(app.loaded.data), sorted(app.startup_timings))', tmp_path)
+
+    songs, phases = output.strip().splitlines()[-1].split(' ', 1)
+    assert int(songs) == len(quiz.song_data)
+    assert phases == "['background', 'index', 'library', 'library version', 'storage']"
+    assert (tmp_path / 'scores.db').exists()
+
+
+def test_starting_again_changes_nothing():
+    assert quiz.start() is quiz.loaded
+    assert quiz.start() is quiz.loaded
+
+
+def test_the_taxonomy_imports_without_the_app(tmp_path):
+    output = run_python('import sys, analyze_songs\n'
+                        'print(sorted({"app", "library", "pandas"} & set(sys.modules)))',
+                        tmp_path)
+
+    assert output.strip().splitlines()[-1] == "['pandas']"   # analyze_songs reads its CSV with pandas
@@ -0,0 +1,56 @@
+"""Tests for the artist typeahead."""
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from artist_index import ArtistIndex  # noqa: E402
+from quiz_library import answer_names  # noqa: E402
+from song_store import SongStore  # noqa: E402
+
+
+@pytest.fixture
+def index():
+    credits = ['Taylor Swift', 'Taylor Swift', 'Taylor Swift feat. Ed Sheeran', 'James Taylor',
+               'James Taylor', 'Talking Heads', 'The Temptations', 'Guns N\' Roses', 'Adele']
+    df = pd.DataFrame({
+        'Song': [f'Song {n}' for n in range(len(credits))],
+        'Artist': credits,
+        'Year': [2000] * len(credits),
+    })
+    df['ArtistAnswer'], df['SongAnswer'] = answer_names(df)
+    return ArtistIndex(SongStore.from_frame(df, [set()] * len(df), []))
+
+
+def test_names_are_suggested_from_their_first_letters(index):
+    assert index.suggest('ta') == ['Taylor Swift', 'Talking Heads', 'James Taylor']
+    assert index.suggest('TAL') == ['Talking Heads']
+
+
+def test_a_later_word_finds_a_name_after_the_first_words(index):
+    assert index.suggest('tay') == ['Taylor Swift', 'James Taylor']
+    assert index.suggest('swi') == ['Taylor Swift']
+    assert index.suggest('temp') == ['The Temptations']
+
+
+def test_the_query_is_cleaned_as_guesses_are(index):
+    assert index.suggest("guns n'") == ["Guns N' Roses"]
+    assert index.suggest('  adele!') == ['Adele']
+
+
+def test_guests_are_not_suggested_on_their_own(index):
+    assert index.suggest('ed') == []
+    assert len(index) == 6
+
+
+def test_short_or_unknown_queries_suggest_nothing(index):
+    assert index.suggest('t') == []
+    assert index.suggest('') == []
+    assert index.suggest('zz') == []
+
+
+def test_the_limit_is_kept(index):
+    assert index.suggest('ta', limit=1) == ['Taylor Swift']
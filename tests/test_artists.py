@@ -91,6 +91,49 @@ def test_library_load_drops_them():
     assert kept == {'See Emily Play', 'Imagine'}
 
 
+def _rules_row_by_row(df):
+    """What the library load did before the rules were applied in bulk."""
+    import pandas as pd
+
+    df = df.copy()
+    df['Artist'] = [canonical_artist(a) for a in df['Artist']]
+    years = pd.to_numeric(df.get('Year'), errors='coerce')
+    excluded = [is_excluded(artist, None if pd.isna(year) else year)
+                for artist, year in zip(df['Artist'], years)]
+    return df[[not flag for flag in excluded]]
+
+
+def test_library_load_matches_the_rules_one_song_at_a_time():
+    import numpy as np
+    import pandas as pd
+    import library
+
+    df = pd.DataFrame({
+        'Song': [f'Song {n}' for n in range(14)],
+        'Artist': ['The Beatles', 'Pink Floyd', 'Pink Floyd', 'pink  floyd', 'Bob Dylan',
+                   'Bob Dylan', 'Little Stevie Wonder', None, np.nan, 'The Beatles with Billy Preston',
+                   'Pink Floyd', 'Bob Dylan', 'Beach House', 'Daryl Hall & John Oates'],
+        'Year': [1964, 1972, 1973, 1980, 1968.0, '1969', 1963, 1990, None, 1969,
+                 'unknown', 1968.9, 1975, 1980],
+    }, index=range(100, 114))
+
+    bulk = library._apply_artist_rules(df)
+
+    pd.testing.assert_frame_equal(bulk, _rules_row_by_row(df))
+    assert list(bulk['Song']) == ['Song 1', 'Song 5', 'Song 6', 'Song 7', 'Song 8',
+                                  'Song 12', 'Song 13']
+
+
+def test_the_first_matching_rule_wins(monkeypatch):
+    import artists
+
+    monkeypatch.setattr(artists, 'EXCLUDED_ARTISTS',
+                        {'the doors': (None, 1970), 'the doors of perception': None})
+
+    assert not is_excluded('The Doors of Perception', 1975)
+    assert is_excluded('The Doors of Perception', 1965)
+
+
 # --- Name tidying ------------------------------------------------------------
 
 def test_little_stevie_wonder_is_renamed():
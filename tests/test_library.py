@@ -4,8 +4,11 @@ These run against SQLite, which takes the same code path as Postgres apart from
 the placeholder style. No network: the chart and preview lookups are stubbed.
 """
 import os
+import sqlite3
 import sys
 import tempfile
+import threading
+import time
 from datetime import datetime
 
 import pytest
@@ -15,13 +18,14 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 os.environ.setdefault('SCORES_DB', os.path.join(tempfile.mkdtemp(), 'library_test.db'))
 
 import library  # noqa: E402
+import migrations  # noqa: E402
 from tools import refresh_library  # noqa: E402
 
 
 @pytest.fixture
 def db():
     """A fresh, empty songs table."""
-    library.init_songs_table()
+    migrations.migrate()
     with library.get_db() as conn:
         conn.cursor().execute('DELETE FROM songs')
         conn.commit()
@@ -117,6 +121,44 @@ def test_empty_write_is_a_no_op(db):
     assert library.upsert_songs([]) == 0
 
 
+def test_a_row_with_nothing_to_set_is_not_written(db):
+    library.upsert_songs([song_row('Known', 'A')])
+    version = library.library_version()
+
+    assert library.upsert_songs([{'song': 'Known', 'artist': 'A'}]) == 0
+    assert library.upsert_songs([{'song': 'Known', 'artist': 'A'},
+                                 {'song': 'Known', 'artist': 'A', 'genres': 'pop'}]) == 1
+    assert library.library_version() == (version[0] + 1, version[1])
+
+
+def test_rows_past_a_batch_are_all_written(db):
+    rows = [song_row(f'Song {n}', 'A', genres='pop') for n in range(7)]
+    rows += [{'song': f'Song {n}', 'artist': 'A', 'chart_peak': n} for n in range(5)]
+
+    assert library.upsert_songs(rows, batch_size=2) == 12
+
+    assert count() == 7
+    assert fetch('Song 4', 'A')[1:] == ('pop', None, None, None, None, 4)
+    assert fetch('Song 6', 'A')[6] is None
+
+
+@pytest.mark.parametrize('batch_size', [1, 3, 100])
+def test_a_song_twice_in_one_write_lands_in_order(db, batch_size):
+    """Rows for one song are written as they came, whatever they're grouped with."""
+    assert library.upsert_songs([
+        {'song': 'Late', 'artist': 'A', 'genres': 'too early'},   # Not there yet
+        song_row('Late', 'A', genres='rock', year_end_rank=5),
+        song_row('Other', 'B'),
+        {'song': 'Late', 'artist': 'A', 'year_end_rank': 2},
+        song_row('Late', 'A', chart_peak=9),
+        {'song': 'Late', 'artist': 'A', 'genres': 'pop'},
+    ], batch_size=batch_size) == 6
+
+    assert count() == 2
+    year, genres, rank, _url, _src, _playable, peak = fetch('Late', 'A')
+    assert (year, genres, rank, peak) == (1985, 'pop', 2, 9)
+
+
 def test_decade_for():
     assert library.decade_for(1985) == '1980s'
     assert library.decade_for(2020) == '2020s'
@@ -150,6 +192,138 @@ def test_loaded_columns_match_what_the_app_expects(db):
         assert column in df.columns
 
 
+def play_failures(song, artist):
+    with library.get_db() as conn:
+        cursor = conn.cursor()
+        cursor.execute(library.sql(
+            'SELECT play_failures, playable FROM songs WHERE song = ? AND artist = ?'
+        ), (song, artist))
+        return cursor.fetchone()
+
+
+def test_play_failures_add_up_until_the_song_is_taken_out(db):
+    library.upsert_songs([song_row('Dead', 'A', playable=True)])
+
+    library.record_plays({('Dead', 'A'): (False, 1)})
+    assert play_failures('Dead', 'A')[0] == 1
+    assert play_failures('Dead', 'A')[1]
+
+    library.record_plays({('Dead', 'A'): (False, library.PLAY_FAILURE_LIMIT - 1)})
+    count, playable = play_failures('Dead', 'A')
+    assert count == library.PLAY_FAILURE_LIMIT
+    assert playable is not None and not playable
+    assert 'Dead' not in set(library._load_from_postgres()['Song'])
+
+
+def test_a_play_clears_the_failures(db):
+    library.upsert_songs([song_row('Flaky', 'A', playable=True, play_failures=2)])
+
+    library.record_plays({('Flaky', 'A'): (True, 0)})
+
+    assert play_failures('Flaky', 'A') == (0, 1)
+
+
+def test_failures_are_loaded_for_weighting(db):
+    library.upsert_songs([song_row('Flaky', 'A', play_failures=1)])
+
+    df = library._load_from_postgres()
+
+    assert df.loc[df['Song'] == 'Flaky', 'PlayFailures'].iloc[0] == 1
+
+
+def test_every_write_moves_the_version(db):
+    library.upsert_songs([song_row('First', 'A')])
+    catalog, plays = library.library_version()
+
+    library.upsert_songs([{'song': 'First', 'artist': 'A', 'genres': 'pop'}])
+    assert library.library_version() == (catalog + 1, plays)
+
+    library.record_plays({('First', 'A'): (False, 1)})
+    assert library.library_version() == (catalog + 1, plays + 1)
+
+
+def test_changes_are_read_back_by_label(db):
+    library.upsert_songs([song_row('Old', 'A'), song_row('Kept', 'B')])
+    since = library.library_version()[0]
+    library.upsert_songs([song_row('Old', 'A', playable=False), song_row('New', 'C')])
+
+    everything = library._load_from_postgres()
+    songs, written = library.load_changes(library.library_version()[0])
+    assert len(songs) == len(written) == 0
+
+    songs, written = library.load_changes(since)
+    assert list(songs['Song']) == ['New']   # Old is unplayable now
+    assert len(written) == 2                # but still reported, to drop
+    assert everything.index[everything['Song'] == 'New'][0] in songs.index
+
+
+def test_a_delete_is_told_apart_from_a_write(db):
+    library.upsert_songs([song_row('Charted', 'A', year_end_rank=1), song_row('Kept', 'B')])
+    since = library.library_version()[0]
+    library.upsert_songs([song_row('New', 'C')])
+    assert not library.deleted_since(since)
+
+    with library.get_db() as conn:
+        assert library.delete_songs(conn.cursor(), 'year_end_rank IS NOT NULL') == 1
+        conn.commit()
+
+    assert library.deleted_since(since)
+    assert not library.deleted_since(library.library_version()[0])
+    assert count() == 2
+
+
+def test_plays_are_read_back_apart_from_the_catalog(db):
+    library.upsert_songs([song_row('Flaky', 'A', play_failures=1), song_row('Fine', 'B')])
+    catalog, since = library.library_version()
+
+    library.record_plays({('Flaky', 'A'): (False, library.PLAY_FAILURE_LIMIT)})
+
+    assert len(library.load_changes(catalog)[1]) == 0
+    plays = library.load_plays(since)
+    assert list(plays['PlayFailures']) == [library.PLAY_FAILURE_LIMIT + 1]
+    assert list(plays['Playable']) == [False]
+    assert len(library.load_plays(library.library_version()[1])) == 0
+
+
+def test_a_write_stamped_earlier_but_committed_later_is_still_seen(db, monkeypatch):
+    """A writer whose clock runs behind, or that took its time to commit."""
+    library.upsert_songs([song_row('First', 'A')])
+    catalog, plays = library.library_version()
+
+    class Behind(datetime):
+        @classmethod
+        def now(cls):
+            return datetime(2001, 1, 1)
+    monkeypatch.setattr(library, 'datetime', Behind)
+    library.upsert_songs([{'song': 'First', 'artist': 'A', 'genres': 'pop'}])
+    library.record_plays({('First', 'A'): (False, 1)})
+
+    assert library.library_version() == (catalog + 1, plays + 1)
+    assert list(library.load_changes(catalog)[0]['Genres']) == ['pop']
+    assert list(library.load_plays(plays)['PlayFailures']) == [1]
+
+
+def test_a_stored_snapshot_is_only_read_back_for_its_version(db):
+    library.upsert_songs([song_row('First', 'A')])
+    version = library.library_version()[0]
+    library.save_snapshot('settings', version, b'packed')
+
+    assert library.load_snapshot('settings', version) == b'packed'
+    assert library.load_snapshot('other settings', version) is None
+
+    library.upsert_songs([song_row('Second', 'B')])
+    assert library.load_snapshot('settings', library.library_version()[0]) is None
+
+
+def test_a_play_does_not_date_the_stored_snapshot(db):
+    library.upsert_songs([song_row('First', 'A')])
+    library.save_snapshot('settings', library.library_version()[0], b'packed')
+
+    library.record_plays({('First', 'A'): (False, 1)})
+
+    assert library.load_snapshot('settings', library.library_version()[0]) == b'packed'
+
+
 def test_expiring_preview_urls_are_not_stored(db, monkeypatch):
     """Deezer links die within minutes; only the track id is worth keeping."""
     library.upsert_songs([song_row('Fresh', 'A')])
@@ -228,6 +402,156 @@ def test_a_real_miss_is_recorded(db, monkeypatch):
     assert checked_at is not None
 
 
+def test_concurrent_lookups_are_all_written(db, monkeypatch):
+    """Results land in whatever order lookups finish, flushed in batches."""
+    from previews import LookupFailed
+
+    library.upsert_songs([song_row(f'Song {n}', 'A') for n in range(9)])
+    monkeypatch.setattr(refresh_library, 'COMMIT_EVERY', 2)
+
+    def lookup(song, artist):
+        n = int(song.split()[1])
+        time.sleep(0.01 * (n % 3))
+        if n == 4:
+            raise LookupFailed('network down')
+        return ('https://x/a.mp3', 'itunes', str(n)) if n % 2 else (None, None, None)
+
+    monkeypatch.setattr(refresh_library, 'find_preview', lookup)
+
+    found = refresh_library.resolve_audio(limit=10, workers=4)
+
+    assert found == 4
+    assert fetch('Song 4', 'A')[5] is None          # unreachable stays unknown
+    assert fetch('Song 1', 'A')[5]
+    assert not fetch('Song 2', 'A')[5]
+    assert not refresh_library.previews.gates      # gates don't outlive the run
+
+
+
+def test_a_failed_last_write_does_not_hide_why_the_run_stopped(db, monkeypatch):
+    library.upsert_songs([song_row(f'Song {n}', 'A') for n in range(3)])
+    looked_up = []
+
+    def lookup(song, artist):
+        looked_up.append(song)
+        if len(looked_up) == 2:
+            raise RuntimeError('provider exploded')
+        return ('https://x/a.mp3', 'itunes', '1')
+
+    def database_down(rows):
+        raise sqlite3.OperationalError('database is down')
+
+    monkeypatch.setattr(refresh_library, 'find_preview', lookup)
+    monkeypatch.setattr(library, 'upsert_songs', database_down)
+
+    with pytest.raises(RuntimeError, match='provider exploded'):
+        refresh_library.resolve_audio(limit=10, workers=1)
+    assert not refresh_library.previews.gates
+
+# --- Connections -------------------------------------------------------------
+
+def test_a_connection_is_reused(db):
+    with library.get_db() as first:
+        pass
+    with library.get_db() as second:
+        pass
+
+    assert first is second
+
+
+def test_uncommitted_work_does_not_outlive_the_block(db):
+    with library.get_db() as conn:
+        conn.cursor().execute(library.sql(
+            'INSERT INTO songs (song, artist, year, decade) VALUES (?, ?, ?, ?)'),
+            ('Left Open', 'A', 1990, '1990s'))
+
+    assert count() == 0
+
+
+def test_idle_connections_are_capped(tmp_path):
+    pool = library.ConnectionPool(lambda: sqlite3.connect(str(tmp_path / 'pool.db'),
+                                                          check_same_thread=False), size=2)
+    borrowed = [pool.acquire() for _ in range(4)]
+    for conn in borrowed:
+        pool.release(conn)
+
+    assert pool.stats() == {'size': 2, 'max_size': 10, 'open': 2, 'idle': 2,
+                            'opened': 4, 'reused': 0}
+    with pytest.raises(sqlite3.ProgrammingError):
+        borrowed[-1].execute('SELECT 1')    # Came back beyond the cap, so closed
+
+
+def test_open_connections_are_capped(tmp_path):
+    pool = library.ConnectionPool(lambda: sqlite3.connect(str(tmp_path / 'pool.db'),
+                                                          check_same_thread=False),
+                                  size=1, max_size=2, timeout=0.05)
+    borrowed = [pool.acquire(), pool.acquire()]
+
+    with pytest.raises(library.PoolTimeout):
+        pool.acquire()
+
+    # A borrower waiting for one gets the next that comes back
+    threading.Timer(0.01, pool.release, (borrowed[0],)).start()
+    pool.timeout = 5
+    assert pool.acquire() is borrowed[0]
+    # One closed as it came back, past the idle cap, makes room for another
+    for conn in borrowed:
+        pool.release(conn)
+    pool.acquire(), pool.acquire()
+    assert pool.stats() == {'size': 1, 'max_size': 2, 'open': 2, 'idle': 0,
+                            'opened': 3, 'reused': 2}
+
+
+def test_a_dead_connection_is_replaced(tmp_path):
+    pool = library.ConnectionPool(lambda: sqlite3.connect(str(tmp_path / 'pool.db'),
+                                                          check_same_thread=False), ping_after=0)
+    dead = pool.acquire()
+    pool.release(dead)
+    dead.close()
+
+    conn = pool.acquire()
+
+    assert conn is not dead
+    assert conn.execute('SELECT 1').fetchone() == (1,)
+
+
+def test_a_forked_worker_leaves_the_inherited_connections_alone(db, monkeypatch):
+    monkeypatch.setattr(library, '_inherited', [])
+    monkeypatch.setattr(library, '_pool', library.connection_pool())
+    with library.get_db() as parents:
+        pass
+
+    library._after_fork_in_child()
+    with library.get_db() as own:
+        pass
+
+    assert own is not parents
+    assert library._inherited[0].idle[0][0] is parents
+    assert parents.execute('SELECT 1').fetchone() == (1,)     # Never closed
+
+
+def test_a_statement_is_prepared_once_per_connection():
+    class Recording:
+        def __init__(self):
+            self.connection = type('Connection', (), {'prepared': set()})()
+            self.statements = []
+
+        def execute(self, query, params=()):
+            self.statements.append((query, params))
+
+    cursor = Recording()
+    for score in (3, 4):
+        library.execute_prepared(cursor, 'record_score',
+                                 'INSERT INTO scores (username, score) VALUES (?, ?)',
+                                 ('mark', score))
+
+    assert cursor.statements == [
+        ('PREPARE record_score AS INSERT INTO scores (username, score) VALUES ($1, $2)', ()),
+        ('EXECUTE record_score (%s, %s)', ('mark', 3)),
+        ('EXECUTE record_score (%s, %s)', ('mark', 4)),
+    ]
+
+
 # --- The refresh job ---------------------------------------------------------
 
 class FakeEntry:
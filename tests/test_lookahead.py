@@ -0,0 +1,146 @@
+"""Tests for resolving a player's next clip in the background."""
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lookahead as lookahead_module  # noqa: E402
+import previews  # noqa: E402
+from lookahead import Lookahead  # noqa: E402
+
+
+class FakePick:
+    def __init__(self, song, expires=False, resolved_at=None):
+        self.song = song
+        self.preview_url = f'https://example.invalid/{song}.mp3'
+        self.expires = expires
+        self.resolved_at = time.time() if resolved_at is None else resolved_at
+
+
+@pytest.fixture
+def made():
+    """Every choose() call, as (genres, decades, recent)."""
+    return []
+
+
+@pytest.fixture
+def ahead(made):
+    def choose(genres, decades, recent):
+        made.append((genres, decades, recent))
+        return FakePick(f'song{len(made)}')
+
+    pool = Lookahead(choose, lambda pick: FakePick(pick.song), workers=2)
+    yield pool
+    pool.shutdown()
+
+
+def test_a_prepared_song_is_handed_over(ahead, made):
+    ahead.prepare('p1', ['rock'], [], {1, 2})
+
+    pick = ahead.take('p1', ['rock'], [])
+
+    assert pick.song == 'song1'
+    assert made == [(['rock'], [], frozenset({1, 2}))]
+    assert (ahead.hits, ahead.misses) == (1, 0)
+
+
+def test_a_slot_is_used_once(ahead):
+    ahead.prepare('p1', [], [], set())
+    ahead.take('p1', [], [])
+
+    assert ahead.take('p1', [], []) is None
+
+
+def test_changed_filters_throw_the_slot_away(ahead):
+    ahead.prepare('p1', ['rock'], [], set())
+
+    assert ahead.take('p1', ['pop'], []) is None
+    assert ahead.take('p1', ['rock'], []) is None
+
+
+def test_players_do_not_share_slots(ahead):
+    ahead.prepare('p1', [], [], set())
+
+    assert ahead.take('p2', [], []) is None
+    assert ahead.take('p1', [], []) is not None
+
+
+def test_a_stale_expiring_url_is_fetched_again(made):
+    refreshed = []
+
+    def refresh(pick):
+        refreshed.append(pick.song)
+        return FakePick(pick.song)
+
+    old = time.time() - previews.FRESH_FOR - 1
+    pool = Lookahead(lambda g, d, r: FakePick('deezer', True, old), refresh, 1)
+    pool.prepare('p1', [], [], set())
+
+    pick = pool.take('p1', [], [])
+    pool.shutdown()
+
+    assert refreshed == ['deezer']
+    assert pick.resolved_at > old
+
+
+def test_a_stale_url_that_cannot_be_refreshed_is_a_miss():
+    old = time.time() - previews.FRESH_FOR - 1
+    pool = Lookahead(lambda g, d, r: FakePick('gone', True, old), lambda pick: None, 1)
+    pool.prepare('p1', [], [], set())
+
+    assert pool.take('p1', [], []) is None
+    pool.shutdown()
+
+
+def test_a_durable_url_never_goes_stale():
+    refreshed = []
+    long_ago = time.time() - 24 * 60 * 60
+    pool = Lookahead(lambda g, d, r: FakePick('itunes', False, long_ago),
+                     lambda pick: refreshed.append(pick), 1)
+    pool.prepare('p1', [], [], set())
+
+    assert pool.take('p1', [], []).song == 'itunes'
+    assert refreshed == []
+    pool.shutdown()
+
+
+def test_a_failed_pick_is_a_miss_not_an_error():
+    def explode(genres, decades, recent):
+        raise RuntimeError('deezer is down')
+
+    pool = Lookahead(explode, lambda pick: pick, 1)
+    pool.prepare('p1', [], [], set())
+
+    assert pool.take('p1', [], []) is None
+    pool.shutdown()
+
+
+def test_slots_are_bounded(ahead, monkeypatch):
+    monkeypatch.setattr(lookahead_module, 'MAX_SLOTS', 2)
+    for player in ('p1', 'p2', 'p3'):
+        ahead.prepare(player, [], [], set())
+
+    assert ahead.take('p1', [], []) is None
+    assert ahead.take('p3', [], []) is not None
+
+
+def test_a_slot_still_resolving_is_not_waited_on():
+    release = threading.Event()
+
+    def slow(genres, decades, recent):
+        release.wait(5)
+        return FakePick('slow')
+
+    pool = Lookahead(slow, lambda pick: pick, 1)
+    pool.prepare('p1', [], [], set())
+
+    started = time.monotonic()
+    assert pool.take('p1', [], []) is None
+    assert time.monotonic() - started < 1
+    assert pool.misses == 1
+    release.set()
+    pool.shutdown()
@@ -0,0 +1,135 @@
+"""Tests for the schema migrations, and that the hot queries stay indexed.
+
+These run against SQLite; the query plans are SQLite's, checked with
+EXPLAIN QUERY PLAN.
+"""
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('SCORES_DB', os.path.join(tempfile.mkdtemp(), 'migrations_test.db'))
+
+import app as quiz  # noqa: E402
+import library  # noqa: E402
+import migrations  # noqa: E402
+from tools import refresh_library  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """An empty SQLite database of its own, as get_db sees it."""
+    path = str(tmp_path / 'schema.db')
+    monkeypatch.setattr(library, 'SQLITE_PATH', path)
+    yield path
+    library.connection_pool().close()
+
+
+def tables_and_indexes(path):
+    with sqlite3.connect(path) as conn:
+        return {name for name, in conn.execute('SELECT name FROM sqlite_master')}
+
+
+def test_a_new_database_gets_every_migration_once(database):
+    assert migrations.migrate() == [version for version, _, _ in migrations.MIGRATIONS]
+    assert migrations.migrate() == []
+
+    assert {'songs', 'scores', 'player_totals', 'schema_migrations', 'songs_artist',
+            'songs_preview_checked_at', 'songs_needing_genres',
+            'scores_player', 'library_changes',
+            'songs_generation', 'songs_play_generation'} <= tables_and_indexes(database)
+
+
+def test_a_database_from_before_migrations_is_brought_up_to_date(database):
+    with sqlite3.connect(database) as conn:
+        # As the tables first shipped, with a game and a song already in them
+        conn.execute('CREATE TABLE songs (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                     'song TEXT NOT NULL, artist TEXT NOT NULL, year INTEGER NOT NULL, '
+                     'decade TEXT NOT NULL, genres TEXT, preview_checked_at TIMESTAMP, '
+                     'UNIQUE (song, artist))')
+        conn.execute("INSERT INTO songs (song, artist, year, decade) "
+                     "VALUES ('Dreams', 'Fleetwood Mac', 1977, '1970s')")
+        conn.execute('CREATE TABLE scores (id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                     'username TEXT NOT NULL, score INTEGER NOT NULL, '
+                     'timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)')
+        conn.execute("INSERT INTO scores (username, score) VALUES ('Mark', 4), ('mark', 2)")
+
+    migrations.migrate()
+
+    with sqlite3.connect(database) as conn:
+        columns = {row[1] for row in conn.execute('PRAGMA table_info(songs)')}
+        assert {'preview_id', 'play_failures', 'updated_at'} <= columns
+        assert conn.execute('SELECT song FROM songs').fetchall() == [('Dreams',)]
+        assert conn.execute('SELECT username, total, games FROM player_totals').fetchall() \
+            == [('Mark', 6, 2)]
+
+
+def test_a_failed_migration_runs_again_next_time(database):
+    def broken(cursor):
+        raise RuntimeError('half done')
+
+    with pytest.raises(RuntimeError):
+        migrations.migrate(migrations.MIGRATIONS + [(99, 'broken', broken)])
+
+    assert migrations.migrate(migrations.MIGRATIONS + [(99, 'fixed', lambda cursor: None)]) \
+        == [99]
+
+
+def test_migrations_are_numbered_in_order():
+    versions = [version for version, _, _ in migrations.MIGRATIONS]
+
+    assert versions == sorted(set(versions))
+
+
+# --- Query plans ---------------------------------------------------------------
+
+# The queries run per request, per game or per refresh batch. Each must reach
+# its rows through an index: no reading a whole table, no sorting one.
+HOT_QUERIES = {
+    'unchecked songs': refresh_library.UNCHECKED_SONGS,
+    'least recently checked': refresh_library.LEAST_RECENTLY_CHECKED,
+    'artists needing genres': refresh_library.ARTISTS_NEEDING_GENRES,
+    "setting an artist's genres": refresh_library.SET_ARTIST_GENRES,
+    'library version': library.LIBRARY_VERSION,
+    'songs written since': 'SELECT * FROM songs WHERE generation > ?',
+    'plays written since': library.PLAYS_SINCE,
+    'a play written back': library.RECORD_PLAY[True],
+    'a failed play written back': library.RECORD_PLAY[False],
+    'the board': quiz.STANDINGS_QUERY + ' LIMIT ?',
+    "a player's rank": ('SELECT ' + quiz.RANK_ON_BOARD.format(row='mine')
+                        + ' FROM player_totals AS mine WHERE mine.player = ?'),
+    'recording a game': quiz.RECORD_SCORE['sqlite'],
+    'backfilling the rollup': migrations.BACKFILL_PLAYER_TOTALS,
+}
+
+# A table read from end to end - through a covering index is still every row
+FULL_SCAN = re.compile(r'^SCAN (?!CONSTANT ROW)')
+
+# The scans that read only what they need
+SCANS_ALLOWED = {
+    # A partial index holding just the songs without genres
+    'artists needing genres': 'SCAN songs USING INDEX songs_needing_genres',
+    # The index walked in rank order, stopped by the LIMIT
+    'the board': 'SCAN player_totals USING INDEX player_totals_rank',
+    # Run once, over every game there is; walked in player order to group
+    'backfilling the rollup': 'SCAN scores USING INDEX scores_player',
+}
+
+
+@pytest.mark.parametrize('name', HOT_QUERIES)
+def test_hot_queries_use_an_index(database, name):
+    migrations.migrate()
+    query = HOT_QUERIES[name]
+
+    with sqlite3.connect(database) as conn:
+        plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + query,
+                                               (1,) * query.count('?'))]
+
+    scans = [step for step in plan if FULL_SCAN.match(step)]
+    assert scans in ([], [SCANS_ALLOWED.get(name)]), plan
+    assert not [step for step in plan if 'TEMP B-TREE' in step], plan
@@ -0,0 +1,56 @@
+"""Tests for batching play-time outcomes back to the library."""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from play_reports import PlayReports  # noqa: E402
+
+
+def test_outcomes_collapse_per_song():
+    written = []
+    reports = PlayReports(written.append)
+
+    reports.record('Dreams', 'Fleetwood Mac', False)
+    reports.record('Dreams', 'Fleetwood Mac', False)
+    reports.record('Hello', 'Adele', False)
+    reports.record('Hello', 'Adele', True)
+    reports.record('Hello', 'Adele', False)
+
+    assert reports.flush() == 2
+    assert written == [{
+        ('Dreams', 'Fleetwood Mac'): (False, 2),
+        ('Hello', 'Adele'): (True, 1),
+    }]
+
+
+def test_nothing_queued_writes_nothing():
+    written = []
+
+    assert PlayReports(written.append).flush() == 0
+    assert written == []
+
+
+def test_a_full_batch_is_written_in_the_background():
+    written = []
+    reports = PlayReports(written.append, flush_every=2, interval=60)
+
+    reports.record('A', 'A', False)
+    reports.record('B', 'B', False)
+
+    deadline = time.monotonic() + 2
+    while not written and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(written[0]) == 2
+
+
+def test_a_failed_write_is_dropped_not_raised():
+    def down(batch):
+        raise RuntimeError('database is down')
+
+    reports = PlayReports(down)
+    reports.record('A', 'A', False)
+
+    assert reports.flush() == 0
+    assert reports.flush() == 0
@@ -0,0 +1,237 @@
+"""Tests for preview lookups. No network: the providers are stubbed."""
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import previews  # noqa: E402
+from previews import PreviewCache  # noqa: E402
+
+
+def signed_url(track_id, expires_in):
+    return (f'https://cdnt-preview.dzcdn.net/api/1/1/x/{track_id}.mp3'
+            f'?hdnea=exp={int(time.time() + expires_in)}~acl=/api/1/*~hmac=abc')
+
+
+class FakeTrack:
+    def __init__(self, preview):
+        self.preview = preview
+
+
+@pytest.fixture
+def deezer(monkeypatch):
+    """Deezer's get_track, stubbed. Records the ids asked for."""
+    asked = []
+
+    def get_track(track_id):
+        asked.append(track_id)
+        return FakeTrack(signed_url(track_id, 15 * 60))
+
+    monkeypatch.setattr(previews.client, 'get_track', get_track)
+    monkeypatch.setattr(previews, 'preview_cache', PreviewCache())
+    return asked
+
+
+# --- Reading a signed URL's expiry -------------------------------------------
+
+def test_expiry_comes_from_the_signature():
+    url = 'https://cdnt-preview.dzcdn.net/a.mp3?hdnea=exp=1721234567~acl=/*~hmac=f'
+    assert previews.url_expiry(url) == 1721234567
+
+
+def test_an_unsigned_url_is_given_the_usual_lifetime():
+    assert previews.url_expiry('https://x/a.mp3', now=1000) == 1000 + previews.SIGNED_LIFETIME
+
+
+# --- The shared cache --------------------------------------------------------
+
+def test_a_refreshed_url_is_reused(deezer):
+    first = previews.refresh_preview('deezer', '42')
+    second = previews.refresh_preview('deezer', '42')
+
+    assert first == second
+    assert deezer == [42]
+    assert previews.preview_cache.stats()['hits'] == 1
+    assert previews.preview_cache.stats()['misses'] == 1
+
+
+def test_tracks_are_cached_separately(deezer):
+    previews.refresh_preview('deezer', '1')
+    previews.refresh_preview('deezer', '2')
+
+    assert deezer == [1, 2]
+
+
+def test_a_url_too_close_to_expiring_is_not_kept():
+    cache = PreviewCache()
+    cache.put(('deezer', '1'), signed_url(1, previews.FRESH_FOR))
+
+    assert cache.get(('deezer', '1')) is None
+
+
+def test_an_entry_is_dropped_once_it_is_too_old_to_hand_out(monkeypatch):
+    cache = PreviewCache()
+    cache.put(('deezer', '1'), signed_url(1, 15 * 60))
+    assert cache.get(('deezer', '1'))
+
+    later = time.time() + 15 * 60 - previews.FRESH_FOR
+    monkeypatch.setattr(previews.time, 'time', lambda: later)
+
+    assert cache.get(('deezer', '1')) is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_the_least_recently_used_entry_goes_first():
+    cache = PreviewCache(size=2)
+    for track in ('1', '2'):
+        cache.put(('deezer', track), signed_url(track, 15 * 60))
+    cache.get(('deezer', '1'))
+    cache.put(('deezer', '3'), signed_url(3, 15 * 60))
+
+    assert cache.get(('deezer', '1'))
+    assert cache.get(('deezer', '2')) is None
+    assert cache.stats()['entries'] == 2
+
+
+def test_a_failed_refresh_is_not_cached(monkeypatch):
+    def down(track_id):
+        raise RuntimeError('deezer is down')
+
+    monkeypatch.setattr(previews.client, 'get_track', down)
+    monkeypatch.setattr(previews, 'preview_cache', PreviewCache())
+
+    assert previews.refresh_preview('deezer', '7') is None
+    assert previews.preview_cache.stats()['entries'] == 0
+
+
+def test_warming_fetches_only_expiring_sources(deezer):
+    warmed = previews.warm_preview_cache([('deezer', '1'), ('itunes', '2'),
+                                          ('deezer', '3')])
+
+    assert warmed == 2
+    assert deezer == [1, 3]
+    assert previews.refresh_preview('deezer', '1')
+    assert deezer == [1, 3]   # served from the warmed cache
+
+
+# --- Hedged lookups ----------------------------------------------------------
+
+class FakeArtist:
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeResult:
+    def __init__(self, title, artist, preview, track_id):
+        self.title, self.artist = title, FakeArtist(artist)
+        self.preview, self.id = preview, track_id
+
+
+def stub_providers(monkeypatch, deezer_answers, itunes_answer, itunes_wait=0):
+    """deezer_answers maps a query kind (exact/combined/title) to
+    (seconds to wait, results or an exception)."""
+    asked = []
+
+    def search(query):
+        # The title here is one word, so only the combined query has a space
+        kind = ('exact' if query.startswith('track:')
+                else 'combined' if ' ' in query else 'title')
+        asked.append(kind)
+        wait, results = deezer_answers[kind]
+        time.sleep(wait)
+        if isinstance(results, Exception):
+            raise results
+        return results
+
+    def itunes(clean_song, clean_artist, song_words, artist_words):
+        asked.append('itunes')
+        time.sleep(itunes_wait)
+        if isinstance(itunes_answer, Exception):
+            raise itunes_answer
+        return itunes_answer
+
+    monkeypatch.setattr(previews.client, 'search', search)
+    monkeypatch.setattr(previews, '_itunes_preview', itunes)
+    return asked
+
+
+DREAMS = FakeResult('Dreams', 'Fleetwood Mac', 'https://dz/dreams.mp3', 1)
+WRONG = FakeResult('Dreams', 'The Cranberries', 'https://dz/other.mp3', 2)
+
+
+def test_hedged_takes_the_best_ranked_match(monkeypatch):
+    stub_providers(monkeypatch, {
+        'exact': (0.05, [DREAMS]),
+        'combined': (0, [DREAMS]),
+        'title': (0, [WRONG]),
+    }, ('https://itunes/dreams.m4a', '9'))
+
+    found = previews.find_preview('Dreams', 'Fleetwood Mac', hedged=True)
+
+    assert found == ('https://dz/dreams.mp3', 'deezer', '1')
+
+
+def test_hedged_falls_through_to_itunes(monkeypatch):
+    stub_providers(monkeypatch, {
+        'exact': (0, []), 'combined': (0, [WRONG]), 'title': (0, [WRONG]),
+    }, ('https://itunes/dreams.m4a', '9'))
+
+    found = previews.find_preview('Dreams', 'Fleetwood Mac', hedged=True)
+
+    assert found == ('https://itunes/dreams.m4a', 'itunes', '9')
+
+
+def test_a_slow_deezer_does_not_hold_up_the_answer(monkeypatch):
+    stub_providers(monkeypatch, {
+        'exact': (1.0, [DREAMS]), 'combined': (1.0, [DREAMS]), 'title': (1.0, [DREAMS]),
+    }, ('https://itunes/dreams.m4a', '9'))
+
+    started = time.monotonic()
+    found = previews.find_preview('Dreams', 'Fleetwood Mac', hedged=True, deadline=0.1)
+
+    assert found[1] == 'itunes'
+    assert time.monotonic() - started < 0.5
+
+
+def test_a_delayed_itunes_is_never_sent_when_deezer_answers(monkeypatch):
+    asked = stub_providers(monkeypatch, {
+        'exact': (0, [DREAMS]), 'combined': (0, []), 'title': (0, []),
+    }, ('https://itunes/dreams.m4a', '9'))
+
+    found = previews.find_preview('Dreams', 'Fleetwood Mac', hedged=True,
+                                  itunes_delay=0.5)
+    time.sleep(0.6)
+
+    assert found[1] == 'deezer'
+    assert 'itunes' not in asked
+
+
+def test_hedged_unreachable_is_still_a_failed_lookup(monkeypatch):
+    """Nothing answered, so nothing may be recorded as "no preview"."""
+    down = RuntimeError('down')
+    stub_providers(monkeypatch, {
+        'exact': (0, down), 'combined': (0, down), 'title': (0, down),
+    }, previews.LookupFailed('itunes unreachable'))
+
+    with pytest.raises(previews.LookupFailed):
+        previews.find_preview('Dreams', 'Fleetwood Mac', hedged=True)
+
+
+def test_hedged_searched_and_found_nothing(monkeypatch):
+    stub_providers(monkeypatch, {
+        'exact': (0, []), 'combined': (0, []), 'title': (0, RuntimeError('down')),
+    }, (None, None))
+
+    assert previews.find_preview('Dreams', 'Fleetwood Mac', hedged=True) == (None, None, None)
+
+
+def test_sequential_and_hedged_agree(monkeypatch):
+    stub_providers(monkeypatch, {
+        'exact': (0, [WRONG]), 'combined': (0, [DREAMS]), 'title': (0, [DREAMS]),
+    }, ('https://itunes/dreams.m4a', '9'))
+
+    assert (previews.find_preview('Dreams', 'Fleetwood Mac', hedged=False)
+            == previews.find_preview('Dreams', 'Fleetwood Mac', hedged=True))
@@ -0,0 +1,107 @@
+"""Tests for the library snapshot workers share."""
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import snapshot  # noqa: E402
+from song_store import SongStore  # noqa: E402
+
+
+@pytest.fixture
+def store():
+    df = pd.DataFrame({
+        'Song': ['Dreams', 'Hello', 'Señorita'],
+        'Artist': ['Fleetwood Mac', 'Adele', 'Fleetwood Mac'],
+        'Year': [1977, 2015, 2019],
+        'Decade': ['1970s', '2010s', '2010s'],
+        'Genres': ['rock', None, 'rock'],
+        'Weight': [1.0, 2.5, 3.0],
+    }, index=[40, 7, 12])
+    return SongStore.from_frame(df, [{'rock'}, {'pop', 'ballad'}, {'rock'}], ['rock', 'pop'])
+
+
+def test_a_snapshot_reads_back_as_written(tmp_path, store):
+    path = str(tmp_path / 'library.snap')
+    snapshot.write(path, snapshot.dumps(store, decades=[1970, 2010]))
+
+    mapped, meta = snapshot.read(path)
+
+    assert meta == {'decades': [1970, 2010]}
+    pd.testing.assert_frame_equal(mapped.to_frame(), store.to_frame())
+    assert mapped.by_label(7)['Song'] == 'Hello'
+    assert mapped.row(1)['ParentGenres'] == {'pop', 'ballad'}
+    assert mapped.row(1)['Genres'] is None
+
+
+def test_a_damaged_snapshot_is_refused(store):
+    data = bytearray(snapshot.dumps(store))
+    data[-1] ^= 0xFF
+
+    with pytest.raises(snapshot.SnapshotError, match='checksum'):
+        snapshot.loads(bytes(data))
+
+
+def test_a_snapshot_in_another_format_is_refused(store):
+    data = bytearray(snapshot.dumps(store))
+    snapshot.PREAMBLE.pack_into(data, 0, snapshot.MAGIC, snapshot.FORMAT + 1, 0, 0)
+
+    with pytest.raises(snapshot.SnapshotError, match='format'):
+        snapshot.loads(bytes(data))
+
+
+def test_a_mapped_snapshot_is_read_only(tmp_path, store):
+    path = str(tmp_path / 'library.snap')
+    snapshot.write(path, snapshot.dumps(store))
+
+    mapped, _ = snapshot.read(path)
+
+    assert not mapped.column('Weight').flags.writeable
+    with pytest.raises(ValueError):
+        mapped.column('Weight')[0] = 9.0
+
+
+def test_only_the_first_worker_builds(tmp_path, store):
+    path = str(tmp_path / 'shared' / 'library.snap')
+    builds = []
+
+    def build():
+        builds.append(1)
+        return snapshot.dumps(store, decades=[1970])
+
+    first, _ = snapshot.shared(path, build)
+    second, meta = snapshot.shared(path, build)
+
+    assert len(builds) == 1
+    assert meta == {'decades': [1970]}
+    assert len(first) == len(second) == 3
+
+
+def test_a_file_that_is_not_a_snapshot_is_rebuilt(tmp_path, store):
+    path = tmp_path / 'library.snap'
+    path.write_bytes(b'half a file')
+
+    mapped, _ = snapshot.shared(str(path), lambda: snapshot.dumps(store))
+
+    assert len(mapped) == 3
+
+
+def test_nothing_is_published_without_a_library(tmp_path):
+    path = tmp_path / 'library.snap'
+
+    assert snapshot.shared(str(path), lambda: None) == (None, None)
+    assert not path.exists()
+
+
+def test_publishing_removes_older_snapshots(tmp_path, store):
+    old = tmp_path / 'library-old.snap'
+    snapshot.write(str(old), snapshot.dumps(store))
+    kept, _ = snapshot.read(str(old))
+
+    snapshot.shared(str(tmp_path / 'library-new.snap'), lambda: snapshot.dumps(store))
+
+    assert not old.exists()
+    assert kept.by_label(40)['Song'] == 'Dreams'   # still mapped by whoever had it
@@ -0,0 +1,146 @@
+"""Tests for the genre and decade index behind pick_song's filters."""
+import os
+import sys
+import tempfile
+
+import random
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('SCORES_DB', os.path.join(tempfile.mkdtemp(), 'index_test.db'))
+
+import song_index  # noqa: E402
+from song_index import SongIndex, WeightedSampler  # noqa: E402
+from song_store import SongStore  # noqa: E402
+
+
+@pytest.fixture
+def index():
+    df = pd.DataFrame({
+        'Song': ['A', 'B', 'C', 'D'],
+        'Decade': ['1980s', '1980s', '1990s', '2000s'],
+        'ParentGenres': [{'rock'}, {'pop', 'rock'}, {'pop'}, set()],
+        'Weight': [1.0, 2.0, 3.0, 4.0],
+    }, index=[10, 11, 12, 13])
+    # rock is a named parent with a bit; pop is left to the long tail
+    return SongIndex(SongStore.from_frame(df, df['ParentGenres'], ['rock']))
+
+
+def test_no_filter_allows_everything(index):
+    assert list(index.matching()) == [0, 1, 2, 3]
+
+
+def test_genres_are_any_of(index):
+    assert list(index.matching(['rock'])) == [0, 1]
+    assert list(index.matching(['rock', 'pop'])) == [0, 1, 2]
+
+
+def test_decades_accept_either_spelling(index):
+    assert list(index.matching(decades=['1980s'])) == [0, 1]
+    assert list(index.matching(decades=['1990'])) == [2]
+
+
+def test_genre_and_decade_must_both_match(index):
+    assert list(index.matching(['pop'], ['1980s'])) == [1]
+
+
+def test_unknown_filters_match_nothing(index):
+    assert len(index.matching(['polka'])) == 0
+    assert len(index.matching(decades=['1930s'])) == 0
+
+
+def test_recent_songs_are_excluded_by_label(index):
+    everything = index.matching()
+    # 99 was never loaded; it must be ignored rather than raise
+    assert list(index.excluding(everything, {10, 12, 99})) == [1, 3]
+
+
+def test_index_agrees_with_a_pandas_scan():
+    """The same answers pick_song used to get by filtering the frame."""
+    import app as quiz
+    from quiz_library import parent_genres
+
+    df = quiz.song_data.to_frame()
+    df['ParentGenres'] = parent_genres(df)
+    for genres, decades in ((['rock'], []), (['pop', 'hip hop'], ['1990s', '2000s']),
+                            ([], ['1970s'])):
+        expected = df
+        if genres:
+            expected = expected[expected['ParentGenres'].apply(
+                lambda values: bool(values & set(genres)))]
+        if decades:
+            expected = expected[expected['Decade'].isin(decades)]
+
+        found = df.index[quiz.song_index.matching(genres, decades)]
+        assert list(found) == list(expected.index)
+
+
+# --- Weighted picking --------------------------------------------------------
+
+DRAWS = 20000
+
+
+def frequencies(draw):
+    counts = Counter(draw() for _ in range(DRAWS))
+    return {position: count / DRAWS for position, count in counts.items()}
+
+
+def test_draws_follow_the_weights(index):
+    sampler = index.sampler()
+    rng = random.Random(1)
+
+    seen = frequencies(lambda: sampler.draw(rng=rng))
+
+    for position, weight in enumerate([1.0, 2.0, 3.0, 4.0]):
+        assert seen[position] == pytest.approx(weight / 10, abs=0.015)
+
+
+def test_rejected_songs_leave_the_others_odds_alone(index):
+    """Same as sampling the remaining songs by weight, which pandas did."""
+    sampler = index.sampler()
+    rejected = index.flags({13})
+    rng = random.Random(2)
+
+    seen = frequencies(lambda: sampler.draw(rejected, rng=rng))
+
+    assert 3 not in seen
+    for position, weight in enumerate([1.0, 2.0, 3.0]):
+        assert seen[position] == pytest.approx(weight / 6, abs=0.015)
+
+
+def test_mostly_rejected_still_finds_the_rest(index, monkeypatch):
+    monkeypatch.setattr(song_index, 'MAX_REJECTIONS', 0)
+    sampler = index.sampler()
+
+    assert sampler.draw(index.flags({10, 11, 12})) == 3
+
+
+def test_everything_rejected_draws_nothing(index):
+    assert index.sampler(['rock']).draw(index.flags({10, 11})) is None
+
+
+def test_empty_filter_has_nothing_to_draw(index):
+    sampler = index.sampler(['polka'])
+    assert len(sampler) == 0
+    assert sampler.draw() is None
+
+
+def test_samplers_are_reused_and_bounded(index, monkeypatch):
+    monkeypatch.setattr(song_index, 'SAMPLER_CACHE_SIZE', 2)
+
+    first = index.sampler(['rock'], ['1980s'])
+    assert index.sampler(['rock'], ['1980']) is first   # same filter, other spelling
+
+    index.sampler(['pop'])
+    index.sampler([], ['1990s'])
+    assert index.sampler(['rock'], ['1980s']) is not first   # evicted
+
+
+def test_a_sampler_only_draws_what_its_filter_allows():
+    sampler = WeightedSampler(np.array([1, 3]), np.array([5.0, 1.0, 5.0, 1.0]))
+    assert {sampler.draw() for _ in range(200)} == {1, 3}
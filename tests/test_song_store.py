@@ -0,0 +1,91 @@
+"""Tests for the columnar store the quiz holds its library in."""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from song_store import SongStore  # noqa: E402
+
+
+@pytest.fixture
+def frame():
+    return pd.DataFrame({
+        'Song': ['Dreams', 'Hello', 'Señorita'],
+        'Artist': ['Fleetwood Mac', 'Adele', 'Fleetwood Mac'],
+        'Year': [1977, 2015, 2019],
+        'Decade': ['1970s', '2010s', '2010s'],
+        'Genres': ['rock,soft rock', None, 'rock,soft rock'],
+        'PreviewSource': ['deezer', None, 'itunes'],
+        'PreviewId': ['1', None, '3'],
+        'Weight': [1.0, 2.5, 3.0],
+    }, index=[40, 7, 12])
+
+
+@pytest.fixture
+def store(frame):
+    parents = [{'rock'}, {'pop', 'ballad'}, {'rock'}]
+    return SongStore.from_frame(frame, parents, ['rock', 'pop'])
+
+
+def test_rows_read_like_pandas_rows(store):
+    song = store.row(2)
+
+    assert song.name == 12
+    assert song['Song'] == 'Señorita'
+    assert song['Artist'] == 'Fleetwood Mac'
+    assert str(song['Year']) == '2019'
+    assert song.get('PreviewUrl') is None      # a column this library lacks
+    with pytest.raises(KeyError):
+        song['PreviewUrl']
+
+
+def test_missing_values_come_back_as_none(store):
+    song = store.row(1)
+
+    assert song['Genres'] is None
+    assert song['PreviewSource'] is None
+    assert song['PreviewId'] is None
+
+
+def test_songs_are_found_by_label(store):
+    assert store.by_label(7)['Song'] == 'Hello'
+    assert store.by_label(99) is None
+    assert list(store.positions_of([12, 99, 40])) == [2, 0]
+
+
+def test_repeated_values_are_stored_once(store):
+    codes = store._columns['Artist'].codes
+    assert codes.dtype == np.int8
+    assert codes[0] == codes[2]
+    assert store.row(0)['Artist'] is store.row(2)['Artist']
+
+
+def test_named_parent_genres_are_bits(store):
+    assert list(store.genre_mask) == [1, 2, 1]
+    assert list(store.other_genres['ballad']) == [1]
+    assert store.row(1)['ParentGenres'] == {'pop', 'ballad'}
+
+
+def test_numbers_are_narrow_arrays(store):
+    assert store.column('Year').dtype == np.int16
+    assert store.column('Weight').dtype == np.float64
+
+
+def test_the_frame_comes_back_as_it_went_in(frame, store):
+    back = store.to_frame()
+
+    assert list(back.index) == [40, 7, 12]
+    for column in ('Song', 'Artist', 'Decade', 'Genres', 'PreviewSource', 'PreviewId'):
+        assert list(back[column]) == list(frame[column])
+    assert list(back['Year']) == list(frame['Year'])
+
+
+def test_an_empty_store_finds_nothing():
+    empty = SongStore.from_frame(pd.DataFrame({'Song': []}, index=pd.Index([], dtype=int)))
+
+    assert len(empty) == 0
+    assert empty.by_label(1) is None
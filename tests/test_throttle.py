@@ -0,0 +1,99 @@
+"""Tests for the per-provider gates used by bulk preview lookups."""
+import os
+import socket
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import previews  # noqa: E402
+from throttle import ProviderGate, is_throttling  # noqa: E402
+
+
+def test_pushback_is_told_apart_from_failure():
+    assert is_throttling(socket.timeout('timed out'))
+    assert is_throttling(RuntimeError({'error': {'code': 4, 'message': 'Quota limit exceeded'}}))
+    assert is_throttling(RuntimeError(429, 'https://api.deezer.com/search', 'slow down'))
+    assert not is_throttling(RuntimeError('connection refused'))
+
+
+def test_throttling_halves_the_rate_and_success_wins_it_back():
+    gate = ProviderGate('deezer', concurrency=1, rate=100)
+
+    with pytest.raises(TimeoutError):
+        with gate.call():
+            raise TimeoutError('read timed out')
+    assert gate.rate == 50
+    assert gate.stats()['throttled'] == 1
+
+    for _ in range(20):
+        with gate.call():
+            pass
+    assert gate.rate == 100
+
+
+def test_plain_failures_leave_the_rate_alone():
+    gate = ProviderGate('deezer', concurrency=1, rate=100)
+
+    with pytest.raises(ValueError):
+        with gate.call():
+            raise ValueError('bad json')
+
+    assert gate.rate == 100
+    assert gate.stats()['failed'] == 1
+
+
+def test_the_rate_never_drops_below_the_floor():
+    gate = ProviderGate('deezer', concurrency=1, rate=16, min_rate=4)
+    for _ in range(10):
+        with pytest.raises(TimeoutError):
+            with gate.call():
+                raise TimeoutError()
+
+    assert gate.rate == 4
+
+
+def test_calls_are_spaced_to_the_rate():
+    gate = ProviderGate('itunes', concurrency=4, rate=20)
+    started = time.monotonic()
+    for _ in range(5):
+        with gate.call():
+            pass
+
+    # The first call is free; the next four wait 1/20s each
+    assert time.monotonic() - started >= 0.15
+
+
+def test_concurrency_is_capped():
+    gate = ProviderGate('deezer', concurrency=2, rate=1000)
+    inside, most = [0], [0]
+    lock = threading.Lock()
+
+    def work():
+        with gate.call():
+            with lock:
+                inside[0] += 1
+                most[0] = max(most[0], inside[0])
+            time.sleep(0.02)
+            with lock:
+                inside[0] -= 1
+
+    threads = [threading.Thread(target=work) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert most[0] == 2
+
+
+def test_previews_go_through_an_installed_gate(monkeypatch):
+    gate = ProviderGate('deezer', concurrency=1, rate=1000)
+    monkeypatch.setitem(previews.gates, 'deezer', gate)
+    monkeypatch.setattr(previews.client, 'search', lambda query: [])
+
+    assert previews._deezer_search('dreams', {'dreams'}, {'fleetwood'}) == (None, None)
+    assert gate.stats()['calls'] == 1
@@ -0,0 +1,96 @@
+"""Keeping bulk preview lookups inside what each provider will put up with.
+
+A gate per provider caps how many calls are out at once and how many start per
+second. When the provider pushes back - a 429, a quota error, a timeout - the
+gate halves its rate and then creeps back up as calls succeed, so a run that
+overdoes it slows itself down instead of getting shut out.
+
+Only the library tools install gates (see previews.gates). The app makes a few
+calls per round and is never the one hitting the limits.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+THROTTLE_STATUSES = {429, 503}
+RECOVERY_STEPS = 20     # Successes needed to climb from the floor back to full rate
+
+
+def is_throttling(error):
+    """Did the provider push back, rather than simply fail?"""
+    if isinstance(error, TimeoutError) or 'Timeout' in type(error).__name__:
+        return True
+    status = getattr(error, 'code', None)
+    if status is None and getattr(error, 'args', None):
+        status = error.args[0]   # deezer's HTTP errors lead with the status
+    if isinstance(status, int) and status in THROTTLE_STATUSES:
+        return True
+    text = str(error).lower()
+    return 'timed out' in text or 'quota' in text or 'too many requests' in text
+
+
+class ProviderGate:
+    """A concurrency limit plus a token bucket whose rate adapts to pushback."""
+
+    def __init__(self, name, concurrency, rate, min_rate=None):
+        self.name = name
+        self.max_rate = float(rate)
+        self.min_rate = float(min_rate) if min_rate is not None else self.max_rate / 16
+        self.rate = self.max_rate
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self.calls = 0
+        self.throttled = 0
+        self.failed = 0
+
+    def _wait_for_token(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                # A burst of up to a second's worth, never less than one call
+                capacity = max(self.rate, 1.0)
+                self._tokens = min(capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def _succeeded(self):
+        with self._lock:
+            self.calls += 1
+            self.rate = min(self.max_rate, self.rate + self.max_rate / RECOVERY_STEPS)
+
+    def _failed(self, error):
+        with self._lock:
+            self.calls += 1
+            self.failed += 1
+            if is_throttling(error):
+                self.throttled += 1
+                self.rate = max(self.min_rate, self.rate / 2)
+                # Everyone waiting backs off too, not just the caller that hit it
+                self._tokens = min(self._tokens, 0.0)
+
+    @contextmanager
+    def call(self):
+        """Wrap one request to the provider; waits for a slot and a token."""
+        with self._slots:
+            self._wait_for_token()
+            try:
+                yield
+            except Exception as e:
+                self._failed(e)
+                raise
+            self._succeeded()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'failed': self.failed,
+                'throttled': self.throttled,
+                'rate': round(self.rate, 2),
+            }
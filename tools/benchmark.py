@@ -0,0 +1,1112 @@
+"""Timings for the quiz's hot paths, old way against new.
+
+    python -m tools.benchmark answers      # judging a guess in /check-answer
+    python -m tools.benchmark clean        # clean_text over every title and credit
+    python -m tools.benchmark filter       # genre/decade filtering in pick_song
+    python -m tools.benchmark indexes      # the refresh job's queries before and after their indexes
+    python -m tools.benchmark leaderboard  # GET /leaderboard p50/p99, connection per call vs pooled
+    python -m tools.benchmark sample       # one weighted pick, recent songs excluded
+    python -m tools.benchmark similarity   # answers.similar checked against SequenceMatcher
+    python -m tools.benchmark memory       # RSS of the library as a DataFrame vs a store
+    python -m tools.benchmark workers      # per-worker memory and boot, private vs shared
+    python -m tools.benchmark standings    # the top ten: grouping every game vs the rollup
+    python -m tools.benchmark startup      # cold library load: songs table vs stored snapshot
+    python -m tools.benchmark suggest      # artist typeahead: scanning every lead vs the index
+    python -m tools.benchmark upsert       # rows/sec for a full rebuild, row by row vs batched
+    python -m tools.benchmark artists      # artist rules over a 100k-song library
+    python -m tools.benchmark weights      # pick weights over the library, and 10x it
+
+Runs against whichever library app.py loads - Postgres when DATABASE_URL is
+set, the CSV otherwise. Nothing is written.
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+ROUNDS = 2000
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def report(name, seconds, rounds):
+    logger.info(f'  {name:<28} {seconds / rounds * 1e6:10.1f} us/call')
+
+
+def _filter_cases(quiz):
+    genres = sorted(quiz.song_index.genres)
+    decades = [f'{d}s' for d in quiz.all_decades]
+    return [
+        ([], []),
+        (['rock'], []),
+        ([], ['1980s']),
+        (['rock', 'pop'], ['1980s', '1990s']),
+        (random.sample(genres, min(3, len(genres))), random.sample(decades, 2)),
+    ]
+
+
+def _old_frame(quiz):
+    """The library as pick_song used to hold it: a DataFrame, a set per row."""
+    import quiz_library
+
+    df = quiz.song_data.to_frame()
+    df['ParentGenres'] = quiz_library.parent_genres(df)
+    return df
+
+
+def bench_filter(rounds=ROUNDS):
+    """pick_song's filtering: the pandas scan it replaced against the index."""
+    import app as quiz
+
+    df, index = _old_frame(quiz), quiz.song_index
+    recent = list(df.index[:quiz.MAX_RECENT_SONGS])
+
+    def scan(genres, decades):
+        # What pick_song did before the index existed
+        filtered = df
+        if genres:
+            wanted = set(genres)
+            filtered = filtered[filtered['ParentGenres'].apply(
+                lambda values: bool(values & wanted))]
+        if decades:
+            filtered = filtered[filtered['Decade'].isin(decades)]
+        return filtered[~filtered.index.isin(recent)]
+
+    def indexed(genres, decades):
+        return index.excluding(index.matching(genres, decades), recent)
+
+    logger.info(f'Filtering {len(df)} songs, {rounds} rounds per case')
+    for genres, decades in _filter_cases(quiz):
+        assert len(scan(genres, decades)) == len(indexed(genres, decades))
+        logger.info(f'genres={genres or "any"} decades={decades or "any"}')
+        report('pandas scan', timeit.timeit(
+            lambda: scan(genres, decades), number=rounds // 10), rounds // 10)
+        report('bitmap index', timeit.timeit(
+            lambda: indexed(genres, decades), number=rounds), rounds)
+
+
+def bench_sample(rounds=ROUNDS):
+    """pick_song's weighted draw: pandas sample against the cached sampler."""
+    import app as quiz
+
+    df, index = _old_frame(quiz), quiz.song_index
+    recent = set(df.index[:quiz.MAX_RECENT_SONGS])
+
+    logger.info(f'Drawing from {len(df)} songs with {len(recent)} recent, '
+                f'{rounds} rounds per case')
+    for genres, decades in _filter_cases(quiz):
+        filtered = df.iloc[index.matching(genres, decades)]
+        if filtered.index.isin(recent).all():
+            continue   # a random case that leaves nothing to draw
+
+        def pandas_sample():
+            available = filtered[~filtered.index.isin(recent)]
+            return available.sample(n=1, weights=available['Weight']).iloc[0]
+
+        def cached_sample():
+            return index.sampler(genres, decades).draw(index.flags(recent))
+
+        logger.info(f'genres={genres or "any"} decades={decades or "any"}')
+        report('pandas sample', timeit.timeit(
+            pandas_sample, number=rounds // 10), rounds // 10)
+        report('cached sampler', timeit.timeit(
+            cached_sample, number=rounds), rounds)
+
+
+def rss():
+    """This process's resident set size, in bytes."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        # Not Linux: the peak is the best there is, in KiB
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _memory_probe(layout):
+    """Run in a fresh process: load the library held one way, print its cost."""
+    logging.disable(logging.INFO)
+    import library
+
+    # Importing the app loads no library, so the baseline doesn't hold one
+    import app  # noqa: F401
+    import quiz_library
+
+    # Run both layouts over a few songs first, so one-off imports and caches
+    # aren't counted against whichever goes first
+    sample = library.load_songs().head(100)
+    quiz_library.prepare_song_data(sample)
+    quiz_library.parent_genres(quiz_library.prepare_song_frame(sample)[0])
+    del sample
+    gc.collect()
+
+    before = rss()
+    tracemalloc.start()
+    df = library.load_songs()
+    if layout == 'frame':
+        held, _ = quiz_library.prepare_song_frame(df)
+        held['ParentGenres'] = quiz_library.parent_genres(held)
+    else:
+        held, _ = quiz_library.prepare_song_data(df)
+    del df
+    gc.collect()
+    live, peak = tracemalloc.get_traced_memory()
+    print(json.dumps({'live': live, 'peak': peak, 'added': rss() - before, 'rss': rss()}))
+
+
+def bench_memory(rounds=ROUNDS):
+    """What a worker spends holding the library: the old DataFrame against the
+    columnar store, each loaded in a fresh process.
+
+    "Live" is what the held library keeps allocated. RSS also carries the
+    load's high-water mark, which the allocator rarely hands back.
+    """
+    logger.info('Library memory per worker')
+    for layout, name in (('frame', 'DataFrame, sets per row'), ('store', 'SongStore')):
+        probe = subprocess.run(
+            [sys.executable, '-c',
+             f'from tools.benchmark import _memory_probe; _memory_probe({layout!r})'],
+            cwd=ROOT, capture_output=True, text=True, check=True)
+        found = json.loads(probe.stdout.strip().splitlines()[-1])
+        logger.info(f'  {name:<24} live {found["live"] / 1e6:5.2f} MB '
+                    f'(peak {found["peak"] / 1e6:5.2f}), '
+                    f'RSS +{found["added"] / 1e6:5.2f} MB, worker at {found["rss"] / 1e6:.1f} MB')
+
+
+def private_memory():
+    """Bytes of this process's memory no other process shares. Falls back to
+    RSS off Linux.
+    """
+    try:
+        with open('/proc/self/smaps_rollup') as rollup:
+            return sum(int(line.split()[1]) * 1024 for line in rollup
+                       if line.startswith(('Private_Clean:', 'Private_Dirty:')))
+    except OSError:
+        return rss()
+
+
+def _touch(songs):
+    """Read every array in a store, so mapped pages count as they would in use."""
+    parts = [songs.labels, songs.genre_mask, *songs.other_genres.values()]
+    for values in songs._columns.values():
+        parts.extend(vars(values).values() if hasattr(values, '__dict__') else [values])
+    for part in parts:
+        if part.dtype != object:
+            part.view(part.dtype).sum()
+
+
+def _worker_probe(layout, path):
+    """Run in a fresh process, one of several: boot a worker's library
+    privately or from the snapshot at `path`, then wait to be measured.
+    """
+    logging.disable(logging.INFO)
+    import library
+    import snapshot
+
+    import app as quiz
+    import quiz_library
+    gc.collect()
+
+    before = private_memory()
+    started = time.perf_counter()
+    if layout == 'shared':
+        songs, _ = snapshot.read(path)
+    else:
+        songs, _ = quiz_library.prepare_song_data(library.load_songs())
+    index = quiz.SongIndex(songs)
+    booted = time.perf_counter() - started
+    _touch(songs)
+    gc.collect()
+
+    # Measured only once every worker has booted, so shared pages are split
+    print('ready', flush=True)
+    sys.stdin.readline()
+    print(json.dumps({'boot': booted, 'added': private_memory() - before, 'songs': len(index.labels)}),
+          flush=True)
+
+
+def bench_workers(rounds=ROUNDS):
+    """What each gunicorn worker spends on the library as workers are added:
+    every worker loading its own against all of them mapping one snapshot.
+
+    Memory is what the library added to each worker that no other process
+    shares. A snapshot's pages count as private while only one worker maps them.
+    """
+    import library
+    import snapshot
+    import app as quiz
+    import quiz_library
+
+    songs, decades = quiz_library.prepare_song_data(library.load_songs())
+    path = os.path.join(tempfile.mkdtemp(), 'library.snap')
+    snapshot.write(path, snapshot.dumps(songs, decades=decades))
+    logger.info(f'Library of {len(songs)} songs; snapshot is '
+                f'{os.path.getsize(path) / 1e6:.2f} MB')
+
+    for workers in (1, 2, 4, 8):
+        found = {}
+        for layout in ('private', 'shared'):
+            probes = [subprocess.Popen(
+                [sys.executable, '-c',
+                 f'from tools.benchmark import _worker_probe; _worker_probe({layout!r}, {path!r})'],
+                cwd=ROOT, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+                for _ in range(workers)]
+            for probe in probes:
+                while probe.stdout.readline().strip() != 'ready':
+                    pass
+            results = []
+            for probe in probes:
+                out, _ = probe.communicate('\n')
+                results.append(json.loads(out.strip().splitlines()[-1]))
+            found[layout] = (sum(r['added'] for r in results) / workers / 1e6,
+                             sum(r['boot'] for r in results) / workers * 1000)
+        logger.info(f'  {workers} worker(s): own copy {found["private"][0]:5.2f} MB, '
+                    f'{found["private"][1]:6.1f} ms to boot; '
+                    f'shared {found["shared"][0]:5.2f} MB, {found["shared"][1]:6.1f} ms to boot')
+    os.unlink(path)
+
+
+def bench_startup(rounds=ROUNDS):
+    """A cold library load: reading the songs table and deriving everything,
+    against one read of a stored snapshot.
+
+    The table is whichever backend is configured. The snapshot is stored in a
+    scratch SQLite database, so nothing real is written.
+    """
+    import library
+    import quiz_library
+    import snapshot
+
+    def from_table():
+        return quiz_library.prepare_song_data(library.load_songs())
+
+    songs, decades = from_table()
+    data = snapshot.dumps(songs, decades=decades)
+    key, version = quiz_library.derivation(), ('benchmark',)
+
+    backend = library.USE_POSTGRES, library.SQLITE_PATH
+    library.USE_POSTGRES = False
+    library.SQLITE_PATH = os.path.join(tempfile.mkdtemp(), 'startup.db')
+    try:
+        library.save_snapshot(key, version, data)
+
+        def from_snapshot():
+            return snapshot.loads(library.load_snapshot(key, version))
+
+        runs = max(1, rounds // 200)
+        logger.info(f'{len(songs)} songs, snapshot {len(data) / 1e6:.2f} MB, {runs} loads each')
+        logging.disable(logging.INFO)
+        table = timeit.timeit(from_table, number=runs)
+        stored = timeit.timeit(from_snapshot, number=runs)
+        logging.disable(logging.NOTSET)
+    finally:
+        os.unlink(library.SQLITE_PATH)
+        library.USE_POSTGRES, library.SQLITE_PATH = backend
+
+    logger.info(f'  {"songs table, derived":<28} {table / runs * 1000:10.1f} ms/load')
+    logger.info(f'  {"stored snapshot":<28} {stored / runs * 1000:10.1f} ms/load')
+
+
+@contextmanager
+def _connect_per_call():
+    """library.get_db as it was: a fresh connection, closed after."""
+    import library
+
+    conn = library._connect()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def _unprepared(cursor, name, query, params=()):
+    import library
+
+    cursor.execute(library.sql(query), params)
+
+
+def bench_leaderboard(rounds=ROUNDS):
+    """GET /leaderboard, request by request: a new connection and a freshly
+    parsed query each time, a pooled connection and a prepared one, the
+    worker's cached board, and that board revalidated by ETag.
+
+    Runs against Postgres when DATABASE_URL is set, where the handshake is
+    what pooling saves. Otherwise against a scratch SQLite database filled
+    with made-up games, so nothing real is written.
+    """
+    import numpy as np
+
+    import app as quiz
+    import library
+    import migrations
+
+    backend = library.SQLITE_PATH
+    scratch = not library.USE_POSTGRES
+    if scratch:
+        library.SQLITE_PATH = os.path.join(tempfile.mkdtemp(), 'leaderboard.db')
+        quiz.init_db()
+        rng = random.Random(7)
+        with library.get_db() as conn:
+            conn.executemany('INSERT INTO scores (username, score) VALUES (?, ?)',
+                             [(f'player{rng.randrange(300)}', rng.randint(1, quiz.MAX_SONGS))
+                              for _ in range(5000)])
+            conn.commit()
+        with library.get_db() as conn:
+            conn.execute(migrations.BACKFILL_PLAYER_TOTALS)     # Rolls those games up
+            conn.commit()
+
+    client = quiz.app.test_client()
+    patched = quiz.get_db, quiz.execute_prepared
+    cache, ttl = quiz.standings_cache, quiz.standings_cache.ttl
+
+    def latencies(headers=None, status=200):
+        taken = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            assert client.get('/leaderboard', headers=headers).status_code == status
+            taken.append(time.perf_counter() - started)
+        return np.array(taken) * 1000
+
+    try:
+        cache.ttl = 0
+        quiz.get_db, quiz.execute_prepared = _connect_per_call, _unprepared
+        before = latencies()
+        quiz.get_db, quiz.execute_prepared = patched
+        after = latencies()
+        pooled = library.connection_pool().stats()
+        cache.ttl = max(ttl, 60)    # No expiry mid-run
+        cache.invalidate()
+        etag = client.get('/leaderboard').headers['ETag']
+        cached = latencies()
+        revalidated = latencies({'If-None-Match': etag}, 304)
+
+        def borrow(get_db):
+            with get_db() as conn:
+                conn.cursor().execute('SELECT 1')
+        alone = [timeit.timeit(lambda: borrow(get_db), number=rounds)
+                 for get_db in (_connect_per_call, library.get_db)]
+    finally:
+        quiz.get_db, quiz.execute_prepared = patched
+        cache.ttl = ttl
+        cache.invalidate()
+        if scratch:
+            library.connection_pool().close()
+            os.unlink(library.SQLITE_PATH)
+            library.SQLITE_PATH = backend
+
+    logger.info(f'{"Postgres" if not scratch else "SQLite"}, {rounds} requests each')
+    for name, taken in (('connection per call', before), ('pooled, prepared', after),
+                        ('cached board', cached), ('cached, 304', revalidated)):
+        p50, p99 = np.percentile(taken, [50, 99])
+        logger.info(f'  {name:<28} p50 {p50:7.2f} ms   p99 {p99:7.2f} ms')
+    report('a connection, SELECT 1', alone[0], rounds)
+    report('a pooled one, SELECT 1', alone[1], rounds)
+    logger.info(f'  pool: {pooled}')
+
+
+OLD_STANDINGS_QUERY = '''
+    SELECT MIN(username), SUM(score), COUNT(*), MAX(score)
+    FROM scores
+    GROUP BY LOWER(username)
+    ORDER BY SUM(score) DESC, COUNT(*) ASC
+    LIMIT ?
+'''
+
+
+def _old_record_score(quiz, username, final_score):
+    """record_score before it returned the rank: two writes and a commit,
+    then the top ten read back and searched for the player.
+    """
+    with quiz.get_db() as db:
+        cursor = db.cursor()
+        quiz.execute_prepared(cursor, 'record_score',
+                              'INSERT INTO scores (username, score) VALUES (?, ?)',
+                              (username, final_score))
+        quiz.execute_prepared(cursor, 'add_to_player_totals', quiz.ADD_TO_PLAYER_TOTALS,
+                              (username, username, final_score, final_score))
+        db.commit()
+    quiz.standings_cache.invalidate()
+    return any(row['username'].lower() == username.lower()
+               for row in quiz.standings_cache.get().rows)
+
+
+def bench_standings(rounds=ROUNDS):
+    """The top ten as the scores table grows: grouping every game on each
+    read, against a top-N read of player_totals. Also what recording a game
+    costs now that it updates the rollup too.
+
+    Each size is a scratch SQLite database of made-up games, so nothing real
+    is written.
+    """
+    import app as quiz
+    import library
+    import migrations
+
+    backend = library.USE_POSTGRES, library.SQLITE_PATH
+    library.USE_POSTGRES = False
+    rng = random.Random(7)
+    try:
+        for games in (10_000, 100_000, 1_000_000):
+            library.SQLITE_PATH = os.path.join(tempfile.mkdtemp(), 'standings.db')
+            quiz.init_db()
+            with library.get_db() as conn:
+                conn.executemany('INSERT INTO scores (username, score) VALUES (?, ?)',
+                                 [(f'player{rng.randrange(games // 20)}', rng.randint(1, 6))
+                                  for _ in range(games)])
+                conn.commit()
+            with library.get_db() as conn:
+                conn.execute(migrations.BACKFILL_PLAYER_TOTALS)
+                conn.commit()
+
+            with library.get_db() as conn:
+                cursor = conn.cursor()
+                cursor.execute(OLD_STANDINGS_QUERY, (quiz.LEADERBOARD_SIZE,))
+                grouped = [(name, total, count) for name, total, count, _ in cursor.fetchall()]
+            assert [(row['username'], row['total'], row['games']) for row in quiz.standings()] \
+                == grouped
+
+            def old():
+                with library.get_db() as conn:
+                    conn.execute(OLD_STANDINGS_QUERY, (quiz.LEADERBOARD_SIZE,)).fetchall()
+
+            runs = max(1, rounds // (games // 1000))
+            logger.info(f'{games} games, {games // 20} players; same top ten')
+            report('grouped from scores', timeit.timeit(old, number=runs), runs)
+            report('player_totals top-N', timeit.timeit(quiz.standings, number=rounds), rounds)
+            library.connection_pool().close()
+            os.unlink(library.SQLITE_PATH)
+
+        names = [f'player{n}' for n in range(500)]
+        games = [(rng.choice(names), rng.randint(1, 6)) for _ in range(rounds)]
+        timings, placed = [], []
+        logging.disable(logging.INFO)
+        for record in (lambda *game: _old_record_score(quiz, *game), quiz.record_score):
+            # The same games into an empty board each way
+            library.SQLITE_PATH = os.path.join(tempfile.mkdtemp(), 'standings.db')
+            quiz.init_db()
+            quiz.standings_cache.invalidate()
+            started = time.perf_counter()
+            placed.append([record(*game) for game in games])
+            timings.append(time.perf_counter() - started)
+            library.connection_pool().close()
+            os.unlink(library.SQLITE_PATH)
+        logging.disable(logging.NOTSET)
+        # The rank counts only players strictly ahead, so a tie for tenth is on
+        # the board where the top ten by LIMIT may have cut it
+        differ = sum(old != new for old, new in zip(*placed))
+        logger.info(f'{rounds} games recorded each way; {differ} placed differently')
+        report('write, then read the board', timings[0], rounds)
+        report('write returning the rank', timings[1], rounds)
+    finally:
+        library.USE_POSTGRES, library.SQLITE_PATH = backend
+
+
+SYNTHETIC_SONGS = 100_000
+
+
+def _synthetic_library(size=SYNTHETIC_SONGS, seed=7):
+    """A library of `size` songs drawn from the real artists, with every
+    rule's artists, joint credits and missing years mixed in.
+    """
+    import numpy as np
+    import pandas as pd
+
+    import artists
+    import library
+
+    names = list(library._load_from_csv()['Artist'].dropna().unique())
+    for rule in list(artists.EXCLUDED_ARTISTS) + list(artists.ARTIST_ALIASES):
+        names += [rule.title(), rule.upper(), f'{rule.title()} featuring Someone']
+    rng = np.random.default_rng(seed)
+    years = rng.integers(1955, 2026, size).astype(float)
+    years[rng.random(size) < 0.01] = np.nan
+    return pd.DataFrame({
+        'Song': [f'Song {n}' for n in range(size)],
+        'Artist': rng.choice(np.array(names, dtype=object), size),
+        'Year': years,
+    })
+
+
+def bench_indexes(rounds=ROUNDS):
+    """The refresh job's queries over a 100k-song table, before and after
+    the migration that indexes them. A scratch SQLite database, so nothing
+    real is written.
+    """
+    import library
+    import migrations
+    from tools import refresh_library
+
+    backend = library.USE_POSTGRES, library.SQLITE_PATH
+    library.USE_POSTGRES = False
+    library.SQLITE_PATH = os.path.join(tempfile.mkdtemp(), 'indexes.db')
+    try:
+        before = [entry for entry in migrations.MIGRATIONS
+                  if entry[2] is not migrations.refresh_indexes]
+        migrations.migrate(before)
+        songs = _synthetic_library()
+        rng = random.Random(7)
+        with library.get_db() as conn:
+            conn.executemany(
+                'INSERT INTO songs (song, artist, year, decade, genres, preview_checked_at) '
+                'VALUES (?, ?, 2000, ?, ?, ?)',
+                [(song, artist, '2000s', None if rng.random() < 0.02 else 'pop',
+                  None if rng.random() < 0.05 else f'2025-{rng.randint(1, 12):02}-01')
+                 for song, artist in zip(songs['Song'], songs['Artist'])])
+            conn.commit()
+        artists = list(songs['Artist'].sample(50, random_state=7))
+        queries = {
+            'unchecked songs': lambda conn: conn.execute(
+                refresh_library.UNCHECKED_SONGS, (200,)).fetchall(),
+            'least recently checked': lambda conn: conn.execute(
+                refresh_library.LEAST_RECENTLY_CHECKED, (200,)).fetchall(),
+            'artists needing genres': lambda conn: conn.execute(
+                refresh_library.ARTISTS_NEEDING_GENRES, (200,)).fetchall(),
+            "an artist's genres set": lambda conn: [conn.execute(
+                refresh_library.SET_ARTIST_GENRES, ('pop', None, artist)) for artist in artists],
+        }
+
+        def timings():
+            runs = max(1, rounds // 200)
+            with library.get_db() as conn:
+                return {name: timeit.timeit(lambda: query(conn), number=runs) / runs
+                        for name, query in queries.items()}
+
+        old = timings()
+        migrations.migrate()
+        new = timings()
+    finally:
+        library.connection_pool().close()
+        os.unlink(library.SQLITE_PATH)
+        library.USE_POSTGRES, library.SQLITE_PATH = backend
+
+    logger.info(f'{len(songs)} songs; before -> after the indexes')
+    for name in queries:
+        logger.info(f'  {name:<28} {old[name] * 1000:8.2f} ms -> {new[name] * 1000:6.2f} ms')
+
+
+def _old_upsert_songs(rows):
+    """library.upsert_songs before it batched: one statement per row."""
+    import library
+
+    written = 0
+    updated_at = library.datetime.now()
+    with library.get_db() as conn:
+        cursor = conn.cursor()
+        for row in rows:
+            row = {**row, 'updated_at': updated_at}
+            present = [c for c in library.COLUMNS if c in row]
+            updatable = [c for c in present if c not in ('song', 'artist')]
+            if all(c in row for c in library.REQUIRED):
+                updates = ', '.join(f'{c} = excluded.{c}' for c in updatable)
+                cursor.execute(library.sql(
+                    f"INSERT INTO songs ({', '.join(present)}) "
+                    f"VALUES ({', '.join('?' for _ in present)}) ON CONFLICT (song, artist) "
+                    f"DO UPDATE SET {updates}"), [row[c] for c in present])
+            else:
+                assignments = ', '.join(f'{c} = ?' for c in updatable)
+                cursor.execute(library.sql(f'UPDATE songs SET {assignments} '
+                                           f'WHERE song = ? AND artist = ?'),
+                               [row[c] for c in updatable] + [row['song'], row['artist']])
+            written += 1
+        conn.commit()
+    return written
+
+
+@contextmanager
+def _scratch_songs_table():
+    """A songs table nobody else sees, for get_db to hand out.
+
+    On Postgres, temporary tables on one connection, which shadow the real
+    ones for that session only. Otherwise a scratch SQLite database.
+    """
+    import library
+    import migrations
+
+    backend = library.get_db, library.SQLITE_PATH
+    if library.USE_POSTGRES:
+        conn = library._connect()
+        cursor = conn.cursor()
+        cursor.execute('CREATE TEMPORARY TABLE songs (id SERIAL PRIMARY KEY, '
+                       + ', '.join(f'{c} {t}' for c, t in library.COLUMN_TYPES.items())
+                       + ', UNIQUE (song, artist))')
+        # Generations are claimed from it on every write
+        cursor.execute('CREATE TEMPORARY TABLE library_changes '
+                       '(kind TEXT PRIMARY KEY, generation INTEGER NOT NULL)')
+        cursor.execute("INSERT INTO library_changes VALUES ('songs', 0), ('plays', 0), ('deletes', 0)")
+        conn.commit()
+
+        @contextmanager
+        def only_the_scratch():
+            yield conn
+        library.get_db = only_the_scratch
+    else:
+        library.SQLITE_PATH = os.path.join(tempfile.mkdtemp(), 'upsert.db')
+        migrations.migrate()
+    try:
+        yield
+    finally:
+        if library.USE_POSTGRES:
+            conn.close()
+        else:
+            library.connection_pool().close()
+            os.unlink(library.SQLITE_PATH)
+        library.get_db, library.SQLITE_PATH = backend
+
+
+def bench_upsert(rounds=ROUNDS):
+    """A full library rebuild through upsert_songs, in rows/sec: one
+    statement per row against batches of UPSERT_BATCH_SIZE. Into an empty
+    table, over the same songs again, and a genre pass of partial rows.
+
+    Postgres when DATABASE_URL is set, into a temporary table; a scratch
+    SQLite database otherwise. Either way nothing real is written.
+    """
+    import library
+
+    songs = _synthetic_library().dropna(subset=['Year'])
+    rng = random.Random(7)
+    rebuild = [{'song': song, 'artist': artist, 'year': int(year),
+                'decade': library.decade_for(year), 'genres': rng.choice(['pop', 'rock', None]),
+                'year_end_rank': rng.randint(1, 100)}
+               for song, artist, year in zip(songs['Song'], songs['Artist'], songs['Year'])]
+    genres = [{'song': row['song'], 'artist': row['artist'], 'genres': 'soul'}
+              for row in rebuild]
+
+    logger.info(f'{"Postgres" if library.USE_POSTGRES else "SQLite"}, {len(rebuild)} songs, '
+                f'batches of {library.UPSERT_BATCH_SIZE}')
+    for name, upsert in (('row by row', _old_upsert_songs), ('batched', library.upsert_songs)):
+        with _scratch_songs_table():
+            taken = []
+            for rows in (rebuild, rebuild, genres):
+                started = time.perf_counter()
+                assert upsert(rows) == len(rows)
+                taken.append(time.perf_counter() - started)
+        logger.info(f'  {name:<14}'
+                    + '   '.join(f'{label} {len(rebuild) / seconds:9,.0f} rows/s'
+                               for label, seconds in zip(('empty', 'again', 'genres'), taken)))
+
+
+def _old_artist_rules(df):
+    """library._apply_artist_rules as it was: both rules asked once per song."""
+    import pandas as pd
+
+    from artists import canonical_artist, is_excluded
+
+    df = df.copy()
+    df['Artist'] = [canonical_artist(a) for a in df['Artist']]
+    years = pd.to_numeric(df.get('Year'), errors='coerce')
+    excluded = [is_excluded(artist, None if pd.isna(year) else year)
+                for artist, year in zip(df['Artist'], years)]
+    return df[[not flag for flag in excluded]]
+
+
+def bench_artists(rounds=ROUNDS):
+    """Artist aliases and exclusions over a synthetic library: asked per song
+    against asked per distinct credit and spread back. Checks both agree.
+    """
+    import pandas as pd
+
+    import library
+
+    df = _synthetic_library()
+    runs = max(1, rounds // 400)
+    logger.info(f'{len(df)} songs, {df["Artist"].nunique()} distinct credits, {runs} runs each')
+
+    logging.disable(logging.INFO)
+    pd.testing.assert_frame_equal(library._apply_artist_rules(df), _old_artist_rules(df))
+    per_song = timeit.timeit(lambda: _old_artist_rules(df), number=runs)
+    per_credit = timeit.timeit(lambda: library._apply_artist_rules(df), number=runs)
+    logging.disable(logging.NOTSET)
+    logger.info('Identical results')
+    report('per song', per_song, runs)
+    report('per credit', per_credit, runs)
+
+
+def _old_song_weights(df):
+    """quiz_library.song_weights as it was: every rule asked once per song."""
+    import pandas as pd
+
+    import quiz_library
+    from artists import FEMALE_VOCAL_ARTISTS, FEMALE_VOCAL_TAGS, normalise_artist, primary_artist
+
+    def is_female_vocal(artist, genres):
+        credit = normalise_artist(artist)
+        lead = normalise_artist(primary_artist(artist))
+        for known in FEMALE_VOCAL_ARTISTS:
+            if credit == known or credit.startswith(known + ' ') or lead == known:
+                return True
+        if not isinstance(genres, str):
+            return False
+        return any(tag.strip().lower() in FEMALE_VOCAL_TAGS for tag in genres.split(','))
+
+    def recency_weight(year, oldest, newest):
+        if newest <= oldest:
+            return 1.0
+        try:
+            position = (int(year) - oldest) / (newest - oldest)
+        except (TypeError, ValueError):
+            return 1.0
+        position = min(max(position, 0.0), 1.0)
+        return 1.0 + (quiz_library.RECENCY_WEIGHT - 1.0) * position
+
+    years = pd.to_numeric(df['Year'], errors='coerce')
+    oldest, newest = int(years.min()), int(years.max())
+    weights = years.apply(lambda y: recency_weight(y, oldest, newest))
+
+    leads = df['Artist'].apply(primary_artist).str.lower().str.strip()
+    marked = pd.Series([is_female_vocal(a, g) for a, g in zip(df['Artist'], df['Genres'])],
+                       index=df.index)
+    female = leads.isin(set(leads[marked]))
+    return weights * female.map({True: quiz_library.FEMALE_VOCAL_WEIGHT, False: 1.0})
+
+
+def bench_weights(rounds=ROUNDS):
+    """Pick weights as computed at boot: per song against per distinct credit
+    and tag string, over the library and over ten copies of it.
+    """
+    import numpy as np
+    import pandas as pd
+
+    import library
+    import quiz_library
+
+    library_frame = library.load_songs()[['Artist', 'Genres', 'Year']]
+    runs = max(1, rounds // 400)
+    logging.disable(logging.INFO)
+    for copies in (1, 10):
+        df = pd.concat([library_frame] * copies, ignore_index=True)
+        new = quiz_library.song_weights(df)
+        assert np.allclose(new, _old_song_weights(df))
+        per_song = timeit.timeit(lambda: _old_song_weights(df), number=runs)
+        vectorised = timeit.timeit(lambda: quiz_library.song_weights(df), number=runs)
+        logging.disable(logging.NOTSET)
+        logger.info(f'{len(df)} songs, {runs} runs each; same weights')
+        report('per song', per_song, runs)
+        report('vectorised', vectorised, runs)
+        logging.disable(logging.INFO)
+    logging.disable(logging.NOTSET)
+
+
+def _old_check(typed, current_song):
+    """check_answer's judging as it was: both names cleaned and every form
+    rebuilt on each guess.
+    """
+    from difflib import SequenceMatcher
+
+    from answers import (ANSWER_STOPWORDS, MIN_SKELETON_LENGTH, MIN_TOKEN_LENGTH,
+                         TOKEN_MATCH_RATIO, WHOLE_MATCH_RATIO, clean_text, consonant_skeleton)
+    from artists import primary_artist
+
+    def similar(a, b, threshold):
+        return SequenceMatcher(None, a, b).ratio() >= threshold
+
+    def answer_matches(guess, correct):
+        if not guess or not correct:
+            return False
+        if correct in guess or similar(guess, correct, WHOLE_MATCH_RATIO):
+            return True
+        tight_guess, tight_correct = guess.replace(' ', ''), correct.replace(' ', '')
+        if len(tight_correct) >= 4 and tight_correct in tight_guess:
+            return True
+        if similar(tight_guess, tight_correct, WHOLE_MATCH_RATIO):
+            return True
+        skeleton = consonant_skeleton(tight_correct)
+        if len(skeleton) >= MIN_SKELETON_LENGTH and skeleton == consonant_skeleton(tight_guess):
+            return True
+        guess_words = guess.split()
+        return any(similar(word, other, TOKEN_MATCH_RATIO)
+                   for word in correct.split()
+                   if len(word) >= MIN_TOKEN_LENGTH and word not in ANSWER_STOPWORDS
+                   for other in guess_words)
+
+    guess = clean_text(typed.lower())
+    return (answer_matches(guess, clean_text(primary_artist(current_song['artist']).lower()))
+            or answer_matches(guess, clean_text(current_song['song'].lower())))
+
+
+def bench_answers(rounds=ROUNDS):
+    """Judging one guess in /check-answer: cleaning both names on every guess
+    against the names stored with the song and reduced once per guess.
+    """
+    import answers
+    import app as quiz
+
+    songs = quiz.song_data
+    rng = random.Random(7)
+    cases = []
+    for position in rng.sample(range(len(songs)), min(200, len(songs))):
+        song = songs.row(position)
+        current = {'artist': str(song['Artist']), 'song': str(song['Song']),
+                   'artist_answer': song['ArtistAnswer'], 'song_answer': song['SongAnswer']}
+        artist = current['artist']
+        dropped = rng.randrange(len(artist))
+        for typed in (artist, artist[:dropped] + artist[dropped + 1:], artist.split()[-1],
+                      current['song'], 'zzzzzzzzzz qqqqqqqqqq', 'the rolling stones'):
+            cases.append((typed, current))
+
+    def new_check(typed, current_song):
+        guess = answers.Guess(answers.clean_text(typed.lower()))
+        return any(answer.matches(guess) for answer in quiz.answers_for(current_song))
+
+    decided = [new_check(*case) for case in cases]
+    assert decided == [_old_check(*case) for case in cases]
+
+    runs = max(1, rounds // 200)
+    old = timeit.timeit(lambda: [_old_check(*case) for case in cases], number=runs)
+    # Each run starts with no names reduced, as a worker's first rounds do
+    new = timeit.timeit(lambda: (answers.answer_for.cache_clear(),
+                                 [new_check(*case) for case in cases]), number=runs)
+    logger.info(f'{len(cases)} guesses ({sum(decided)} right), {runs} runs each; same decisions')
+    report('names cleaned per guess', old, runs * len(cases))
+    report('stored names, one guess', new, runs * len(cases))
+
+
+def _near_misses(name, rng, count=4):
+    """`name` with a few letters dropped, doubled, swapped or changed."""
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    variants = []
+    for _ in range(count):
+        chars = list(name)
+        for _ in range(rng.randint(1, 3)):
+            if not chars:
+                break
+            at = rng.randrange(len(chars))
+            edit = rng.randrange(4)
+            if edit == 0:
+                del chars[at]
+            elif edit == 1:
+                chars.insert(at, chars[at])
+            elif edit == 2 and at + 1 < len(chars):
+                chars[at], chars[at + 1] = chars[at + 1], chars[at]
+            else:
+                chars[at] = rng.choice(letters)
+        variants.append(''.join(chars))
+    return variants
+
+
+def bench_similarity(rounds=ROUNDS):
+    """Calibration of answers.similar against the SequenceMatcher score it
+    stands in for, then a whole guess judged as its length grows.
+
+    Pairs are the library's cleaned names and their words against misspelt
+    copies and against other names, at both thresholds. Every decision has to
+    agree; where each was settled shows what the bounds save.
+    """
+    from difflib import SequenceMatcher
+
+    import answers
+    import app as quiz
+
+    rng = random.Random(11)
+    songs = quiz.song_data
+    names = sorted(set(songs.column('ArtistAnswer')) | set(songs.column('SongAnswer')))
+    names = rng.sample(names, min(1500, len(names)))
+    words = sorted({word for name in names for word in name.split()
+                    if len(word) >= answers.MIN_TOKEN_LENGTH})
+    pairs = []
+    for pool, threshold in ((names, answers.WHOLE_MATCH_RATIO),
+                            (words, answers.TOKEN_MATCH_RATIO)):
+        for correct in pool:
+            for guess in _near_misses(correct, rng) + rng.sample(pool, 4):
+                pairs.append((answers.Term(guess), answers.Term(correct), threshold))
+
+    settled = Counter()
+    disagreements = []
+    for guess, correct, threshold in pairs:
+        total = len(guess.text) + len(correct.text)
+        if total and 2.0 * min(len(guess.text), len(correct.text)) / total < threshold:
+            settled['lengths'] += 1
+        elif total and 2.0 * sum((guess.counts & correct.counts).values()) / total < threshold:
+            settled['letter counts'] += 1
+        else:
+            settled['scored'] += 1
+        scored = SequenceMatcher(None, guess.text, correct.text).ratio() >= threshold
+        if answers.similar(guess, correct, threshold) != scored:
+            disagreements.append((guess.text, correct.text, threshold))
+
+    logger.info(f'{len(pairs)} pairs, {len(disagreements)} decided differently')
+    for guess, correct, threshold in disagreements[:10]:
+        logger.info(f'  {guess!r} vs {correct!r} at {threshold}')
+    for how, count in settled.most_common():
+        logger.info(f'  settled on {how:<20} {count / len(pairs):6.1%}')
+
+    runs = max(1, rounds // 1000)
+    scored = timeit.timeit(lambda: [SequenceMatcher(None, g.text, c.text).ratio() >= t
+                                    for g, c, t in pairs], number=runs)
+    bounded = timeit.timeit(lambda: [answers.similar(g, c, t) for g, c, t in pairs],
+                            number=runs)
+    report('SequenceMatcher ratio', scored, runs * len(pairs))
+    report('answers.similar', bounded, runs * len(pairs))
+
+    # A long guess: made-up words, some the length of the answer's own
+    current = {'artist': 'Alanis Morissette', 'song': 'Hand in My Pocket'}
+    for size in (1_000, 8_000, 64_000):
+        typed = ''
+        while len(typed) < size:
+            typed += ''.join(rng.choice('aeilmnorst') for _ in range(rng.randint(3, 10))) + ' '
+
+        def judged(limit=None):
+            read = typed[:quiz.MAX_GUESS_LENGTH] if limit else typed
+            guess = answers.Guess(answers.clean_text(read.lower())[:limit])
+            return any(answer.matches(guess) for answer in quiz.answers_for(current))
+
+        old = timeit.timeit(lambda: _old_check(typed, current), number=1)
+        new = timeit.timeit(judged, number=1)
+        capped = timeit.timeit(lambda: judged(quiz.MAX_ANSWER_LENGTH), number=1)
+        logger.info(f'  {size:>6}-character guess: SequenceMatcher {old * 1000:8.1f} ms, '
+                    f'bounded {new * 1000:7.1f} ms, as /check-answer takes it '
+                    f'{capped * 1000:5.2f} ms')
+
+
+def _old_clean_text(text):
+    """answers.clean_text as it was: eight replaces and four regex passes."""
+    import re
+
+    for contraction in ("don't", "couldn't", "won't", "can't", "ain't", "'bout"):
+        text = text.replace(contraction, contraction.replace("'", ''))
+    text = text.replace("'n'", 'and').replace("'", '')
+    text = re.sub(r'\([^)]*\)', '', text)
+    text = re.sub(r'\[[^\]]*\]', '', text)
+    text = re.sub(r'feat\.?|ft\.?|featuring', '', text, flags=re.IGNORECASE)
+    text = re.sub(r'[^\w\s]', ' ', text)
+    return ' '.join(text.split()).strip()
+
+
+def bench_clean(rounds=ROUNDS):
+    """clean_text over every title and credit in the library, as the library
+    load and a refresh run clean them: the old passes against the compiled
+    ones, first with nothing cached and then again.
+    """
+    import library
+    from answers import CLEAN_CACHE_SIZE, clean_text
+
+    df = library.load_songs()
+    texts = list(df['Song'].astype(str)) + list(df['Artist'].astype(str))
+    # Both as stored and lowercased, the two ways callers hand them over
+    texts += [text.lower() for text in texts]
+    assert [clean_text(text) for text in texts] == [_old_clean_text(text) for text in texts]
+
+    runs = max(1, rounds // 400)
+    old = timeit.timeit(lambda: [_old_clean_text(text) for text in texts], number=runs)
+    compiled = timeit.timeit(lambda: (clean_text.cache_clear(),
+                                      [clean_text(text) for text in texts]), number=runs)
+    # Names seen again while they're still cached: a working set that fits
+    again = texts[:CLEAN_CACHE_SIZE // 2]
+    [clean_text(text) for text in again]
+    cached = timeit.timeit(lambda: [clean_text(text) for text in again], number=runs)
+    logger.info(f'{len(texts)} titles and credits, {runs} runs each; same output')
+    report('old passes', old, runs * len(texts))
+    report('compiled', compiled, runs * len(texts))
+    report('compiled, seen again', cached, runs * len(again))
+
+
+def _scan_suggest(leads, typed, limit):
+    """/suggest without an index: every lead, every word, on every keystroke."""
+    from answers import clean_text
+
+    query = clean_text(typed.lower())
+    if len(query) < 2:
+        return []
+    first, later = [], []
+    for rank, (lead, name) in enumerate(leads):
+        if lead.startswith(query):
+            first.append((rank, name))
+        elif any(lead[at + 1:].startswith(query) for at, char in enumerate(lead) if char == ' '):
+            later.append((rank, name))
+    return [name for _, name in sorted(first) + sorted(later)][:limit]
+
+
+def bench_suggest(rounds=ROUNDS):
+    """One /suggest lookup as the player types each letter of an artist's
+    name: a scan of every lead against the sorted-key index, and what building
+    the index adds to a library load.
+    """
+    import app as quiz
+    from artist_index import SUGGESTION_LIMIT, ArtistIndex
+    from artists import primary_artist
+
+    songs = quiz.song_data
+    index = quiz.loaded.artists
+    build = min(timeit.repeat(lambda: ArtistIndex(songs), number=1, repeat=5))
+    # Every lead, most songs first, shown as it's first credited
+    counts, shown = Counter(), {}
+    for lead, credit in zip(songs.column('ArtistAnswer'), songs.column('Artist')):
+        if lead:
+            counts[lead] += 1
+            shown.setdefault(lead, primary_artist(credit))
+    leads = [(lead, shown[lead]) for lead in sorted(counts, key=lambda lead: (-counts[lead], lead))]
+
+    rng = random.Random(7)
+    typed = []
+    for name in rng.sample(index.names, min(100, len(index))):
+        typed += [name[:end] for end in range(2, min(len(name), 8) + 1)]
+    assert [index.suggest(text) for text in typed] == \
+        [_scan_suggest(leads, text, SUGGESTION_LIMIT) for text in typed]
+
+    runs = max(1, rounds // 400)
+    scan = timeit.timeit(lambda: [_scan_suggest(leads, text, SUGGESTION_LIMIT) for text in typed],
+                         number=runs)
+    indexed = timeit.timeit(lambda: [index.suggest(text) for text in typed], number=runs)
+    client = quiz.app.test_client()
+    served = timeit.timeit(lambda: [client.get('/suggest', query_string={'q': text})
+                                    for text in typed[:200]], number=runs)
+    logger.info(f'{len(index)} artists, {len(index.keys)} keys, built in {build * 1000:.1f} ms; '
+                f'{len(typed)} prefixes, {runs} runs each; same suggestions')
+    report('scan every lead', scan, runs * len(typed))
+    report('sorted-key index', indexed, runs * len(typed))
+    report('GET /suggest', served, runs * min(200, len(typed)))
+
+
+BENCHMARKS = {
+    'answers': bench_answers,
+    'artists': bench_artists,
+    'clean': bench_clean,
+    'filter': bench_filter,
+    'indexes': bench_indexes,
+    'leaderboard': bench_leaderboard,
+    'memory': bench_memory,
+    'sample': bench_sample,
+    'standings': bench_standings,
+    'similarity': bench_similarity,
+    'startup': bench_startup,
+    'suggest': bench_suggest,
+    'upsert': bench_upsert,
+    'weights': bench_weights,
+    'workers': bench_workers,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('benchmarks', nargs='*', metavar='name',
+                        help=f'Any of {", ".join(sorted(BENCHMARKS))} (default: all)')
+    parser.add_argument('--rounds', type=int, default=ROUNDS)
+    args = parser.parse_args()
+
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f'unknown benchmark: {", ".join(sorted(unknown))}')
+
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        logger.info(f'\n== {name} ==')
+        BENCHMARKS[name](args.rounds)
+
+
+if __name__ == '__main__':
+    main()
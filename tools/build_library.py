@@ -20,6 +20,8 @@ sys.path.insert(0, __import__('os').path.dirname(
     __import__('os').path.dirname(__import__('os').path.abspath(__file__))))
 
 import library  # noqa: E402
+import migrations  # noqa: E402
+import quiz_library  # noqa: E402
 from tools.wikipedia_charts import fetch_year_end  # noqa: E402
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO,
@@ -145,7 +147,7 @@ def build(years, with_genres=True, dry_run=False, replace=False):
         logger.info('\nDry run - nothing written')
         return rows
 
-    library.init_songs_table()
+    migrations.migrate()
 
     if replace:
         # Songs are keyed on (song, artist), so a corrected artist inserts a new
@@ -154,8 +156,7 @@ def build(years, with_genres=True, dry_run=False, replace=False):
         # which have no year_end_rank, are left alone.
         with library.get_db() as conn:
             cursor = conn.cursor()
-            cursor.execute('DELETE FROM songs WHERE year_end_rank IS NOT NULL')
-            removed = cursor.rowcount
+            removed = library.delete_songs(cursor, 'year_end_rank IS NOT NULL')
             conn.commit()
         logger.info(f'Replaced: cleared {removed} existing year-end songs')
 
@@ -163,6 +164,13 @@ def build(years, with_genres=True, dry_run=False, replace=False):
     logger.info(f'\nWrote {written} songs to '
                 f"{'Postgres' if library.USE_POSTGRES else library.SQLITE_PATH}")
 
+    if library.USE_POSTGRES:
+        # What the app boots from; it reads the table itself if this fails
+        try:
+            quiz_library.publish_snapshot()
+        except Exception as e:
+            logger.warning(f'Could not store a library snapshot: {e}')
+
     if failures:
         logger.warning(f'Years that failed and are missing: {failures}')
 
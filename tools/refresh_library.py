@@ -2,12 +2,13 @@
 
     python -m tools.refresh_library
 
-Three independent steps. Each one logs and moves on if it fails, so a dead
-source can't take the others down. Nothing here ever deletes a song.
+Independent steps. Each one logs and moves on if it fails, so a dead source
+can't take the others down. Nothing here ever deletes a song.
 
   1. Add this week's Billboard Hot 100 entries
   2. Resolve audio for songs that don't have a preview yet
   3. Fill in genres for artists we haven't looked up
+  4. Store a snapshot of the result for the app to boot from (Postgres only)
 
 Every January, re-run tools/build_library.py for the year just finished: the
 year-end list is the authoritative ranking and supersedes the weekly entries.
@@ -16,12 +17,19 @@ import argparse
 import logging
 import os
 import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date, datetime
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import library  # noqa: E402
+import migrations  # noqa: E402
+import previews  # noqa: E402
+import quiz_library  # noqa: E402
 from previews import EXPIRING_SOURCES, LookupFailed, find_preview  # noqa: E402
+from throttle import ProviderGate  # noqa: E402
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(message)s')
 logger = logging.getLogger(__name__)
@@ -29,6 +37,14 @@ logger = logging.getLogger(__name__)
 PREVIEW_BATCH = 500     # Songs to resolve audio for per run
 GENRE_BATCH = 200       # Artists to look up per run
 COMMIT_EVERY = 50       # Save partial progress this often
+AUDIO_WORKERS = 8       # Songs being resolved at once
+
+# Per provider: calls in flight at once, and calls started per second. Each
+# gate halves its rate on a 429 or timeout and recovers as calls succeed.
+PROVIDER_LIMITS = {
+    'deezer': (4, 8.0),     # Deezer allows 50 calls per 5 seconds
+    'itunes': (2, 0.3),     # Apple asks for about 20 a minute
+}
 
 
 def add_current_chart():
@@ -56,35 +72,66 @@ def add_current_chart():
     return written
 
 
+# The refresh job's reads and writes, each served by an index (see migrations)
+UNCHECKED_SONGS = 'SELECT song, artist FROM songs WHERE preview_checked_at IS NULL LIMIT ?'
+LEAST_RECENTLY_CHECKED = ('SELECT song, artist FROM songs WHERE preview_checked_at IS NOT NULL '
+                          'ORDER BY preview_checked_at ASC LIMIT ?')
+ARTISTS_NEEDING_GENRES = ("SELECT DISTINCT artist FROM songs "
+                          "WHERE genres IS NULL OR genres = '' LIMIT ?")
+SET_ARTIST_GENRES = ('UPDATE songs SET genres = ?, updated_at = ?, generation = ? '
+                     'WHERE artist = ?')
+
+
 def _songs_needing_audio(limit):
     with library.get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute(library.sql(
-            'SELECT song, artist FROM songs WHERE preview_checked_at IS NULL LIMIT ?'
-        ), (limit,))
+        cursor.execute(library.sql(UNCHECKED_SONGS), (limit,))
         rows = cursor.fetchall()
 
         if len(rows) < limit:
             # Top the batch up with the least recently checked
-            cursor.execute(library.sql(
-                'SELECT song, artist FROM songs WHERE preview_checked_at IS NOT NULL '
-                'ORDER BY preview_checked_at ASC LIMIT ?'
-            ), (limit - len(rows),))
+            cursor.execute(library.sql(LEAST_RECENTLY_CHECKED), (limit - len(rows),))
             rows += cursor.fetchall()
 
     return rows
 
 
-def resolve_audio(limit=PREVIEW_BATCH):
-    """Find and store a preview for songs that don't have one."""
+def _provider_gates():
+    return {source: ProviderGate(source, concurrency, rate)
+            for source, (concurrency, rate) in PROVIDER_LIMITS.items()}
+
+
+def _throughput_report(resolved_by, gates, elapsed):
+    """Log songs/sec per provider, plus how each gate's rate held up."""
+    elapsed = max(elapsed, 1e-9)
+    total = sum(resolved_by.values())
+    logger.info(f'  {total} songs in {elapsed:.1f}s ({total / elapsed:.2f} songs/sec)')
+    for source in sorted(set(gates) | set(resolved_by)):
+        line = (f'    {source}: {resolved_by[source]} songs '
+                f'({resolved_by[source] / elapsed:.2f} songs/sec)')
+        gate = gates.get(source)
+        if gate is not None:
+            s = gate.stats()
+            line += (f', {s["calls"]} calls, {s["throttled"]} throttled, '
+                     f'ending at {s["rate"]} calls/sec')
+        logger.info(line)
+
+
+def resolve_audio(limit=PREVIEW_BATCH, workers=AUDIO_WORKERS):
+    """Find and store a preview for songs that don't have one.
+
+    Songs are looked up `workers` at a time, each provider held to its
+    PROVIDER_LIMITS. Results are written from this thread only, in batches.
+    """
     candidates = _songs_needing_audio(limit)
     if not candidates:
         logger.info('Every song already has a resolved preview')
         return 0
 
-    logger.info(f'Resolving audio for {len(candidates)} songs')
+    logger.info(f'Resolving audio for {len(candidates)} songs with {workers} workers')
     checked_at = datetime.now()
     pending, found, checked, unreachable = [], 0, 0, 0
+    resolved_by = Counter()
 
     def flush():
         if pending:
@@ -92,50 +139,77 @@ def resolve_audio(limit=PREVIEW_BATCH):
             pending.clear()
             logger.info(f'  {checked}/{len(candidates)} checked, {found} playable')
 
-    for song, artist in candidates:
+    gates = _provider_gates()
+    previews.gates.update(gates)
+    started = time.monotonic()
+    pool = ThreadPoolExecutor(max_workers=max(workers, 1),
+                              thread_name_prefix='resolve-audio')
+
+    def stop():
+        # On an interrupt, drop what hasn't started and keep what has finished
+        pool.shutdown(wait=True, cancel_futures=True)
+        for source in gates:
+            previews.gates.pop(source, None)
+
+    try:
+        lookups = {pool.submit(find_preview, song, artist): (song, artist)
+                   for song, artist in candidates}
+        for lookup in as_completed(lookups):
+            song, artist = lookups[lookup]
+            try:
+                preview, source, track_id = lookup.result()
+            except LookupFailed as e:
+                # Leave it unchecked so a later run retries. Recording this as
+                # "no preview" would blacklist the song over a network blip.
+                unreachable += 1
+                logger.warning(f'  skipped {artist} - {song}: {e}')
+                continue
+
+            if preview:
+                found += 1
+            checked += 1
+            resolved_by[source or 'none'] += 1
+            pending.append({
+                'song': song,
+                'artist': artist,
+                # Deezer links expire within minutes, so only the id is worth
+                # keeping - the app fetches a fresh link when the song comes up.
+                'preview_url': None if source in EXPIRING_SOURCES else preview,
+                'preview_source': source,
+                'preview_id': track_id,
+                'preview_checked_at': checked_at,
+                'playable': bool(preview),
+                # A fresh verdict supersedes failures seen at play time
+                'play_failures': 0,
+            })
+
+            # Write as we go. A long run that only saved at the end would bank
+            # nothing if it were interrupted, and the app couldn't use any of it
+            # until the whole library was done.
+            if len(pending) >= COMMIT_EVERY:
+                flush()
+    except BaseException:
+        stop()
+        # Bank what finished, but a write failing too - the same outage, say -
+        # mustn't hide why the run stopped
         try:
-            preview, source, track_id = find_preview(song, artist)
-        except LookupFailed as e:
-            # Leave it unchecked so a later run retries. Recording this as
-            # "no preview" would blacklist the song over a network blip.
-            unreachable += 1
-            logger.warning(f'  skipped {artist} - {song}: {e}')
-            continue
-
-        if preview:
-            found += 1
-        checked += 1
-        pending.append({
-            'song': song,
-            'artist': artist,
-            # Deezer links expire within minutes, so only the id is worth
-            # keeping - the app fetches a fresh link when the song comes up.
-            'preview_url': None if source in EXPIRING_SOURCES else preview,
-            'preview_source': source,
-            'preview_id': track_id,
-            'preview_checked_at': checked_at,
-            'playable': bool(preview),
-        })
-
-        # Write as we go. A long run that only saved at the end would bank
-        # nothing if it were interrupted, and the app couldn't use any of it
-        # until the whole library was done.
-        if len(pending) >= COMMIT_EVERY:
             flush()
-
+        except Exception as e:
+            logger.error(f'  could not write the last {len(pending)} results: {e}')
+        raise
+    stop()
     flush()
+
     logger.info(f'  {found} of {checked} checked are playable'
                 + (f'; {unreachable} skipped as unreachable' if unreachable else ''))
+    _throughput_report(resolved_by, gates, time.monotonic() - started)
     return found
 
 
 def _artists_needing_genres(limit):
     with library.get_db() as conn:
         cursor = conn.cursor()
-        cursor.execute(library.sql(
-            "SELECT DISTINCT artist FROM songs "
-            "WHERE genres IS NULL OR genres = '' LIMIT ?"
-        ), (limit,))
+        cursor.execute(library.sql(ARTISTS_NEEDING_GENRES), (limit,))
         return [row[0] for row in cursor.fetchall()]
 
 
@@ -162,10 +236,9 @@ def fill_genres(limit=GENRE_BATCH):
         found += 1
         with library.get_db() as conn:
             cursor = conn.cursor()
-            cursor.execute(
-                library.sql('UPDATE songs SET genres = ? WHERE artist = ?'),
-                (','.join(genres), artist),
-            )
+            cursor.execute(library.sql(SET_ARTIST_GENRES),
+                           (','.join(genres), datetime.now(), library.next_generation(cursor),
+                            artist))
             conn.commit()
 
     logger.info(f'  resolved {found} of {len(artists)} artists')
@@ -194,17 +267,21 @@ def main():
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('--preview-batch', type=int, default=PREVIEW_BATCH)
     parser.add_argument('--genre-batch', type=int, default=GENRE_BATCH)
+    parser.add_argument('--workers', type=int, default=AUDIO_WORKERS,
+                        help='songs to resolve audio for at once')
     parser.add_argument('--skip-chart', action='store_true')
     args = parser.parse_args()
 
     logger.info(f'Refreshing the song library - {date.today()}')
-    library.init_songs_table()
+    migrations.migrate()
 
     steps = []
     if not args.skip_chart:
         steps.append(('current chart', lambda: add_current_chart()))
-    steps.append(('audio', lambda: resolve_audio(args.preview_batch)))
+    steps.append(('audio', lambda: resolve_audio(args.preview_batch, args.workers)))
     steps.append(('genres', lambda: fill_genres(args.genre_batch)))
+    if library.USE_POSTGRES:
+        steps.append(('snapshot', quiz_library.publish_snapshot))
 
     for name, step in steps:
         try:
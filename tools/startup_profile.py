@@ -0,0 +1,82 @@
+"""Where a worker's startup goes, phase by phase.
+
+    python -m tools.startup_profile            # boot as a worker would now
+    python -m tools.startup_profile --cold     # as the first worker, with no shared snapshot
+
+Imports the app's heavier dependencies one at a time, then the app, then runs
+app.start() and serves one page - the order a gunicorn worker goes through.
+An import's time is only what it added: anything an earlier step pulled in is
+already paid for. Runs against whichever library the app loads; beyond what a
+worker booting would write, nothing is.
+"""
+import argparse
+import importlib
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+logging.basicConfig(stream=sys.stdout, level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+# Third-party first, then the app's own modules in the order it imports them
+IMPORTS = ('numpy', 'pandas', 'flask', 'deezer', 'library', 'quiz_library',
+           'song_index', 'previews', 'app')
+
+
+def report(name, seconds):
+    logger.info(f'  {name:<28} {seconds * 1000:10.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cold', action='store_true',
+                        help='Use an empty snapshot directory, so the library is built here')
+    args = parser.parse_args()
+    if args.cold:
+        os.environ['LIBRARY_SNAPSHOT_DIR'] = tempfile.mkdtemp()
+
+    logging.disable(logging.INFO)
+    imports = {}
+    for name in IMPORTS:
+        started = time.perf_counter()
+        importlib.import_module(name)
+        imports[name] = time.perf_counter() - started
+    app = sys.modules['app']
+    opened = app.loaded is not None
+
+    started = time.perf_counter()
+    app.start()
+    booted = time.perf_counter() - started
+
+    client = app.app.test_client()
+    started = time.perf_counter()
+    status = client.get('/').status_code
+    first = time.perf_counter() - started
+    started = time.perf_counter()
+    client.get('/')
+    second = time.perf_counter() - started
+    logging.disable(logging.NOTSET)
+
+    logger.info('import')
+    for name, seconds in imports.items():
+        report(name, seconds)
+    if opened:
+        logger.warning('  importing app loaded the library; it should wait for start()')
+    logger.info('app.start()')
+    for phase, seconds in app.startup_timings.items():
+        report(phase, seconds)
+    logger.info(f'first page ({status})')
+    report('first request', first)
+    report('next request', second)
+    logger.info(f'{len(app.loaded.data) if app.loaded.data is not None else 0} songs; '
+                f'{(sum(imports.values()) + booted + first) * 1000:.0f} ms '
+                f'from nothing to a served page')
+
+
+if __name__ == '__main__':
+    main()